@@ -0,0 +1,85 @@
+# Memory behaviour of the frame loop
+#
+# The runtime reads, resizes and stores detections in buffers that are
+# reused from frame to frame, so in the steady state a frame should not
+# allocate anything frame-sized and the garbage collector should hardly
+# run. AllocationMonitor checks that: it counts garbage collections and
+# the time spent in them through gc.callbacks and reports the peak resident
+# set size. With trace=True it also uses tracemalloc to measure how much
+# memory was allocated while each frame was processed, by every thread.
+# Tracing slows every allocation down, so it is off by default.
+import gc
+import resource
+import time
+import tracemalloc
+
+# Allocations of at least this many bytes in one frame count as a frame
+# sized allocation, a 1000x700 grayscale frame is 700 KB
+FRAME_SIZED = 64 * 1024
+
+
+class AllocationMonitor:
+    def __init__(self, trace=False, warmup=10):
+        self.trace = trace
+        self.warmup = warmup
+
+        # Garbage collections per generation and time spent in them
+        self.collections = [0, 0, 0]
+        self.gc_seconds = 0.0
+        self.gc_started = 0.0
+        gc.callbacks.append(self._on_gc)
+
+        # Bytes allocated per frame once the warm-up frames are over
+        self.frames = 0
+        self.frame_start = 0
+        self.traced_frames = 0
+        self.total_bytes = 0
+        self.max_bytes = 0
+        self.large_frames = 0
+        if trace:
+            tracemalloc.start()
+
+    def _on_gc(self, phase, info):
+        if phase == "start":
+            self.gc_started = time.perf_counter()
+        else:
+            self.gc_seconds += time.perf_counter() - self.gc_started
+            self.collections[info["generation"]] += 1
+
+    def start_frame(self):
+        if self.trace:
+            tracemalloc.reset_peak()
+            self.frame_start = tracemalloc.get_traced_memory()[0]
+
+    # The highest memory use above the start of the frame is what the
+    # frame allocated on top of what it kept
+    def end_frame(self):
+        self.frames += 1
+        if not self.trace or self.frames <= self.warmup:
+            return
+        allocated = tracemalloc.get_traced_memory()[1] - self.frame_start
+        self.traced_frames += 1
+        self.total_bytes += allocated
+        self.max_bytes = max(self.max_bytes, allocated)
+        if allocated >= FRAME_SIZED:
+            self.large_frames += 1
+
+    def stats(self):
+        stats = {
+            "frames": self.frames,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            "collections": list(self.collections),
+            "gc_ms": self.gc_seconds * 1000.0,
+        }
+        if self.traced_frames:
+            stats["avg_frame_kb"] = self.total_bytes / self.traced_frames / 1024.0
+            stats["max_frame_kb"] = self.max_bytes / 1024.0
+            stats["large_frames"] = self.large_frames
+            stats["traced_frames"] = self.traced_frames
+        return stats
+
+    def close(self):
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+        if self.trace:
+            tracemalloc.stop()
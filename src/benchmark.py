@@ -0,0 +1,272 @@
+# Offline replay benchmark of the detection and gate pairing path
+#
+# Feeds the bundled test photos (and optionally video files) through the
+# same resize, detection and pairing stages raspiaruco.py uses, without a
+# serial port or any GUI. Reports per-stage timings, frames per second and
+# whether each photo gives the result its filename describes, and writes
+# everything to a JSON file.
+#
+#   python src/benchmark.py [paths ...] [--video FILE] [--output FILE]
+import argparse
+import glob
+import json
+import os
+import re
+import statistics
+import time
+
+import cv2
+
+from detection import create_dictionary, create_parameters, add_detector_arguments, create_detector, prepare_frame
+from gates import Detections, frame_commands
+from tuning import PRESETS
+
+TESTING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testing")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+# Work out the expected result from a scenario photo's filename, e.g.
+# "gate target N" -> steer with 'N', "nogate" -> no gate,
+# "Detected Left Marker ID 0" -> marker 0 in view, "5 markers" -> 5 markers
+def expected_result(filename):
+    name = os.path.splitext(os.path.basename(filename))[0].lower()
+    expected = {}
+
+    match = re.search(r"gate target ([a-z])\b", name)
+    if match:
+        expected["command"] = match.group(1).upper()
+        expected["gate"] = True
+    elif "nogate" in name or "gate not detected" in name:
+        expected["gate"] = False
+    elif "gate" in name and ("detected" in name or "targeted" in name):
+        expected["gate"] = True
+
+    match = re.search(r"marker id (\d+)", name)
+    if match:
+        expected["marker_id"] = int(match.group(1))
+
+    match = re.search(r"(\d+) markers", name)
+    if match:
+        expected["markers"] = int(match.group(1))
+
+    return expected
+
+
+# Compare one frame's detections and commands with the expected result
+def check_result(expected, detections, commands, result):
+    failures = []
+    gate = result is not None and result.target is not None
+
+    if "gate" in expected and gate != expected["gate"]:
+        failures.append("gate %s, expected %s" % (gate, expected["gate"]))
+    if "command" in expected and expected["command"] not in commands:
+        failures.append("commands %s, expected %s" % ("".join(commands), expected["command"]))
+    if "marker_id" in expected and expected["marker_id"] not in detections.ids.tolist():
+        failures.append("marker %d not detected" % expected["marker_id"])
+    if "markers" in expected and len(detections) != expected["markers"]:
+        failures.append("%d markers, expected %d" % (len(detections), expected["markers"]))
+
+    return failures
+
+
+# Run one frame through the pipeline, timing each stage in milliseconds
+def process_frame(frame, detect, args, prepare=True):
+    t0 = time.perf_counter()
+    if prepare:
+        frame = prepare_frame(frame, args)
+    t1 = time.perf_counter()
+    (corners, ids, rejected) = detect(frame)
+    t2 = time.perf_counter()
+    detections = Detections.from_aruco(corners, ids)
+    commands, result = frame_commands(detections, frame.shape[1])
+    t3 = time.perf_counter()
+
+    timings = {
+        "resize": (t1 - t0) * 1000.0,
+        "detect": (t2 - t1) * 1000.0,
+        "pair": (t3 - t2) * 1000.0,
+    }
+    return detections, commands, result, timings
+
+
+# Mean, median and maximum of each stage over a list of frame timings
+def summarise(timings):
+    summary = {}
+    for stage in ("resize", "detect", "pair"):
+        values = [t[stage] for t in timings]
+        if values:
+            summary[stage] = {
+                "mean_ms": statistics.mean(values),
+                "median_ms": statistics.median(values),
+                "max_ms": max(values),
+            }
+    total = sum(sum(t.values()) for t in timings)
+    summary["frames"] = len(timings)
+    summary["fps"] = len(timings) / (total / 1000.0) if total > 0 else 0.0
+    return summary
+
+
+def find_images(paths):
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    images.append(os.path.join(path, name))
+        else:
+            images.extend(sorted(glob.glob(path)))
+    return images
+
+
+def run_image(filename, detect, args):
+    frame = cv2.imread(filename)
+    if frame is None:
+        print("[INFO] Cannot read image: " + filename)
+        return None
+
+    # Repeat each photo to get stable timings, the result of the
+    # last run is the one checked
+    timings = []
+    for _ in range(args.repeat):
+        detections, commands, result, frameTimings = process_frame(frame, detect, args)
+        timings.append(frameTimings)
+
+    expected = expected_result(filename)
+    failures = check_result(expected, detections, commands, result)
+
+    status = "PASS" if not failures else "FAIL"
+    if not expected:
+        status = "----"
+    print("[%s] %-60s %-8s %s" % (status, os.path.basename(filename)[:60], "".join(commands), "; ".join(failures)))
+
+    return {
+        "file": os.path.relpath(filename),
+        "ids": detections.ids.tolist(),
+        "sizes": detections.sizes.tolist(),
+        "commands": commands,
+        "target": result.target if result is not None else None,
+        "expected": expected,
+        "passed": not failures if expected else None,
+        "failures": failures,
+        "timings": summarise(timings),
+    }
+
+
+def run_video(filename, detect, args):
+    cap = cv2.VideoCapture(filename)
+    if not cap.isOpened():
+        print("[INFO] Cannot open video: " + filename)
+        return None
+
+    timings = []
+    commandCounts = {}
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        detections, commands, result, frameTimings = process_frame(frame, detect, args)
+        timings.append(frameTimings)
+        for command in commands:
+            commandCounts[command] = commandCounts.get(command, 0) + 1
+    cap.release()
+
+    summary = summarise(timings)
+    print("[INFO] %s: %d frames, %.1f fps" % (filename, summary["frames"], summary["fps"]))
+    return {"file": filename, "commands": commandCounts, "timings": summary}
+
+
+# Run every photo and video through the pipeline for the given options
+def run_suite(args):
+    arucoDict = create_dictionary()
+
+    # Photos are unrelated to each other, so each one gets a fresh
+    # detector and parameters, and no tracking or tuning state
+    # carries over between them
+    imageResults = []
+    for filename in find_images(args.paths):
+        detect = create_detector(arucoDict, create_parameters(), args)
+        result = run_image(filename, detect, args)
+        if result is not None:
+            imageResults.append(result)
+
+    videoResults = []
+    for filename in args.video:
+        detect = create_detector(arucoDict, create_parameters(), args)
+        result = run_video(filename, detect, args)
+        if result is not None:
+            videoResults.append(result)
+
+    checked = [r for r in imageResults if r["passed"] is not None]
+    passed = sum(1 for r in checked if r["passed"])
+    allTimings = []
+    for r in imageResults:
+        allTimings.append({stage: r["timings"][stage]["mean_ms"] for stage in ("resize", "detect", "pair")})
+    summary = summarise(allTimings)
+    summary["passed"] = passed
+    summary["checked"] = len(checked)
+    summary["markers"] = sum(len(r["ids"]) for r in imageResults)
+
+    print("[INFO] Images: %d, passed: %d/%d, markers detected: %d" % (
+        len(imageResults), passed, len(checked), summary["markers"]))
+    for stage in ("resize", "detect", "pair"):
+        if stage in summary:
+            print("[INFO] %-6s mean %.2f ms, median %.2f ms, max %.2f ms" % (
+                stage, summary[stage]["mean_ms"], summary[stage]["median_ms"], summary[stage]["max_ms"]))
+    print("[INFO] Throughput: %.1f fps" % summary["fps"])
+
+    return {
+        "options": dict(vars(args)),
+        "summary": summary,
+        "images": imageResults,
+        "videos": videoResults,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the detection and gate pairing path")
+    parser.add_argument("paths", nargs="*",
+        default=[os.path.join(TESTING_DIR, "card-detection"), os.path.join(TESTING_DIR, "gates-scenario-detection")],
+        help="image files, directories or globs (default: the bundled test photos)")
+    parser.add_argument("--video", action="append", default=[],
+        help="video file to run through the pipeline, can be repeated")
+    parser.add_argument("--repeat", type=int, default=5,
+        help="times each photo is processed for timing (default 5)")
+    parser.add_argument("--output", default="benchmark.json",
+        help="JSON file to write the results to (default benchmark.json)")
+    parser.add_argument("--compare-presets", action="store_true",
+        help="run the suite with the default parameters and every preset and compare cost and recall")
+    add_detector_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.compare_presets:
+        results = run_suite(args)
+    else:
+        # Recall is relative to the most markers any configuration found
+        runs = {}
+        for preset in [None] + sorted(PRESETS):
+            args.preset = preset
+            print("[INFO] Preset: " + (preset or "default"))
+            runs[preset or "default"] = run_suite(args)
+
+        mostMarkers = max(max(r["summary"]["markers"] for r in runs.values()), 1)
+        comparison = {}
+        print("[INFO] %-10s %10s %8s %8s" % ("preset", "detect ms", "recall", "passed"))
+        for name, run in runs.items():
+            summary = run["summary"]
+            comparison[name] = {
+                "detect_mean_ms": summary["detect"]["mean_ms"] if "detect" in summary else 0.0,
+                "recall": summary["markers"] / mostMarkers,
+                "passed": summary["passed"],
+                "checked": summary["checked"],
+            }
+            print("[INFO] %-10s %10.2f %8.2f %5d/%d" % (name, comparison[name]["detect_mean_ms"],
+                comparison[name]["recall"], summary["passed"], summary["checked"]))
+        results = {"comparison": comparison, "runs": runs}
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("[INFO] Results written to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
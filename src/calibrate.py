@@ -0,0 +1,125 @@
+# Camera calibration tool
+#
+# Finds a printed chessboard in photos or in the live camera stream and
+# writes the camera intrinsics to a JSON file, which raspiaruco.py and
+# detectarucovideo.py load with --calibration to undistort marker corners.
+# Calibrate at the resolution the robot captures at; frames resized after
+# capture are handled by scaling.
+#
+#   python src/calibrate.py photos/ [--board 9x6] [--square 25]
+#   python src/calibrate.py --camera 0 [--views 20]
+import argparse
+import sys
+import time
+
+import cv2
+
+from benchmark import find_images
+from calibration import board_points, calibrate, find_board
+from capture import FrameCapture, parse_size
+
+
+# Board corners of every readable photo that shows the whole board
+def views_from_images(paths, board):
+    views = []
+    size = None
+    for filename in find_images(paths):
+        image = cv2.imread(filename)
+        if image is None:
+            print("[INFO] Cannot read image: " + filename)
+            continue
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if size is not None and gray.shape[::-1] != size:
+            print("[INFO] Skipping %s, size differs from the first image" % filename)
+            continue
+
+        corners = find_board(gray, board)
+        print("[INFO] %s: %s" % (filename, "board found" if corners is not None else "no board"))
+        if corners is not None:
+            size = gray.shape[::-1]
+            views.append(corners)
+    return views, size
+
+
+# Board corners from the live camera, at most one view per interval so
+# the board can be moved between views
+def views_from_camera(index, board, count, interval, size, headless):
+    cam = FrameCapture(index, size=size)
+    if not cam.isOpened():
+        print("[INFO] Cannot open camera")
+        sys.exit(1)
+
+    views = []
+    imageSize = None
+    lastView = 0.0
+    while len(views) < count:
+        ok, frame = cam.read()
+        if not ok:
+            break
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+        now = time.monotonic()
+        corners = None
+        if now - lastView >= interval:
+            corners = find_board(gray, board)
+        if corners is not None:
+            imageSize = gray.shape[::-1]
+            views.append(corners)
+            lastView = now
+            print("[INFO] View %d of %d captured" % (len(views), count))
+
+        if not headless:
+            if corners is not None:
+                cv2.drawChessboardCorners(frame, board, corners, True)
+            cv2.imshow("Calibration", frame)
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                break
+
+    cam.release()
+    if not headless:
+        cv2.destroyAllWindows()
+    return views, imageSize
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the camera from views of a chessboard")
+    parser.add_argument("paths", nargs="*",
+        help="photos, directories or globs of the chessboard")
+    parser.add_argument("--camera", type=int, default=None,
+        help="capture the views from this camera index instead of photos")
+    parser.add_argument("--board", type=parse_size, default=(9, 6), metavar="COLSxROWS",
+        help="inner corners of the chessboard (default 9x6)")
+    parser.add_argument("--square", type=float, default=25.0,
+        help="side of one chessboard square in mm (default 25)")
+    parser.add_argument("--views", type=int, default=20,
+        help="views to capture from the camera (default 20)")
+    parser.add_argument("--interval", type=float, default=1.0,
+        help="minimum seconds between camera views (default 1)")
+    parser.add_argument("--capture-size", type=parse_size, default=None, metavar="WxH",
+        help="camera resolution to request, use the robot's capture resolution")
+    parser.add_argument("--headless", action="store_true",
+        help="never open a window")
+    parser.add_argument("--output", default="calibration.json",
+        help="JSON file to write the intrinsics to (default calibration.json)")
+    args = parser.parse_args()
+
+    if args.camera is not None:
+        views, size = views_from_camera(args.camera, args.board, args.views, args.interval, args.capture_size, args.headless)
+    elif args.paths:
+        views, size = views_from_images(args.paths, args.board)
+    else:
+        parser.error("give chessboard photos or --camera")
+
+    if len(views) < 3:
+        print("[INFO] Need at least 3 views of the board, found %d" % len(views))
+        sys.exit(1)
+
+    objectPoints = [board_points(args.board, args.square)] * len(views)
+    camera, rms = calibrate(objectPoints, views, size)
+    camera.save(args.output, rms)
+    print("[INFO] Calibrated from %d views at %dx%d, RMS reprojection error %.3f px" % (len(views), size[0], size[1], rms))
+    print("[INFO] Intrinsics written to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Camera intrinsics and point-only undistortion
+#
+# Wide-angle lenses bend straight lines near the frame edges, so targets
+# computed from raw marker corners steer the robot off towards the edges.
+# CameraModel holds the intrinsics written by calibrate.py and moves the
+# detected corners to where an ideal pinhole camera would have seen them.
+# Only the handful of corner points are undistorted, never whole frames.
+import json
+
+import cv2
+import numpy as np
+
+
+class CameraModel:
+    def __init__(self, camera_matrix, dist_coeffs, image_size):
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64).reshape(3, 3)
+        self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64).reshape(-1)
+        self.image_size = tuple(int(v) for v in image_size)
+
+        # Scale factors from frame pixels to calibration pixels, per frame
+        # size, so resized frames cost nothing extra
+        self.scales = {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["camera_matrix"], data["dist_coeffs"], data["image_size"])
+
+    def save(self, path, rms=None):
+        data = {
+            "camera_matrix": self.camera_matrix.tolist(),
+            "dist_coeffs": self.dist_coeffs.tolist(),
+            "image_size": list(self.image_size),
+        }
+        if rms is not None:
+            data["rms"] = rms
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+
+    def scale(self, width, height):
+        scale = self.scales.get((width, height))
+        if scale is None:
+            scale = self.scales[(width, height)] = np.array(
+                [self.image_size[0] / width, self.image_size[1] / height], dtype=np.float64)
+        return scale
+
+    # Undistort marker corners found in a frame of the given size, which
+    # may be a resized copy of the calibration resolution. Returns an
+    # (N, 4, 2) array in the same frame's pixels.
+    def undistort_corners(self, corners, width, height):
+        if len(corners) == 0:
+            return corners
+        scale = self.scale(width, height)
+        points = np.concatenate([c.reshape(-1, 2) for c in corners]).astype(np.float64) * scale
+        points = cv2.undistortPoints(points.reshape(-1, 1, 2), self.camera_matrix, self.dist_coeffs,
+            P=self.camera_matrix)
+        return (points.reshape(-1, 4, 2) / scale).astype(np.float32)
+
+
+# Wraps a detect function and undistorts the corners it returns, so the
+# gate logic only ever sees undistorted points
+class CornerUndistorter:
+    def __init__(self, detect, camera):
+        self.detect = detect
+        self.camera = camera
+
+    def __call__(self, frame):
+        corners, ids, rejected = self.detect(frame)
+        if ids is None or len(corners) == 0:
+            return corners, ids, rejected
+        height, width = frame.shape[:2]
+        undistorted = self.camera.undistort_corners(corners, width, height)
+        return tuple(c.reshape(1, 4, 2) for c in undistorted), ids, rejected
+
+
+# Calibrate from the board points and the matching image points of a
+# number of views of the same size. Returns (CameraModel, rms).
+def calibrate(objectPoints, imagePoints, image_size):
+    rms, camera_matrix, dist_coeffs, _, _ = cv2.calibrateCamera(
+        objectPoints, imagePoints, image_size, None, None)
+    return CameraModel(camera_matrix, dist_coeffs, image_size), rms
+
+
+# Chessboard corner positions of one view, board is the number of inner
+# corners per row and column, square the side of one square in any unit
+def board_points(board, square):
+    points = np.zeros((board[0] * board[1], 3), np.float32)
+    points[:, :2] = np.mgrid[0:board[0], 0:board[1]].T.reshape(-1, 2) * square
+    return points
+
+
+# Sub-pixel chessboard corners of a grayscale image, or None
+def find_board(gray, board):
+    found, corners = cv2.findChessboardCorners(gray, board,
+        cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE)
+    if not found:
+        return None
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+    return cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
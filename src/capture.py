@@ -0,0 +1,255 @@
+# Threaded camera capture that always hands out the newest frame
+#
+# cv2.VideoCapture.read() returns the oldest frame waiting in the V4L2
+# buffer queue, so a slow detection loop always works on stale images.
+# FrameCapture grabs frames on a background thread into a small ring
+# buffer, and read() returns the most recent one. Frames that were
+# overwritten before being read are counted as dropped.
+#
+# In grayscale mode the camera is asked for raw YUYV frames and only the
+# luma plane is kept, so the BGR conversion in the driver and the grayscale
+# conversion inside detectMarkers are both skipped. Backends that ignore
+# the request still deliver BGR, which is then converted once here.
+#
+# With reuse=True frames are read into a fixed set of buffers allocated
+# with the first frame, instead of a new array for every frame. A frame
+# returned by read() then stays valid until the next read().
+#
+# In on-demand mode, used while the loop is idle, the thread still takes
+# every frame from the driver so none go stale, but only decodes the one
+# after a read() asked for it. The others are grabbed and dropped without
+# being decoded or converted, which is most of the cost of a frame.
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+# Add the capture options to an argparse parser
+def add_capture_arguments(parser):
+    parser.add_argument("--gray", action="store_true",
+        help="capture raw YUYV frames and keep only the luma plane")
+    parser.add_argument("--capture-size", type=parse_size, default=None, metavar="WxH",
+        help="capture resolution to request, e.g. the sensor's native 1296x972 (default: driver default)")
+    parser.add_argument("--capture-fps", type=float, default=None,
+        help="capture frame rate to request (default: driver default)")
+
+
+# Camera index, or the path of a video file to play instead
+def camera_source(text):
+    return int(text) if text.isdigit() else text
+
+
+# Parse a WIDTHxHEIGHT resolution
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+# Luma plane of a raw frame as a (height, width) array, written into dst
+# when given. YUYV frames interleave luma with chroma, I420 frames start
+# with the full luma plane.
+def luma(frame, width, height, dst=None):
+    if frame.ndim == 3 and frame.shape[2] == 3:
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=dst)
+    if frame.ndim == 3 and frame.shape[2] == 2:
+        return cv2.extractChannel(frame, 0, dst=dst)
+    if frame.size == width * height * 2:
+        return cv2.extractChannel(frame.reshape(height, width, 2), 0, dst=dst)
+    if frame.size == width * height * 3 // 2:
+        plane = frame.reshape(-1, width)[:height]
+    elif frame.ndim == 2 and frame.size == width * height:
+        plane = frame.reshape(height, width)
+    else:
+        raise ValueError("unknown raw frame layout %s for %dx%d" % (frame.shape, width, height))
+
+    # The plane is a view of the raw frame
+    if dst is None:
+        return plane
+    np.copyto(dst, plane)
+    return dst
+
+
+class FrameCapture:
+    def __init__(self, source, buffer_size=2, gray=False, size=None, fps=None, reuse=False):
+        self.cam = cv2.VideoCapture(source)
+        self.gray = gray
+        self.reuse = reuse
+
+        # Ask the driver to keep as few frames queued as it can,
+        # not every backend honours this so the ring buffer still drops
+        self.cam.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        if size is not None:
+            self.cam.set(cv2.CAP_PROP_FRAME_WIDTH, size[0])
+            self.cam.set(cv2.CAP_PROP_FRAME_HEIGHT, size[1])
+        if fps is not None:
+            self.cam.set(cv2.CAP_PROP_FPS, fps)
+
+        # Raw YUYV frames without the driver's BGR conversion
+        self.raw = False
+        if gray:
+            self.cam.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"YUYV"))
+            self.raw = bool(self.cam.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+        self.width = int(self.cam.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cam.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        # Ring buffer of (sequence number, capture timestamp, frame, slot)
+        self.buffer = deque(maxlen=buffer_size)
+
+        # Reused frame buffers: one per ring buffer entry, the frame the
+        # caller holds and the frame being captured. Raw frames of the
+        # grayscale mode go through one more buffer of their own.
+        self.slots = [None] * (buffer_size + 2)
+        self.raw_frame = None
+        self.held_slot = None
+        self.lock = threading.Lock()
+        self.new_frame = threading.Condition(self.lock)
+
+        self.running = False
+        self.thread = None
+
+        # On-demand mode and whether a read() is waiting for a frame
+        self.on_demand = False
+        self.requested = False
+
+        # Statistics of the capture stream
+        self.captured = 0    # frames grabbed from the camera
+        self.delivered = 0   # frames handed to the caller
+        self.dropped = 0     # frames replaced before they were read
+        self.skipped = 0     # frames grabbed without decoding, on demand
+
+        # Details of the frame returned by the last read()
+        self.frame_seq = -1
+        self.frame_timestamp = 0.0
+        self.frame_age = 0.0
+
+    def isOpened(self):
+        return self.cam.isOpened()
+
+    def start(self):
+        if self.running:
+            return self
+        self.running = True
+        self.thread = threading.Thread(target=self._update, name="FrameCapture", daemon=True)
+        self.thread.start()
+        return self
+
+    # A slot that is neither in the ring buffer nor held by the caller
+    def _free_slot(self):
+        with self.lock:
+            used = {entry[3] for entry in self.buffer}
+            used.add(self.held_slot)
+        for slot in range(len(self.slots)):
+            if slot not in used:
+                return slot
+
+    # Only take frames that a read() asked for, or every frame again
+    def set_on_demand(self, on_demand):
+        with self.lock:
+            self.on_demand = on_demand
+            self.requested = False
+
+    # Grab the next frame and decode it into the given slot's buffer when
+    # reusing. Returns (True, None) for a frame nobody asked for.
+    def _grab(self, slot):
+        if not self.cam.grab():
+            return False, None
+        if self.on_demand and not self.requested:
+            return True, None
+
+        if slot is None:
+            ok, frame = self.cam.retrieve()
+            if ok and self.gray:
+                frame = luma(frame, self.width, self.height)
+            return ok, frame
+
+        if self.gray:
+            ok, self.raw_frame = self.cam.retrieve(self.raw_frame)
+            if not ok:
+                return False, None
+            frame = luma(self.raw_frame, self.width, self.height, self.slots[slot])
+        else:
+            ok, frame = self.cam.retrieve(self.slots[slot])
+            if not ok:
+                return False, None
+        self.slots[slot] = frame
+        return True, frame
+
+    # Background loop that keeps pulling frames from the camera
+    def _update(self):
+        while self.running:
+            slot = self._free_slot() if self.reuse else None
+            ok, frame = self._grab(slot)
+            timestamp = time.monotonic()
+
+            if not ok:
+                # Camera unplugged or end of a video file, wake up readers
+                with self.lock:
+                    self.running = False
+                    self.new_frame.notify_all()
+                break
+            if frame is None:
+                self.skipped += 1
+                continue
+
+            with self.lock:
+                self.requested = False
+
+                # A full ring buffer overwrites its oldest unread frame
+                if len(self.buffer) == self.buffer.maxlen:
+                    self.dropped += 1
+                self.buffer.append((self.captured, timestamp, frame, slot))
+                self.captured += 1
+                self.new_frame.notify_all()
+
+    # Return the newest frame that has not been read yet, in the same
+    # (ok, frame) form as cv2.VideoCapture.read(). Blocks until a frame
+    # arrives, however slow the camera is, and only returns False once
+    # the stream has ended.
+    def read(self):
+        if self.thread is None:
+            self.start()
+
+        with self.lock:
+            # On demand, frames taken before this read are stale
+            if self.on_demand:
+                self.dropped += len(self.buffer)
+                self.buffer.clear()
+                self.requested = True
+            self.new_frame.wait_for(lambda: self.buffer or not self.running)
+            if not self.buffer:
+                return False, None
+
+            seq, timestamp, frame, self.held_slot = self.buffer.pop()
+
+            # Everything older than the newest frame is stale
+            self.dropped += len(self.buffer)
+            self.buffer.clear()
+
+        self.delivered += 1
+        self.frame_seq = seq
+        self.frame_timestamp = timestamp
+        self.frame_age = time.monotonic() - timestamp
+        return True, frame
+
+    def stats(self):
+        return {
+            "captured": self.captured,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+            "frame_age_ms": self.frame_age * 1000.0,
+            "format": ("luma" if self.raw else "gray") if self.gray else "bgr",
+        }
+
+    def release(self):
+        with self.lock:
+            self.running = False
+            self.new_frame.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        self.cam.release()
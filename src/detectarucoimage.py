@@ -1,175 +1,203 @@
 # import the necessary packages
+#
+# With a single image the detections are shown in a window. With a
+# directory or glob the images are decoded and detected on a pool of worker
+# processes and one JSON line per image is streamed to --output:
+#
+#   python src/detectarucoimage.py [image]
+#   python src/detectarucoimage.py photos/ --output results.jsonl [--annotate DIR]
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
 import imutils
 import numpy as np
 import cv2
-
-# Create custom dictionary of aruco markers
-arucoDict = cv2.aruco.Dictionary_create(4,4)
-arucoParams = cv2.aruco.DetectorParameters_create()
-
-# Class to represent the aruco markers as form of gates
-class gate:
-    def __init__(self, corners, ID):
-        self.corners = corners
-        self.ID = ID
-        self.size = cv2.norm(corners[0] - corners[2]) # diagonal length of the marker
-
-# Function to calculate the midpoint between two markers
-def calculate_midpoint(marker1, marker2):
-    x1, y1 = marker1[1] # top-right corner of marker 1
-    x2, y2 = marker2[3] # bottom-left corner of marker 2
-
-    # calculate centre point
-    x_mid = (x1 + x2) / 2
-    y_mid = (y1 + y2) / 2
-
-    return (x_mid, y_mid)
-
-# Function to draw a circle at the midpoint between two markers
-def drawtarget(image, marker1, marker2):
-    x_mid, y_mid = calculate_midpoint(marker1, marker2)
-    cv2.circle(image, (int(x_mid), int(y_mid)), 5, (0, 0, 255), -1)
-
-# Method to draw a line between two points
-def draw_line(frame, point1, point2):
-    cv2.line(frame, point1, point2, (255, 255, 255), 2)
-
-
-# load the input image from disk and resize it
-# to have a maximum width of 750 pixels
-print("[INFO] loading image...")
-frame = cv2.imread("assets\IMG_0412(1).JPG")
-frame = imutils.resize(frame, width=750)
-
-# Get the height and width of the image
-height, width, _ = frame.shape
-
-# Draw circle at centre of the frame
-centre = (width // 2, height // 2)
-cv2.circle(frame, centre, 1, (255, 255, 255), -1)
-
-# List of tags in view
-tags  = []
-tagID = []
-
-# detect ArUco markers in the input frame
-(corners, ids, rejected) = cv2.aruco.detectMarkers(frame, arucoDict, parameters=arucoParams)
-
-# verify *at least* one ArUco marker was detected
-if len(corners) > 0:
-    # Zip corners and ids inside tuple
-    markers = zip(corners, ids)
-    
-    for x in range(len(ids)):
-        # Draw bounding box for detected aruco markers
-        cv2.aruco.drawDetectedMarkers(frame, corners)
-
-        # add detected ArUco markers to tags list
-        g = gate(corners[x][0], ids[x])
-        tags.append(g)
-    
-    # Sort tags list by size of ArUco markers in ascending order
-    tags.sort(key = lambda gate: gate.size, reverse = True)
-
-    # loop over the detected ArUCo corners
-    for (markerCorner, markerID) in markers:
-        # extract the marker corners (which are always returned in 
-        # top-left, top-right, bottom-right, and bottom-left order)
-        # corners[0][0], corners[0][1], corners[0][2], corners[0][3]
-        corners = markerCorner.reshape((4, 2))
-        (topLeft, topRight, bottomRight, bottomLeft) = corners
-
-        # convert each of the (x, y)-coordinate pairs to integers
-        topRight = (int(topRight[0]), int(topRight[1]))
-        bottomRight = (int(bottomRight[0]), int(bottomRight[1]))
-        bottomLeft = (int(bottomLeft[0]), int(bottomLeft[1]))
-        topLeft = (int(topLeft[0]), int(topLeft[1]))
-
-        # compute and draw the center (x, y)-coordinates of the ArUco marker
-        cX = int((topLeft[0] + bottomRight[0]) / 2.0)
-        cY = int((topLeft[1] + bottomRight[1]) / 2.0)
-        cv2.circle(frame, (cX, cY), 4, (255, 0, 0), -1)
-        
-        # draw the ArUco marker ID on the frame
-        cv2.putText(frame, str(markerID),
-            (topLeft[0], topLeft[1] - 15),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.5, (0, 255, 0), 2)
-        
-    gatedetect = False
-    gate = 0
-
-    # Check if the gates are aligned correctly
-    if (len(tags) >= 2):
-        # Extracting the corners of the markers
-        marker0Corners = tags[0].corners
-        marker1Corners = tags[1].corners
-
-        # Calculate the centre of the markers
-        marker0Center = np.mean(marker0Corners, axis=0).astype(int)
-        marker1Center = np.mean(marker1Corners, axis=0).astype(int)
-
-        # Calculate the midpoint between the two markers to act as target
-        target = calculate_midpoint(marker0Corners, marker1Corners)
-
-        # Scale factor to find convert coordinates to an ascii value
-        # 25 sections (26 characters, 0-25).
-        scale_factor = 25 / width
-        
-        # TODO - Add tags[2] and tags[3] to account for third and fourth biggest marker
-        # Compare the IDs of the markers
-        if (tags[0].ID[0] == 0 and tags[1].ID[0] == 1):
-            # Compare the positions of the markers
-            if (marker0Center[0] < marker1Center[0]):
-                # Draw a target point between the two markers
-                drawtarget(frame, marker0Corners, marker1Corners)
-                
-                # Scale the target point to an ASCII character value
-                asc = chr(int((target[0] * scale_factor) + 64))
-                
+from detection import create_dictionary, create_parameters, add_detector_arguments, create_detector
+from gates import Detections, select_gate, frame_commands
+from overlay import draw_overlay
+from benchmark import find_images
+
+# Load an image from disk and resize it to have a maximum width of
+# 750 pixels, unless in multi-scale mode
+def load_image(filename, args):
+    frame = cv2.imread(filename)
+    if frame is None or args.multiscale:
+        return frame
+    return imutils.resize(frame, width=750)
+
+
+# Show the detections of a single image in a window
+def show_image(filename, args):
+    print("[INFO] loading image...")
+    frame = load_image(filename, args)
+    if frame is None:
+        print("[INFO] Cannot read image: " + filename)
+        return
+
+    # Get the height and width of the image
+    height, width, _ = frame.shape
+
+    tagID = []
+    labels = []
+
+    # detect ArUco markers in the input frame
+    detect = create_detector(create_dictionary(), create_parameters(), args)
+    (corners, ids, rejected) = detect(frame)
+
+    # All markers in view as arrays, sorted by size in descending order
+    detections = Detections.from_aruco(corners, ids)
+
+    # verify *at least* one ArUco marker was detected
+    if len(detections) > 0:
+        gatedetect = False
+        asc = "-"
+
+        # Pair all left and right markers and target the best gate
+        if len(detections) >= 2:
+            result = select_gate(detections, width)
+            if result.target is not None:
+                labels.append((result.target, result.command))
+                target = result.target
+                asc = result.command
                 gatedetect = True
-            else:
-                asc = "-"
-                gatedetect = False
-
-        elif (tags[0].ID[0] == 1 and tags[1].ID[0] == 0):
-            # Compare the positions of the markers
-            if (marker0Center[0] > marker1Center[0]):
-                # Draw a target point between the two markers
-                drawtarget(frame, marker0Corners, marker1Corners)
 
-                # Scale the target point to an ASCII character value
-                asc = chr(int((target[0] * scale_factor) + 64))
-
-                gatedetect = True
-            else:
-                asc = "-"
-                gatedetect = False
-
-    tagID = [tag.ID[0] for tag in tags]
-    tagsize = [tag.size for tag in tags]
-    tagcorner = [tag.corners[0][0] for tag in tags]
-
-# show the output frame        
-cv2.imshow("ArUco Gate Detection System", frame)
-key = cv2.waitKey(0) & 0xFF
-
-# if the `s` key was pressed, take a screenshot
-if key == ord("s"):
-    cv2.imwrite("screenshot.jpg", frame)
-    print("[INFO] Screenshot saved.")
-
-if not(tagID == []):
-    print("[INFO] Detected Tags ID: " + str(tagID))
-    print("[INFO] Tag Sizes (pixels): " + str(tagsize))
-    print("[INFO] Tag Top Left Corner Coordinates: " + str(tagcorner))
-    print()
-    if gatedetect:
-        print("[INFO] Gate detected.")
-        print("[OUTPUT] Target Gate Coordinates: " + str(target))
-    else:
-        print("[INFO] No Gate detected.")
-    print("[OUTPUT] ASCII value of target:", asc)
-    
-# cleanup
-cv2.destroyAllWindows()
\ No newline at end of file
+        tagID = detections.ids.tolist()
+        tagsize = detections.sizes.tolist()
+        tagcorner = detections.corners[:, 0].tolist()
+
+    # Draw the frame centre, all markers and the target point
+    draw_overlay(frame, detections, (width // 2, height // 2), labels)
+
+    # show the output frame
+    cv2.imshow("ArUco Gate Detection System", frame)
+    key = cv2.waitKey(0) & 0xFF
+
+    # if the `s` key was pressed, take a screenshot
+    if key == ord("s"):
+        cv2.imwrite("screenshot.jpg", frame)
+        print("[INFO] Screenshot saved.")
+
+    if not(tagID == []):
+        print("[INFO] Detected Tags ID: " + str(tagID))
+        print("[INFO] Tag Sizes (pixels): " + str(tagsize))
+        print("[INFO] Tag Top Left Corner Coordinates: " + str(tagcorner))
+        print()
+        if gatedetect:
+            print("[INFO] Gate detected.")
+            print("[OUTPUT] Target Gate Coordinates: " + str(target))
+        else:
+            print("[INFO] No Gate detected.")
+        print("[OUTPUT] ASCII value of target:", asc)
+
+    # cleanup
+    cv2.destroyAllWindows()
+
+
+# Worker process setup, OpenCV's own threads would compete with the pool
+def init_worker():
+    cv2.setNumThreads(1)
+
+
+# Detect the markers in one image of a batch and return its JSON record,
+# runs in a worker process
+def process_image(task):
+    filename, args = task
+    start = time.perf_counter()
+    frame = load_image(filename, args)
+    if frame is None:
+        return {"image": filename, "error": "cannot read image"}
+    decoded = time.perf_counter()
+
+    # Fresh detector per image, the photos are unrelated so tracking and
+    # tuning state must not carry over
+    detect = create_detector(create_dictionary(), create_parameters(), args)
+    (corners, ids, rejected) = detect(frame)
+    detections = Detections.from_aruco(corners, ids)
+
+    height, width = frame.shape[:2]
+    commands, result = frame_commands(detections, width)
+    done = time.perf_counter()
+
+    target = None
+    command = None
+    if result is not None:
+        command = result.command
+        if result.target is not None:
+            target = [float(result.target[0]), float(result.target[1])]
+
+    if args.annotate:
+        labels = [(result.target, result.command)] if target is not None else []
+        draw_overlay(frame, detections, (width // 2, height // 2), labels)
+        cv2.imwrite(os.path.join(args.annotate, os.path.basename(filename)), frame)
+
+    return {
+        "image": filename,
+        "width": width,
+        "height": height,
+        "ids": detections.ids.tolist(),
+        "sizes": detections.sizes.tolist(),
+        "corners": detections.corners.tolist(),
+        "target": target,
+        "ascii": command,
+        "commands": commands,
+        "decode_ms": (decoded - start) * 1000.0,
+        "detect_ms": (done - decoded) * 1000.0,
+    }
+
+
+# Detect the markers in every image and stream the results as JSON Lines
+# in the order of the images
+def run_batch(images, args):
+    if args.annotate:
+        os.makedirs(args.annotate, exist_ok=True)
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    start = time.perf_counter()
+    count = 0
+    failed = 0
+    try:
+        with Pool(args.workers or None, initializer=init_worker) as pool:
+            for record in pool.imap(process_image, [(f, args) for f in images], chunksize=4):
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                count += 1
+                failed += "error" in record
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    print("[INFO] Processed %d images (%d unreadable) in %.1f s, %.1f images/s" % (count, failed, elapsed, count / max(elapsed, 1e-9)),
+        file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect ArUco gates in an image, or in a directory or glob of images")
+    parser.add_argument("image", nargs="?", default=os.path.join("assets", "IMG_0412(1).JPG"),
+        help="image file to show, or a directory or glob to process in batch mode")
+    parser.add_argument("--output", default="-",
+        help="JSON Lines file for batch results (default: standard output)")
+    parser.add_argument("--annotate", default=None,
+        help="directory to write annotated copies of the batch images to")
+    parser.add_argument("--workers", type=int, default=0,
+        help="worker processes in batch mode (default: one per CPU)")
+    add_detector_arguments(parser)
+    args = parser.parse_args()
+
+    # A single existing file is shown, anything else is a batch
+    if os.path.isfile(args.image):
+        show_image(args.image, args)
+        return
+
+    images = find_images([args.image])
+    if not images:
+        print("[INFO] No images found: " + args.image, file=sys.stderr)
+        sys.exit(1)
+    run_batch(images, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,300 +1,192 @@
 # import the necessary packages
 import sys
+import argparse
 import numpy as np
 import cv2
 import time
+import signal
+from capture import FrameCapture, add_capture_arguments
+from detection import create_dictionary, create_parameters, add_detector_arguments, create_detector, prepare_frame, print_detector_stats
+from gates import Detections, select_gate, START, STOP
+from overlay import draw_overlay
+from instrument import Instrumentation
 
 # Create custom dictionary of aruco markers
-arucoDict = cv2.aruco.Dictionary_create(4,4)
-arucoParams = cv2.aruco.DetectorParameters_create()
-
-if len(sys.argv) > 1:
-    camera_index = int(sys.argv[1])
-else:
-    camera_index = 0  # Default camera index
+arucoDict = create_dictionary()
+arucoParams = create_parameters()
+
+# Command line options
+parser = argparse.ArgumentParser()
+parser.add_argument("camera_index", nargs="?", type=int, default=0,
+    help="index of the camera to open (default 0)")
+add_detector_arguments(parser)
+add_capture_arguments(parser)
+parser.add_argument("--headless", action="store_true",
+    help="never open a window, for profiling the vision path over SSH")
+parser.add_argument("--render-every", type=int, default=1,
+    help="draw and show the overlay only every Kth frame (default 1)")
+parser.add_argument("--stats", action="store_true",
+    help="print rolling per-stage latency statistics (toggle at runtime with SIGUSR1)")
+parser.add_argument("--stats-interval", type=float, default=5.0,
+    help="seconds between statistics reports (default 5)")
+args = parser.parse_args()
+camera_index = args.camera_index
+
+# Detection function for the selected options
+detect = create_detector(arucoDict, arucoParams, args)
 
 # Camera Setup
 print("[INFO] Starting video stream...")
-cam = cv2.VideoCapture(camera_index)
+cam = FrameCapture(camera_index, gray=args.gray, size=args.capture_size, fps=args.capture_fps)
 if not cam.isOpened():
     print("[INFO] Cannot open camera")
     sys.exit()
 else:
     print("[INFO] Camera ready")
 
-# Class to represent the aruco markers as form of gates
-class gate:
-    def __init__(self, corners, ID):
-        self.corners = corners
-        self.ID = ID
-        self.size = cv2.norm(corners[0] - corners[2]) # diagonal length of the marker
-
-# Function to calculate the midpoint between two markers
-def calculate_midpoint(marker1, marker2):
-    x1, y1 = marker1[1] # top-right corner of marker 1
-    x2, y2 = marker2[3] # bottom-left corner of marker 2
+# Per-stage latency statistics, switched on and off with SIGUSR1
+instr = Instrumentation(enabled=args.stats, export_interval=args.stats_interval)
+instr.install_toggle()
 
-    # calculate midpoint
-    x_mid = (x1 + x2) / 2
-    y_mid = (y1 + y2) / 2
+# A screenshot with the overlay can be asked for at any frame, with
+# the `s` key or by sending SIGUSR2 in headless mode
+snapshotRequested = False
 
-    return (x_mid, y_mid)
+def request_snapshot(*_):
+    global snapshotRequested
+    snapshotRequested = True
 
-# Function to draw a circle at the midpoint between two markers
-def drawtarget(image, target, asc):
-    # Initialise midpoint coordinates
-    x_mid, y_mid = target
+if hasattr(signal, "SIGUSR2"):
+    signal.signal(signal.SIGUSR2, request_snapshot)
 
-    # draw a circle at the midpoint when gate is detected
-    if not asc == "?":
-        cv2.circle(image, (int(x_mid), int(y_mid)), 5, (0, 0, 255), -1)
-
-    # draw the ASCII character on the frame
-    cv2.putText(frame, asc,
-        (int(x_mid), int(y_mid + 30)),
-        cv2.FONT_HERSHEY_SIMPLEX,
-        0.5, (0, 255, 0), 2)
+frameCount = 0
+startTime = time.monotonic()
 
 # loop over the frames from the video stream
 while True:
-    # Capture frame-by-frame video stream
-    _, frame = cam.read()
+    # Grab the newest frame from the threaded video stream
+    t = instr.start()
+    ok, frame = cam.read()
+    if not ok:
+        print("[INFO] Video stream ended")
+        break
+    t = instr.stop("capture", t)
+    frameCount += 1
 
-    # grab the frame from the threaded video stream and resize it
-    # to have a maximum width of 1000 pixels
-    # and maximum height of 700 pixels
-    frame = cv2.resize(frame, (1000, 700))
+    # resize the frame to have a maximum width of 1000 pixels
+    # and maximum height of 700 pixels, unless in multi-scale mode
+    frame = prepare_frame(frame, args)
+    t = instr.stop("resize", t)
 
     # Get the height and width of the image
-    height, width, _ = frame.shape
-
-    # Draw circle at centre of the frame
+    height, width = frame.shape[:2]
     centre = (width // 2, height // 2)
-    cv2.circle(frame, centre, 1, (255, 255, 255), -1)
 
-    # List of tags in view
-    tags  = []
+    # Markers and gate of this frame only, for the summary at exit
     tagID = []
+    result = None
 
     # detect ArUco markers in the input frame
-    (corners, ids, rejected) = cv2.aruco.detectMarkers(frame, arucoDict, parameters=arucoParams)
-    
+    (corners, ids, rejected) = detect(frame)
+    t = instr.stop("detect", t)
+
+    # All markers in view as arrays, sorted by size in descending order
+    detections = Detections.from_aruco(corners, ids)
+
+    # Text to draw on the overlay as (point, text)
+    labels = []
+
     # verify *at least* one ArUco marker was detected
-    if len(corners) > 0:
-        # Zip corners and ids inside tuple
-        markers = zip(corners, ids)
-        
-        for x in range(len(ids)):
-            # Draw bounding box for detected aruco markers
-            cv2.aruco.drawDetectedMarkers(frame, corners)
-
-            # add detected ArUco markers to tags list
-            g = gate(corners[x][0], ids[x])
-            tags.append(g)
-        
-        # Sort tags list by size of ArUco markers in ascending order
-        tags.sort(key = lambda gate: gate.size, reverse = True)
-
-        # loop over the detected ArUCo corners
-        for (markerCorner, markerID) in markers:
-            # extract the marker corners (which are always returned in 
-            # top-left, top-right, bottom-right, and bottom-left order)
-            # corners[0][0], corners[0][1], corners[0][2], corners[0][3]
-            corners = markerCorner.reshape((4, 2))
-            (topLeft, topRight, bottomRight, bottomLeft) = corners
-
-            # convert each of the (x, y)-coordinate pairs to integers
-            topRight = (int(topRight[0]), int(topRight[1]))
-            bottomRight = (int(bottomRight[0]), int(bottomRight[1]))
-            bottomLeft = (int(bottomLeft[0]), int(bottomLeft[1]))
-            topLeft = (int(topLeft[0]), int(topLeft[1]))
-
-            # compute and draw the center (x, y)-coordinates of the ArUco marker
-            cX = int((topLeft[0] + bottomRight[0]) / 2.0)
-            cY = int((topLeft[1] + bottomRight[1]) / 2.0)
-            cv2.circle(frame, (cX, cY), 4, (255, 0, 0), -1)
-            
-            # draw the ArUco marker ID on the frame
-            cv2.putText(frame, str(markerID),
-				(topLeft[0], topLeft[1] - 15),
-				cv2.FONT_HERSHEY_SIMPLEX,
-				0.5, (0, 255, 0), 2)
-            
-        gatedetect = False
-        
-        # Scale factor to find convert coordinates to an ascii value
-        # 25 sections (26 characters, 0-25).
-        scale_factor = 25 / width # 0.025
-        
+    if len(detections) > 0:
         # Start marker
-        if (tags[0].ID[0] == 2):
+        if detections.ids[0] == START:
             start_signal = "& - Start Signal"
-            drawtarget(frame, centre, start_signal)
+            labels.append((centre, start_signal))
             print(start_signal)
-        
+
         # Stop marker
-        if (tags[0].ID[0] == 3):
+        if detections.ids[0] == STOP:
             stop_signal = "! - Stop Signal"
             print(stop_signal)
-            drawtarget(frame, centre, stop_signal)
-            continue
-        
-        # Check if the gates are aligned correctly
-        if (len(tags) == 2):
-            # Extracting the corners of the markers
-            marker0Corners = tags[0].corners
-            marker1Corners = tags[1].corners
-
-            # Calculate the centre of the markers
-            marker0Center = np.mean(marker0Corners, axis=0).astype(int)
-            marker1Center = np.mean(marker1Corners, axis=0).astype(int)
-
-            # Calculate the midpoint between the two markers to act as target
-            target = calculate_midpoint(marker0Corners, marker1Corners)        
-
-            # Default value for ASCII character and if no gate is detected
-            asc = "?" 
-
-            # Check if the markers are aligned correctly
-            if (tags[0].ID[0] == 0 and tags[1].ID[0] == 1):
-                # Compare the positions of the markers
-                if (marker0Center[0] < marker1Center[0]):
-                    # Gate detected
-                    # Scale and convert the target point  
-                    # x-coordinate to uppercase character
-                    asc = chr(int((target[0] * scale_factor) + 64))
-                    gatedetect = True
-
-            elif (tags[0].ID[0] == 1 and tags[1].ID[0] == 0):
-                # Compare the positions of the markers
-                if (marker0Center[0] > marker1Center[0]):
-                    # Gate detected
-                    # Scale and convert the target point  
-                    # x-coordinate to uppercase character
-                    asc = chr(int((target[0] * scale_factor) + 64))
-                    gatedetect = True
-            
-            # Print the ASCII character to the console
-            print(asc)
+            labels.append((centre, stop_signal))
 
-            # Draw a target point between the two markers
-            drawtarget(frame, target, asc)
-
-        if len(tags) >= 3:
-            # Extracting the corners of the markers
-            marker0Corners = tags[0].corners
-            marker1Corners = tags[1].corners
-            marker2Corners = tags[2].corners
-
-            # Calculate the centre of the markers
-            marker0Center = np.mean(marker0Corners, axis=0).astype(int)
-            marker1Center = np.mean(marker1Corners, axis=0).astype(int)
-            marker2Center = np.mean(marker2Corners, axis=0).astype(int)
-
-            # Default value for ASCII character
-            asc = "?"
-
-            # Compare the IDs of the markers
-            if (tags[0].ID[0] == 0 and tags[1].ID[0] == 1):
-                # Calculate the midpoint between the two markers to act as target
-                target = calculate_midpoint(marker0Corners, marker1Corners)
-
-                # Compare the positions of the markers
-                if (marker0Center[0] < marker1Center[0]):
-                    # Gate detected
-                    # Scale and convert the target point  
-                    # x-coordinate to uppercase character
-                    asc = chr(int((target[0] * scale_factor) + 64))
-                    
-                    # # Draw a target point between the two markers
-                    # drawtarget(frame, target, asc)
-                    
-                    gatedetect = True
-
-            elif (tags[0].ID[0] == 1 and tags[1].ID[0] == 0):
-                # Calculate the midpoint between the two markers to act as target
-                target = calculate_midpoint(marker0Corners, marker1Corners)
-
-                # Compare the positions of the markers
-                if (marker0Center[0] > marker1Center[0]):
-                    # Gate detected
-                    # Scale and convert the target point  
-                    # x-coordinate to uppercase character
-                    asc = chr(int((target[0] * scale_factor) + 64))
-
-                    # # Draw a target point between the two markers
-                    # drawtarget(frame, target, asc)
-
-                    gatedetect = True
-
-            elif (tags[1].ID[0] == 1 and tags[2].ID[0] == 0):
-                # Calculate target point
-                target = calculate_midpoint(marker1Corners, marker2Corners)
-                
-                # Compare the positions of the markers
-                if (marker1Center[0] > marker2Center[0]):
-                    # Gate detected
-                    # Scale and convert the target point  
-                    # x-coordinate to uppercase character
-                    asc = chr(int((target[0] * scale_factor) + 64))
-
-                    # # Draw a target point between the two markers
-                    # drawtarget(frame, target, asc)
-
-                    gatedetect = True
-
-            elif (tags[1].ID[0] == 0 and tags[2].ID[0] == 1):
-                # Calculate target point
-                target = calculate_midpoint(marker1Corners, marker2Corners)
-
-                # Compare the positions of the markers
-                if (marker1Center[0] < marker2Center[0]):
-                    # Gate detected
-                    # Scale and convert the target point  
-                    # x-coordinate to uppercase character
-                    asc = chr(int((target[0] * scale_factor) + 64))
-                    
-                    # # Draw a target point between the two markers
-                    # drawtarget(frame, target, asc)
-
-                    gatedetect = True
+        # Pair all left and right markers and target the best gate
+        elif len(detections) >= 2:
+            result = select_gate(detections, width)
+            asc = result.command
 
             # Print the ASCII character to the console
             print(asc)
 
-            # Draw a target point between the two markers
-            drawtarget(frame, target, asc)
-
-        tagID = [tag.ID[0] for tag in tags]
-        tagsize = [tag.size for tag in tags]
-
-    # else:
-    #     drawtarget(frame, centre, "- no markers detected -")
-    
-    # show the output frame        
-    cv2.imshow("Fiducial Marker Computer Vision-based Navigation System", frame)
-    key = cv2.waitKey(1) & 0xFF
-    
-    # if the `s` key was pressed, take a screenshot
-    if key == ord("s"):
+            # Target point between the two markers, or the '?' at the
+            # centre of the frame when no gate was found
+            labels.append((result.target if result.target is not None else centre, asc))
+
+        tagID = detections.ids.tolist()
+        tagsize = detections.sizes.tolist()
+    t = instr.stop("pair", t)
+
+    # Overlays are only drawn for frames that are shown or saved
+    render = not args.headless and frameCount % args.render_every == 0
+    if render or snapshotRequested:
+        # Grayscale frames are only converted to colour for display
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        draw_overlay(frame, detections, centre, labels)
+    t = instr.stop("draw", t)
+
+    if snapshotRequested:
         cv2.imwrite("screenshot.jpg", frame)
         print("[INFO] Screenshot saved.")
+        snapshotRequested = False
 
-    # if the `q` key was pressed, break from the loop
-    if key == ord("q"):
-        print("[INFO] stopping video stream...")
-        break
+    if render:
+        # show the output frame
+        cv2.imshow("Fiducial Marker Computer Vision-based Navigation System", frame)
+        key = cv2.waitKey(1) & 0xFF
+
+        # if the `s` key was pressed, take a screenshot
+        # of the next frame with its overlay
+        if key == ord("s"):
+            snapshotRequested = True
+
+        # if the `q` key was pressed, break from the loop
+        if key == ord("q"):
+            print("[INFO] stopping video stream...")
+            break
+        t = instr.stop("show", t)
+
+    instr.count("frames")
+    instr.maybe_export()
 
 if not(tagID == []):
     print("[INFO] Detected Tags ID: " + str(tagID))
     print("[INFO] Tag Sizes (pixels): " + str(tagsize))
-    if gatedetect:
-        print("[INFO] Gate detected.")
-        print("[OUTPUT] Target Gate Coordinates: " + str(target))
-    else:
-        print("[INFO] No Gate detected.")
-    print("[OUTPUT] ASCII value of target:", asc)
+    # No gate is paired when the stop marker is the largest marker
+    if result is not None:
+        if result.target is not None:
+            print("[INFO] Gate detected.")
+            print("[OUTPUT] Target Gate Coordinates: " + str(result.target))
+        else:
+            print("[INFO] No Gate detected.")
+        print("[OUTPUT] ASCII value of target:", result.command)
+
+# Frame rate of the whole loop including any rendering
+elapsed = time.monotonic() - startTime
+if elapsed > 0:
+    print("[INFO] Processed %d frames at %.1f fps" % (frameCount, frameCount / elapsed))
+if instr.enabled:
+    instr.export()
+
+# Report how many stale frames were skipped by the capture thread
+stats = cam.stats()
+print("[INFO] Frames captured: %d, processed: %d, dropped: %d" % (stats["captured"], stats["delivered"], stats["dropped"]))
+print("[INFO] Last frame age (ms): %.1f" % stats["frame_age_ms"])
+
+# Report what the tracking and tuning stages of the detector did
+print_detector_stats(detect)
 
 # cleanup
 cam.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+if not args.headless:
+    cv2.destroyAllWindows()
\ No newline at end of file
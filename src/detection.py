@@ -0,0 +1,153 @@
+# Marker detection stage shared by the runtime, desktop and benchmark scripts
+#
+# create_detector() builds the detect(image) -> (corners, ids, rejected)
+# callable from the same options the scripts take on the command line, so
+# every script runs exactly the same detection path.
+import json
+import os
+
+import cv2
+import numpy as np
+
+from tracking import MarkerTracker
+from multiscale import MultiScaleDetector
+from tuning import PRESETS, AdaptiveTuner, apply_preset
+from calibration import CameraModel, CornerUndistorter
+from scenechange import SceneGate
+
+
+# The custom dictionary of 4 markers of 4x4 bits, pinned to a file so
+# startup does not have to generate it and every OpenCV version uses
+# exactly the same markers
+DICTIONARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dictionary.json")
+
+
+# Create custom dictionary of aruco markers and default detector parameters
+def create_dictionary(path=DICTIONARY_PATH):
+    if os.path.exists(path):
+        return load_dictionary(path)
+    return cv2.aruco.Dictionary_create(4,4)
+
+
+# Load a dictionary written by save_dictionary(). A predefined dictionary
+# is created without any generation work and its markers are replaced.
+def load_dictionary(path):
+    with open(path) as f:
+        data = json.load(f)
+    dictionary = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
+    dictionary.bytesList = np.array(data["bytesList"], dtype=np.uint8)
+    dictionary.markerSize = data["markerSize"]
+    dictionary.maxCorrectionBits = data["maxCorrectionBits"]
+    return dictionary
+
+
+def save_dictionary(dictionary, path):
+    data = {
+        "markerSize": int(dictionary.markerSize),
+        "maxCorrectionBits": int(dictionary.maxCorrectionBits),
+        "bytesList": dictionary.bytesList.tolist(),
+    }
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def create_parameters():
+    return cv2.aruco.DetectorParameters_create()
+
+
+# Add the detection options to an argparse parser
+def add_detector_arguments(parser):
+    parser.add_argument("--track", action="store_true",
+        help="search only around the markers found in the previous frame")
+    parser.add_argument("--full-scan-interval", type=int, default=10,
+        help="frames between full-frame scans in tracking mode (default 10)")
+    parser.add_argument("--multiscale", action="store_true",
+        help="detect on a downscaled frame and refine corners at native resolution")
+    parser.add_argument("--min-marker-size", type=int, default=48,
+        help="smallest expected marker side in native pixels for --multiscale (default 48)")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default=None,
+        help="detector parameter preset (default: OpenCV defaults)")
+    parser.add_argument("--adaptive", action="store_true",
+        help="narrow the detector parameters to the marker sizes seen in recent frames")
+    parser.add_argument("--scene-threshold", type=float, default=0,
+        help="reuse the last detections while a 32x24 thumbnail differs by less than this mean grey level (default 0, off)")
+    parser.add_argument("--scene-refresh", type=int, default=15,
+        help="frames after which detection runs even if the scene has not changed (default 15)")
+    parser.add_argument("--calibration", default=None,
+        help="camera intrinsics from calibrate.py, marker corners are undistorted before gate pairing")
+
+
+# Build the detection function for the parsed options, arucoParams is
+# changed in place by the preset and adaptive tuning
+def create_detector(arucoDict, arucoParams, args):
+    if args.preset:
+        apply_preset(arucoParams, args.preset)
+
+    # Function to detect ArUco markers in an image
+    def detect(image):
+        return cv2.aruco.detectMarkers(image, arucoDict, parameters=arucoParams)
+
+    # In multi-scale mode markers are found on a pyramid level of the native
+    # frame instead of a fixed 1000x700 resize
+    if args.multiscale:
+        detect = MultiScaleDetector(arucoDict, arucoParams, min_marker_size=args.min_marker_size)
+
+    # In tracking mode only the regions around previous markers are searched
+    if args.track:
+        detect = MarkerTracker(detect, full_scan_interval=args.full_scan_interval)
+
+    # Adaptive tuning sees whole frames, tracking ROIs make markers look
+    # larger relative to the image so the maximum perimeter is left alone
+    if args.adaptive:
+        detect = AdaptiveTuner(detect, arucoParams, tune_max=not args.track)
+
+    # Lens distortion is removed from the returned corners only, the
+    # stages above keep working in raw image coordinates
+    if getattr(args, "calibration", None):
+        detect = CornerUndistorter(detect, CameraModel.load(args.calibration))
+
+    # Unchanged scenes reuse the previous detections without running any
+    # of the stages above
+    if getattr(args, "scene_threshold", 0) > 0:
+        detect = SceneGate(detect, threshold=args.scene_threshold, refresh_interval=args.scene_refresh)
+
+    return detect
+
+
+# Print the statistics of each stage of a detector from create_detector
+def print_detector_stats(detect):
+    while detect is not None:
+        if isinstance(detect, MarkerTracker):
+            stats = detect.stats()
+            print("[INFO] Full-frame scans: %d, ROI scans: %d, lost markers: %d" % (stats["full_scans"], stats["roi_scans"], stats["lost"]))
+            print("[INFO] Fraction of frame pixels searched: %.2f" % stats["scanned_fraction"])
+        elif isinstance(detect, AdaptiveTuner):
+            stats = detect.stats()
+            print("[INFO] Parameter narrowings: %d, widenings: %d" % (stats["narrowings"], stats["widenings"]))
+            print("[INFO] Threshold windows: %s, perimeter rates: %s" % (stats["threshold_windows"], stats["perimeter_rates"]))
+        elif isinstance(detect, SceneGate):
+            stats = detect.stats()
+            print("[INFO] Unchanged frames skipped: %d of %d (%.0f%%)" % (stats["skipped"], stats["frames"], stats["skip_ratio"] * 100.0))
+
+        # Step to the detect function the stage wraps
+        detect = getattr(detect, "detect", None)
+
+
+# Resize the frame to have a maximum width of 1000 pixels and maximum
+# height of 700 pixels, times scale, multi-scale mode works on the native
+# frame and picks its own detection scale. With a buffers dict the frame
+# is resized into a buffer kept there for each size, and the returned frame
+# is overwritten by the next call.
+def prepare_frame(frame, args, scale=1.0, buffers=None):
+    if args.multiscale:
+        return frame
+    size = (int(1000 * scale), int(700 * scale))
+    interpolation = cv2.INTER_AREA if scale != 1.0 else cv2.INTER_LINEAR
+
+    dst = None
+    if buffers is not None:
+        key = size + frame.shape[2:]
+        dst = buffers.get(key)
+        if dst is None:
+            dst = buffers[key] = np.empty((size[1], size[0]) + frame.shape[2:], frame.dtype)
+    return cv2.resize(frame, size, dst=dst, interpolation=interpolation)
@@ -0,0 +1,139 @@
+# Temporal target estimation and fixed-rate command output
+#
+# Every frame's gate decision used to be sent on its own, so one missed
+# detection made the robot twitch and the command rate followed the
+# detection rate. TargetEstimator smooths the target position and gate
+# size with alpha-beta filters and predicts them between detections.
+# ControlLoop emits a steering command from the latest estimate at a
+# fixed rate on its own thread, so detection can run slower than control.
+import threading
+import time
+
+
+# Alpha-beta filter of one value and its rate of change
+class AlphaBetaFilter:
+    def __init__(self, alpha=0.5, beta=0.1):
+        self.alpha = alpha
+        self.beta = beta
+        self.value = None
+        self.rate = 0.0
+        self.time = 0.0
+
+    def update(self, measurement, t):
+        if self.value is None:
+            self.value = measurement
+            self.rate = 0.0
+            self.time = t
+            return self.value
+
+        dt = t - self.time
+        predicted = self.value + self.rate * dt
+        residual = measurement - predicted
+        self.value = predicted + self.alpha * residual
+        if dt > 0:
+            self.rate += self.beta * residual / dt
+        self.time = t
+        return self.value
+
+    def predict(self, t):
+        if self.value is None:
+            return None
+        return self.value + self.rate * (t - self.time)
+
+    def reset(self):
+        self.value = None
+        self.rate = 0.0
+
+
+# Estimate of the target x, y (fractions of the frame width and height)
+# and gate size in pixels, shared between the vision loop and ControlLoop
+class TargetEstimator:
+    def __init__(self, alpha=0.5, beta=0.1, max_coast=0.5):
+        self.x = AlphaBetaFilter(alpha, beta)
+        self.y = AlphaBetaFilter(alpha, beta)
+        self.size = AlphaBetaFilter(alpha, beta)
+
+        # Predictions are only trusted for max_coast seconds after the
+        # last detection of a gate
+        self.max_coast = max_coast
+        self.last_update = None
+
+        # Command to send when there is no estimate: '-' no markers,
+        # '?' markers but no valid gate
+        self.status = "-"
+        self.lock = threading.Lock()
+
+    # New gate measurement taken from a frame captured at time t
+    def update(self, x, y, size, t):
+        with self.lock:
+            self.x.update(x, t)
+            self.y.update(y, t)
+            self.size.update(size, t)
+            self.last_update = t
+
+    # Frame without a valid gate, the estimate keeps coasting unless
+    # clear is set, e.g. when a stop marker has been seen
+    def miss(self, status, clear=False):
+        with self.lock:
+            self.status = status
+            if clear:
+                self._reset()
+
+    # Predicted (x, y, size) at time t, or None once the last detection
+    # is older than max_coast
+    def estimate(self, t):
+        with self.lock:
+            if self.last_update is None or t - self.last_update > self.max_coast:
+                self._reset()
+                return None
+
+            x = min(1.0, max(0.0, self.x.predict(t)))
+            y = min(1.0, max(0.0, self.y.predict(t)))
+            size = max(0.0, self.size.predict(t))
+            return (x, y, size)
+
+    def _reset(self):
+        self.x.reset()
+        self.y.reset()
+        self.size.reset()
+        self.last_update = None
+
+    def current_status(self):
+        with self.lock:
+            return self.status
+
+
+# Calls emit(estimate, status) every 1 / rate seconds, where estimate is
+# the latest (x, y, size) prediction or None
+class ControlLoop:
+    def __init__(self, estimator, emit, rate=20.0):
+        self.estimator = estimator
+        self.emit = emit
+        self.period = 1.0 / rate
+        self.running = True
+        self.ticks = 0
+        self.late = 0
+
+        self.thread = threading.Thread(target=self._run, name="ControlLoop", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while self.running:
+            now = time.monotonic()
+            estimate = self.estimator.estimate(now)
+            self.emit(estimate, self.estimator.current_status())
+            self.ticks += 1
+
+            # Keep a fixed schedule, skip ticks that were missed
+            next_tick += self.period
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.late += 1
+                next_tick = time.monotonic()
+
+    def stop(self):
+        self.running = False
+        self.thread.join(timeout=1.0)
@@ -0,0 +1,246 @@
+# Gate detection shared by the Raspberry Pi and desktop scripts
+#
+# All markers detected in a frame are held in one set of NumPy arrays
+# (N x 4 x 2 corners, N ids and N sizes), sorted by size with the largest
+# first. Every left/right marker combination is paired in a single
+# vectorized pass and the candidate gates are ranked by size and
+# alignment, so any number of markers and gates can be in view.
+from collections import namedtuple
+
+import numpy as np
+
+# Marker IDs of the custom dictionary
+LEFT = 0
+RIGHT = 1
+START = 2
+STOP = 3
+
+# The smaller marker of a gate must be at least this fraction of the
+# larger one, and the vertical offset between the marker centres at most
+# this many marker sizes
+MIN_SIZE_RATIO = 0.5
+MAX_VERTICAL_OFFSET = 1.0
+
+# Result of gate selection, target is None when no valid gate is in view
+GateResult = namedtuple("GateResult", ["command", "target", "size", "left", "right"])
+
+
+# Function to calculate the midpoint between two markers
+def calculate_midpoint(marker1, marker2):
+    x1, y1 = marker1[1] # top-right corner of marker 1
+    x2, y2 = marker2[3] # bottom-left corner of marker 2
+
+    # calculate midpoint
+    x_mid = (x1 + x2) / 2
+    y_mid = (y1 + y2) / 2
+
+    return (x_mid, y_mid)
+
+
+# Scale the target x-coordinate to an ASCII character value,
+# 25 sections (26 characters, 0-25) across the frame width. Undistorted
+# corners can lie outside the frame, so x is clamped to it first: below
+# '@' are '?' (no valid gate) and other control characters.
+def ascii_command(x, width):
+    x = min(max(x, 0.0), width)
+    scale_factor = 25 / width
+    return chr(int((x * scale_factor) + 64))
+
+
+# Markers detected in one frame, sorted by size in descending order
+class Detections:
+    def __init__(self, corners, ids):
+        self.corners = np.asarray(corners, dtype=np.float32).reshape(-1, 4, 2)
+        self.ids = np.asarray(ids, dtype=np.int32).reshape(-1)
+
+        # Diagonal length of each marker
+        self.sizes = np.linalg.norm(self.corners[:, 0] - self.corners[:, 2], axis=1)
+
+        order = np.argsort(-self.sizes, kind="stable")
+        self.corners = self.corners[order]
+        self.ids = self.ids[order]
+        self.sizes = self.sizes[order]
+        self.centres = self.corners.mean(axis=1)
+
+    # Build from the (corners, ids) returned by cv2.aruco.detectMarkers
+    @classmethod
+    def from_aruco(cls, corners, ids):
+        if ids is None or len(corners) == 0:
+            return cls(np.empty((0, 4, 2), dtype=np.float32), np.empty(0, dtype=np.int32))
+        return cls(np.concatenate([c.reshape(1, 4, 2) for c in corners]), ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+# Initial number of markers a DetectionStore holds
+STORE_CAPACITY = 16
+
+
+# Detections of the runtime's frame loop, refilled for every frame in
+# arrays that are allocated once. corners, ids, sizes and centres are views
+# of the first len() markers, like the arrays of Detections, so the gate
+# pairing, pose estimation and flight recorder take either. The contents
+# are replaced by the next fill(), copy() keeps them. More markers than
+# fit make the store grow.
+class DetectionStore:
+    __slots__ = ("capacity", "count", "corners", "ids", "sizes", "centres",
+        "_raw_corners", "_raw_ids", "_raw_sizes", "_diagonals", "_keys",
+        "_corners", "_ids", "_sizes", "_centres")
+
+    def __init__(self, capacity=STORE_CAPACITY):
+        self._allocate(capacity)
+        self._select(0)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+
+        # Markers in detection order
+        self._raw_corners = np.empty((capacity, 4, 2), dtype=np.float32)
+        self._raw_ids = np.empty(capacity, dtype=np.int32)
+        self._raw_sizes = np.empty(capacity, dtype=np.float32)
+        self._diagonals = np.empty((capacity, 2), dtype=np.float32)
+        self._keys = np.empty(capacity, dtype=np.float32)
+
+        # Markers sorted by size
+        self._corners = np.empty((capacity, 4, 2), dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=np.int32)
+        self._sizes = np.empty(capacity, dtype=np.float32)
+        self._centres = np.empty((capacity, 2), dtype=np.float32)
+
+    def _select(self, n):
+        self.count = n
+        self.corners = self._corners[:n]
+        self.ids = self._ids[:n]
+        self.sizes = self._sizes[:n]
+        self.centres = self._centres[:n]
+
+    # Refill from the (corners, ids) returned by cv2.aruco.detectMarkers
+    def fill(self, corners, ids):
+        n = 0 if ids is None else len(corners)
+        if n > self.capacity:
+            self._allocate(max(n, 2 * self.capacity))
+
+        rawCorners = self._raw_corners[:n]
+        for i in range(n):
+            rawCorners[i] = corners[i]
+        self._raw_ids[:n] = ids.reshape(-1) if n else 0
+
+        # Diagonal length of each marker
+        diagonals = self._diagonals[:n]
+        np.subtract(rawCorners[:, 0], rawCorners[:, 2], out=diagonals)
+        np.hypot(diagonals[:, 0], diagonals[:, 1], out=self._raw_sizes[:n])
+
+        # Only the order of at most a few markers is a new array
+        np.negative(self._raw_sizes[:n], out=self._keys[:n])
+        order = np.argsort(self._keys[:n], kind="stable")
+        self._select(n)
+        np.take(rawCorners, order, axis=0, out=self.corners)
+        np.take(self._raw_ids[:n], order, out=self.ids)
+        np.take(self._raw_sizes[:n], order, out=self.sizes)
+        np.mean(self.corners, axis=1, out=self.centres)
+        return self
+
+    # Detections holding a copy of the current markers
+    def copy(self):
+        return Detections(self.corners, self.ids)
+
+    def __len__(self):
+        return self.count
+
+
+# Pair every left marker with every right marker in one pass. Returns the
+# indices of the left and right markers, the target points and the sizes
+# of all valid gates, best gate first.
+def pair_gates(detections):
+    left = np.flatnonzero(detections.ids == LEFT)
+    right = np.flatnonzero(detections.ids == RIGHT)
+    if len(left) == 0 or len(right) == 0:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty, np.empty((0, 2), dtype=np.float32), np.empty(0, dtype=np.float32)
+
+    # Grid of every left/right combination
+    li, ri = np.meshgrid(left, right, indexing="ij")
+    li = li.ravel()
+    ri = ri.ravel()
+
+    centres = detections.centres
+    sizes = detections.sizes
+    left_size = sizes[li]
+    right_size = sizes[ri]
+    gate_size = (left_size + right_size) / 2
+
+    # The left marker has to be on the left, the markers of a gate are
+    # roughly the same size and at roughly the same height
+    size_ratio = np.minimum(left_size, right_size) / np.maximum(left_size, right_size)
+    offset = np.abs(centres[li, 1] - centres[ri, 1]) / gate_size
+    valid = (
+        (centres[li, 0] < centres[ri, 0])
+        & (size_ratio >= MIN_SIZE_RATIO)
+        & (offset <= MAX_VERTICAL_OFFSET)
+    )
+
+    li = li[valid]
+    ri = ri[valid]
+    gate_size = gate_size[valid]
+
+    # Rank the closest (largest) and best aligned gates first
+    score = gate_size * size_ratio[valid] / (1 + offset[valid])
+    order = np.argsort(-score, kind="stable")
+    li = li[order]
+    ri = ri[order]
+    gate_size = gate_size[order]
+
+    # Target is the midpoint between the top-right corner of the larger
+    # marker and the bottom-left corner of the smaller one, as the original
+    # gate logic computed it. Markers are sorted by size, so the larger
+    # marker has the lower index.
+    first = np.minimum(li, ri)
+    second = np.maximum(li, ri)
+    targets = (detections.corners[first, 1] + detections.corners[second, 3]) / 2
+
+    return li, ri, targets, gate_size
+
+
+# Pick the best gate in view and the ASCII command that steers towards it.
+# to_frame maps the target into the frame of the given width the command
+# letters are measured in, when the markers are not in its pixels.
+def select_gate(detections, width, to_frame=None):
+    li, ri, targets, sizes = pair_gates(detections)
+    if len(li) == 0:
+        return GateResult("?", None, 0.0, None, None)
+
+    target = (float(targets[0, 0]), float(targets[0, 1]))
+    if to_frame is not None:
+        target = to_frame(target)
+    return GateResult(ascii_command(target[0], width), target, float(sizes[0]), int(li[0]), int(ri[0]))
+
+
+# Commands raspiaruco.py sends for one frame, in the order they are sent,
+# and the selected gate (None when no gate selection was made):
+#   '-' no markers, '!' stop marker is the largest marker,
+#   '&' start marker is the largest marker, '@' start and stop markers
+#   are the two largest markers (shut down), otherwise the gate command
+#   when two or more markers are in view
+def frame_commands(detections, width, to_frame=None):
+    if len(detections) == 0:
+        return ["-"], None
+
+    ids = detections.ids
+    if ids[0] == STOP:
+        return ["!"], None
+
+    commands = []
+    if ids[0] == START:
+        commands.append("&")
+
+    result = None
+    if len(detections) >= 2:
+        if ids[0] == START and ids[1] == STOP:
+            commands.append("@")
+            return commands, None
+
+        result = select_gate(detections, width, to_frame)
+        commands.append(result.command)
+
+    return commands, result
@@ -0,0 +1,135 @@
+# Low-overhead per-stage instrumentation for the frame loop
+#
+# Each stage of the loop is timed by chaining start() and stop() calls:
+#
+#   t = instr.start()
+#   ok, frame = cam.read()
+#   t = instr.stop("capture", t)
+#
+# stop() records the time since t and returns a new start time, so the
+# next stage can be timed from there. When disabled both calls return
+# straight away. Latencies are kept in rolling windows and exported as
+# p50/p95/p99 statistics to a JSON file every export_interval seconds.
+# Sending SIGUSR1 to the process switches instrumentation on and off.
+import json
+import os
+import signal
+import time
+from collections import deque
+
+
+class Instrumentation:
+    def __init__(self, enabled=False, window=500, export_path=None, export_interval=5.0):
+        self.enabled = enabled
+        self.window = window
+        self.export_path = export_path
+        self.export_interval = export_interval
+
+        # Rolling latency windows in milliseconds and event counters
+        self.latencies = {}
+        self.counters = {}
+
+        self.started = time.monotonic()
+        self.last_export = self.started
+        self.last_counters = {}
+
+    def start(self):
+        if not self.enabled:
+            return 0.0
+        return time.perf_counter()
+
+    # Record the time spent in a stage and return the start of the next one
+    def stop(self, stage, start):
+        if not self.enabled:
+            return 0.0
+        now = time.perf_counter()
+        if start:
+            samples = self.latencies.get(stage)
+            if samples is None:
+                samples = self.latencies[stage] = deque(maxlen=self.window)
+            samples.append((now - start) * 1000.0)
+        return now
+
+    # Record a value that is not a stage latency, e.g. the age of a frame
+    def record(self, name, value_ms):
+        if not self.enabled:
+            return
+        samples = self.latencies.get(name)
+        if samples is None:
+            samples = self.latencies[name] = deque(maxlen=self.window)
+        samples.append(value_ms)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def toggle(self, *_):
+        self.enabled = not self.enabled
+        print("[INFO] Instrumentation " + ("enabled" if self.enabled else "disabled"))
+
+    # Switch instrumentation on and off with a signal, e.g. kill -USR1 <pid>
+    def install_toggle(self, signum=getattr(signal, "SIGUSR1", None)):
+        if signum is not None:
+            signal.signal(signum, self.toggle)
+
+    # Percentiles of each rolling window and the rate of each counter
+    # since the previous snapshot
+    def snapshot(self):
+        now = time.monotonic()
+        elapsed = max(now - self.last_export, 1e-9)
+
+        stages = {}
+        for stage, samples in self.latencies.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            n = len(ordered)
+            stages[stage] = {
+                "count": n,
+                "mean_ms": sum(ordered) / n,
+                "p50_ms": ordered[int(0.50 * (n - 1))],
+                "p95_ms": ordered[int(0.95 * (n - 1))],
+                "p99_ms": ordered[int(0.99 * (n - 1))],
+                "max_ms": ordered[-1],
+            }
+
+        rates = {}
+        for name, total in self.counters.items():
+            rates[name] = (total - self.last_counters.get(name, 0)) / elapsed
+
+        return {
+            "time": time.time(),
+            "uptime_s": now - self.started,
+            "stages": stages,
+            "counters": dict(self.counters),
+            "rates_per_s": rates,
+        }
+
+    # Export a snapshot when export_interval has passed, cheap to call
+    # once per frame
+    def maybe_export(self):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now - self.last_export < self.export_interval:
+            return
+        self.export()
+
+    def export(self):
+        stats = self.snapshot()
+        self.last_export = time.monotonic()
+        self.last_counters = dict(self.counters)
+
+        if self.export_path:
+            # Write to a temporary file and rename, so readers never see
+            # a half written file
+            tmp = self.export_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(stats, f, indent=2)
+            os.replace(tmp, self.export_path)
+
+        parts = ["%s p50=%.1f p95=%.1f p99=%.1f" % (stage, s["p50_ms"], s["p95_ms"], s["p99_ms"])
+            for stage, s in stats["stages"].items()]
+        print("[STATS] %.1f fps | %s" % (stats["rates_per_s"].get("frames", 0.0), " | ".join(parts)))
+        return stats
@@ -0,0 +1,220 @@
+# Serial link latency benchmark against a simulated robot controller
+#
+# Runs raspiaruco.py on a video file with its serial port connected to one
+# end of a pseudo-terminal pair. The pty itself delivers instantly, so the
+# UART wire is modelled at the configured baud rate on both ends: the
+# runtime runs with --pace-writes, which holds every write for its time on
+# the wire as a UART's flush does, and the simulated controller reading
+# the other end lets every byte arrive 10 bit times after the one before
+# it. The writer's queueing delay therefore depends on the baud rate as it
+# would on the robot. With the binary protocol each frame carries its
+# capture timestamp, which gives the time from frame capture to the last
+# byte of the command reaching the controller. The runtime is run once for
+# every combination of baud rate and output policy, and the results are
+# written to a JSON file, to size the link before raising the control rate.
+#
+#   python src/linkbench.py [--video FILE] [--bauds 9600 115200] [--min-intervals 0.1 0.02]
+import argparse
+import itertools
+import json
+import os
+import re
+import select
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+
+from benchmark import TESTING_DIR, find_images
+from protocol import FrameDecoder
+from serialout import CONTROL_SIGNALS
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "raspiaruco.py")
+
+
+# Robot controller stand-in on the master end of the pty
+class SimulatedController:
+    def __init__(self, fd, baud, binary):
+        self.fd = fd
+        self.bit_time = 1.0 / baud
+        self.decoder = FrameDecoder() if binary else None
+
+        self.wire_free = 0.0
+        self.bytes = 0
+        self.commands = 0
+        self.latencies = []
+        self.first = None
+        self.last = None
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="SimulatedController", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            ready, _, _ = select.select([self.fd], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.fd, 4096)
+            except OSError:
+                break
+            now = time.monotonic()
+
+            # The bytes leave the wire one after the other at 10 bit
+            # times each, once the bytes before them have left
+            self.wire_free = max(self.wire_free, now) + len(data) * 10 * self.bit_time
+            self.bytes += len(data)
+            if self.first is None:
+                self.first = now
+            self.last = self.wire_free
+
+            if self.decoder is None:
+                self.commands += len(data)
+                continue
+            for frame in self.decoder.feed(data):
+                self.commands += 1
+
+                # Only frames from a captured frame carry a capture time,
+                # control signals such as the ready signal do not
+                if frame.command.encode() in CONTROL_SIGNALS or frame.timestamp == 0:
+                    continue
+                # Timestamps are milliseconds of time.monotonic(), wrapping at 2^32
+                arrived = int(self.wire_free * 1000) & 0xFFFFFFFF
+                sent = int(round(frame.timestamp * 1000)) & 0xFFFFFFFF
+                self.latencies.append((arrived - sent) & 0xFFFFFFFF)
+
+    def stop(self):
+        self.running = False
+        self.thread.join(timeout=1.0)
+
+    def stats(self):
+        duration = (self.last - self.first) if self.first is not None and self.last > self.first else 0.0
+        stats = {
+            "bytes": self.bytes,
+            "commands": self.commands,
+            "commands_per_s": self.commands / duration if duration else 0.0,
+            "wire_utilisation": self.bytes * 10 * self.bit_time / duration if duration else 0.0,
+        }
+        if self.latencies:
+            ordered = sorted(self.latencies)
+            n = len(ordered)
+            stats["latency_ms"] = {
+                "mean": statistics.mean(ordered),
+                "p50": ordered[int(0.50 * (n - 1))],
+                "p95": ordered[int(0.95 * (n - 1))],
+                "max": ordered[-1],
+            }
+        if self.decoder is not None:
+            stats["crc_errors"] = self.decoder.errors
+        return stats
+
+
+# Write the bundled test photos to a video file, each shown for a number
+# of frames, so the benchmark runs without a camera
+def make_video(path, frames_per_image=15):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (1000, 700))
+    for filename in find_images([os.path.join(TESTING_DIR, "card-detection"), os.path.join(TESTING_DIR, "gates-scenario-detection")]):
+        image = cv2.imread(filename)
+        if image is None:
+            continue
+        image = cv2.resize(image, (1000, 700))
+        for _ in range(frames_per_image):
+            writer.write(image)
+    writer.release()
+
+
+# Queueing statistics printed by raspiaruco.py when it exits
+WRITER_PATTERNS = {
+    "written": r"Commands written: (\d+)",
+    "coalesced": r"coalesced: (\d+)",
+    "dropped": r"dropped: (\d+)",
+    "avg_queue_delay_ms": r"Avg queue delay \(ms\): ([\d.]+)",
+    "max_queue_delay_ms": r"max queue delay \(ms\): ([\d.]+)",
+}
+
+
+def run_once(video, baud, minInterval, controlRate, args):
+    master, slave = os.openpty()
+    controller = SimulatedController(master, baud, args.protocol == "binary")
+
+    command = [sys.executable, SCRIPT, video, "--port", os.ttyname(slave), "--baud", str(baud),
+        "--protocol", args.protocol, "--min-interval", str(minInterval), "--control-rate", str(controlRate), "--pace-writes"]
+    command += args.runtime_args
+    start = time.monotonic()
+    result = subprocess.run(command, capture_output=True, text=True, timeout=args.timeout)
+    elapsed = time.monotonic() - start
+
+    # Let the last bytes arrive before reading the statistics
+    time.sleep(0.2)
+    controller.stop()
+    os.close(slave)
+    os.close(master)
+
+    stats = controller.stats()
+    stats["runtime_s"] = elapsed
+    stats["exit_code"] = result.returncode
+    writer = {}
+    for name, pattern in WRITER_PATTERNS.items():
+        match = re.search(pattern, result.stdout)
+        if match:
+            writer[name] = float(match.group(1))
+    stats["writer"] = writer
+    if result.returncode != 0:
+        stats["error"] = result.stderr.strip().splitlines()[-1:] or ["exit code %d" % result.returncode]
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the serial command path against a simulated robot controller")
+    parser.add_argument("--video", default=None,
+        help="video file to run the runtime on (default: a video made from the bundled test photos)")
+    parser.add_argument("--bauds", type=int, nargs="+", default=[9600, 115200],
+        help="baud rates to simulate (default 9600 115200)")
+    parser.add_argument("--min-intervals", type=float, nargs="+", default=[0.1, 0.02],
+        help="--min-interval output policies to compare (default 0.1 0.02)")
+    parser.add_argument("--control-rates", type=float, nargs="+", default=[0],
+        help="--control-rate output policies to compare, 0 for one command per frame (default 0)")
+    parser.add_argument("--protocol", choices=["ascii", "binary"], default="binary",
+        help="UART protocol, latency is only measured with binary frames (default binary)")
+    parser.add_argument("--timeout", type=float, default=120,
+        help="seconds each runtime run may take (default 120)")
+    parser.add_argument("--output", default="linkbench.json",
+        help="JSON file to write the results to (default linkbench.json)")
+    parser.add_argument("runtime_args", nargs=argparse.REMAINDER,
+        help="further options passed to raspiaruco.py after --")
+    args = parser.parse_args()
+    if args.runtime_args[:1] == ["--"]:
+        args.runtime_args = args.runtime_args[1:]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video = args.video
+        if video is None:
+            video = os.path.join(tmp, "testing.avi")
+            make_video(video)
+
+        runs = []
+        print("[INFO] %7s %8s %7s %9s %8s %8s %8s %9s" % ("baud", "interval", "rate", "cmds/s", "p50 ms", "p95 ms", "wire", "queue ms"))
+        for baud, minInterval, controlRate in itertools.product(args.bauds, args.min_intervals, args.control_rates):
+            stats = run_once(video, baud, minInterval, controlRate, args)
+            stats.update({"baud": baud, "min_interval": minInterval, "control_rate": controlRate})
+            runs.append(stats)
+
+            latency = stats.get("latency_ms", {})
+            print("[INFO] %7d %8.3f %7.1f %9.1f %8.1f %8.1f %7.0f%% %9.1f" % (baud, minInterval, controlRate,
+                stats["commands_per_s"], latency.get("p50", 0), latency.get("p95", 0),
+                stats["wire_utilisation"] * 100.0, stats["writer"].get("avg_queue_delay_ms", 0.0)))
+            if "error" in stats:
+                print("[INFO] Runtime failed: " + " ".join(stats["error"]))
+
+    with open(args.output, "w") as f:
+        json.dump({"protocol": args.protocol, "runs": runs}, f, indent=2)
+    print("[INFO] Results written to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# Concurrent detection on several cameras, merged into one gate view
+#
+# A single camera's field of view limits how early the robot sees a gate
+# it approaches at an angle. MultiCamera captures each camera on its own
+# FrameCapture thread and runs each camera's detector on its own worker
+# thread, so all cameras are detected at the same time (detectMarkers
+# releases the GIL) and a cycle takes about as long as the slowest camera.
+#
+# The marker corners of every camera are projected into one cylindrical
+# panorama around the robot: x is the bearing and y the elevation, both in
+# pixels of a 1000x700 frame of one camera, so marker sizes stay the same.
+# Gates are paired in the panorama exactly as in a single frame, which also
+# finds gates whose two markers are seen by different cameras. A marker
+# seen by two overlapping cameras is kept once. The target of the gate is
+# mapped back into the frame of the first camera, so a command letter
+# steers towards the same bearing however many cameras are attached, and
+# a gate outside that frame steers fully left or right. Cameras whose frame was
+# captured more than max_skew before the newest frame are left out of the
+# merge, so every merged frame shows the scene at about one moment.
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from capture import FrameCapture, camera_source
+from calibration import CameraModel
+from detection import create_parameters, create_detector, prepare_frame
+from gates import Detections
+
+# Size of the frame of one camera the panorama is measured in
+FRAME_WIDTH = 1000
+FRAME_HEIGHT = 700
+
+# Bearings further than this from the first camera's axis have no point
+# in its frame and are mapped to this bearing
+MAX_BEARING = math.radians(85.0)
+
+
+# Add the multi-camera options to an argparse parser
+def add_multicamera_arguments(parser):
+    parser.add_argument("--extra-cameras", type=camera_source, nargs="+", default=[], metavar="CAMERA",
+        help="further cameras, or video files, detected together with the first one")
+    parser.add_argument("--camera-yaws", type=float, nargs="+", default=None, metavar="DEG",
+        help="mounting yaw of each camera in degrees, positive to the right (default: side by side, one field of view apart)")
+    parser.add_argument("--camera-fov", type=float, default=62.2,
+        help="horizontal field of view of the cameras in degrees, unused with --calibration (default 62.2)")
+    parser.add_argument("--max-skew", type=float, default=0.05,
+        help="seconds a camera's frame may be older than the newest frame and still be merged (default 0.05)")
+
+
+# Yaws of n cameras side by side, centred on the robot's heading
+def default_yaws(n, fov):
+    return [(i - (n - 1) / 2.0) * fov for i in range(n)]
+
+
+# One camera with its own capture thread, detector and projection
+class CameraView:
+    def __init__(self, source, yaw, fov, arucoDict, options, camera=None, **capture):
+        self.cam = FrameCapture(source, **capture)
+        self.yaw = math.radians(yaw)
+        self.tan_half_fov = math.tan(math.radians(fov) / 2.0)
+        self.camera = camera
+        self.options = options
+
+        # Adaptive tuning changes the parameters, so each camera has its own
+        self.detect = create_detector(arucoDict, create_parameters(), options)
+        self.buffers = {} if capture.get("reuse") else None
+
+        # Frame, capture time and detection time of the last process()
+        self.frame = None
+        self.timestamp = 0.0
+        self.detect_ms = 0.0
+
+    # Capture and detect the newest frame. Returns the corners as an
+    # (N, 4, 2) array and the ids, or None once the stream has ended.
+    def process(self, scale):
+        ok, frame = self.cam.read()
+        if not ok:
+            return None
+        start = time.perf_counter()
+        self.timestamp = self.cam.frame_timestamp
+        self.frame = prepare_frame(frame, self.options, scale, self.buffers)
+        corners, ids, _ = self.detect(self.frame)
+        self.detect_ms = (time.perf_counter() - start) * 1000.0
+
+        if ids is None or len(corners) == 0:
+            return np.empty((0, 4, 2), dtype=np.float32), np.empty(0, dtype=np.int32)
+        return np.asarray(corners, dtype=np.float32).reshape(-1, 4, 2), np.asarray(ids, dtype=np.int32).reshape(-1)
+
+    # Focal length and principal point in pixels of a frame of this size
+    def intrinsics(self, width, height):
+        if self.camera is not None:
+            scale = self.camera.scale(width, height)
+            matrix = self.camera.camera_matrix
+            return matrix[0, 0] / scale[0], matrix[0, 2] / scale[0], matrix[1, 2] / scale[1]
+        return width / 2.0 / self.tan_half_fov, width / 2.0, height / 2.0
+
+    # Corners of a frame of this size in panorama pixels, focal is the
+    # panorama's pixels per radian and origin the bearing of its left edge
+    def project(self, corners, width, height, focal, origin):
+        f, cx, cy = self.intrinsics(width, height)
+        dx = corners[..., 0] - cx
+        dy = corners[..., 1] - cy
+        bearing = self.yaw + np.arctan2(dx, f)
+        projected = np.empty_like(corners)
+        projected[..., 0] = (bearing - origin) * focal
+        projected[..., 1] = FRAME_HEIGHT / 2.0 + focal * dy / np.hypot(dx, f)
+        return projected
+
+
+class MultiCamera:
+    def __init__(self, sources, yaws, fov, arucoDict, options, max_skew=0.05, **capture):
+        camera = CameraModel.load(options.calibration) if getattr(options, "calibration", None) else None
+        if yaws is None:
+            yaws = default_yaws(len(sources), fov)
+        self.views = [CameraView(source, yaw, fov, arucoDict, options, camera, **capture)
+            for source, yaw in zip(sources, yaws)]
+        self.max_skew = max_skew
+        self.executor = ThreadPoolExecutor(max_workers=len(self.views), thread_name_prefix="MultiCamera")
+
+        # Panorama covering the field of view of every camera
+        f, cx, _ = self.views[0].intrinsics(FRAME_WIDTH, FRAME_HEIGHT)
+        halfFov = math.atan2(cx, f)
+        bearings = [view.yaw for view in self.views]
+        self.focal = f
+        self.origin = min(bearings) - halfFov
+        self.width = int(round(f * (max(bearings) - min(bearings) + 2 * halfFov)))
+        self.height = FRAME_HEIGHT
+
+        # Details of the last read(): the first camera's frame, the
+        # capture time of the oldest merged frame and the slowest detection
+        self.frame = None
+        self.timestamp = 0.0
+        self.frame_age = 0.0
+        self.detect_ms = 0.0
+
+        # Statistics of the merge
+        self.cycles = 0
+        self.stale = 0
+        self.duplicates = 0
+        self.max_skew_seen = 0.0
+        self.cycle_ms = 0.0
+        self.slowest_ms = 0.0
+
+    def isOpened(self):
+        return all(view.cam.isOpened() for view in self.views)
+
+    def set_on_demand(self, on_demand):
+        for view in self.views:
+            view.cam.set_on_demand(on_demand)
+
+    # Capture time of the last merged frames, named as on FrameCapture
+    @property
+    def frame_timestamp(self):
+        return self.timestamp
+
+    # Capture and detect every camera at once and merge their markers.
+    # Returns (ok, corners, ids) with the corners in panorama pixels as
+    # an (N, 4, 2) array, in the form gates.Detections takes.
+    def read(self, scale=1.0):
+        start = time.perf_counter()
+        results = list(self.executor.map(lambda view: view.process(scale), self.views))
+        if any(result is None for result in results):
+            return False, None, None
+
+        newest = max(view.timestamp for view in self.views)
+        oldest = newest
+        corners = []
+        ids = []
+        for view, (viewCorners, viewIds) in zip(self.views, results):
+            skew = newest - view.timestamp
+            if skew > self.max_skew:
+                self.stale += 1
+                continue
+            oldest = min(oldest, view.timestamp)
+            self.max_skew_seen = max(self.max_skew_seen, skew)
+            if len(viewIds):
+                height, width = view.frame.shape[:2]
+                corners.append(view.project(viewCorners, width, height, self.focal, self.origin))
+                ids.append(viewIds)
+
+        if corners:
+            corners, ids = self.deduplicate(np.concatenate(corners), np.concatenate(ids))
+        else:
+            corners, ids = np.empty((0, 4, 2), dtype=np.float32), np.empty(0, dtype=np.int32)
+
+        self.frame = self.views[0].frame
+        self.timestamp = oldest
+        self.frame_age = time.monotonic() - oldest
+        self.detect_ms = max(view.detect_ms for view in self.views)
+        self.cycles += 1
+        self.cycle_ms += (time.perf_counter() - start) * 1000.0
+        self.slowest_ms += self.detect_ms
+        return True, corners, ids
+
+    # A point of the panorama in pixels of the first camera's frame, the
+    # frame the gate commands are measured in
+    def to_main_frame(self, point):
+        view = self.views[0]
+        f, cx, cy = view.intrinsics(FRAME_WIDTH, FRAME_HEIGHT)
+        bearing = point[0] / self.focal + self.origin - view.yaw
+        bearing = min(max(bearing, -MAX_BEARING), MAX_BEARING)
+        dx = f * math.tan(bearing)
+        dy = (point[1] - FRAME_HEIGHT / 2.0) * math.hypot(dx, f) / self.focal
+        return (cx + dx, cy + dy)
+
+    # Drop markers that overlap a larger marker with the same id, the
+    # same marker seen by two cameras
+    def deduplicate(self, corners, ids):
+        if len(ids) < 2:
+            return corners, ids
+        detections = Detections(corners, ids)
+        keep = np.ones(len(detections), dtype=bool)
+        for i in range(len(detections)):
+            if not keep[i]:
+                continue
+            distance = np.linalg.norm(detections.centres[i + 1:] - detections.centres[i], axis=1)
+            same = (detections.ids[i + 1:] == detections.ids[i]) & (distance < detections.sizes[i] / 2)
+            keep[i + 1:] &= ~same
+        self.duplicates += len(keep) - int(keep.sum())
+        return detections.corners[keep], detections.ids[keep]
+
+    def stats(self):
+        captures = [view.cam.stats() for view in self.views]
+        return {
+            "cameras": len(self.views),
+            "captured": sum(s["captured"] for s in captures),
+            "delivered": sum(s["delivered"] for s in captures),
+            "dropped": sum(s["dropped"] for s in captures),
+            "skipped": sum(s["skipped"] for s in captures),
+            "frame_age_ms": self.frame_age * 1000.0,
+            "format": captures[0]["format"],
+            "cycles": self.cycles,
+            "stale": self.stale,
+            "duplicates": self.duplicates,
+            "max_skew_ms": self.max_skew_seen * 1000.0,
+            "avg_cycle_ms": self.cycle_ms / self.cycles if self.cycles else 0.0,
+            "avg_slowest_detect_ms": self.slowest_ms / self.cycles if self.cycles else 0.0,
+        }
+
+    def release(self):
+        self.executor.shutdown()
+        for view in self.views:
+            view.cam.release()
@@ -0,0 +1,73 @@
+# Multi-scale ArUco detection with full-resolution corner refinement
+#
+# Markers are searched for on a downscaled pyramid level of the frame,
+# picked so that the smallest marker we expect to see is still large
+# enough to decode. The corners found there are mapped back to the
+# original frame and refined with cornerSubPix, converting only the small
+# windows around each marker to grayscale, so the results stay in
+# original-frame pixel units.
+import math
+
+import numpy as np
+import cv2
+
+
+class MultiScaleDetector:
+    def __init__(self, dictionary, parameters, min_marker_size=48, detect_size=24, refine=True):
+        self.dictionary = dictionary
+        self.parameters = parameters
+        self.refine = refine
+
+        # Pyramid level at which a marker of min_marker_size pixels (side
+        # length in the original frame) shrinks to about detect_size pixels
+        self.level = max(0, int(math.floor(math.log2(min_marker_size / detect_size))))
+        self.scale = 1.0 / (2 ** self.level)
+
+        # Half size of the corner refinement window in original pixels
+        self.window = 2 ** self.level + 1
+        self.criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 0.05)
+
+    # Detect markers in a frame, returns the same (corners, ids, rejected)
+    # layout as cv2.aruco.detectMarkers
+    def __call__(self, frame):
+        if self.level == 0:
+            return cv2.aruco.detectMarkers(frame, self.dictionary, parameters=self.parameters)
+
+        height, width = frame.shape[:2]
+        small = cv2.resize(frame, (int(width * self.scale), int(height * self.scale)),
+            interpolation=cv2.INTER_AREA)
+
+        corners, ids, rejected = cv2.aruco.detectMarkers(small, self.dictionary, parameters=self.parameters)
+        if ids is None:
+            return corners, ids, rejected
+
+        # Map pixel centres of the pyramid level back to the original frame
+        fx = width / small.shape[1]
+        fy = height / small.shape[0]
+        scaled = []
+        for c in corners:
+            c = (c + 0.5) * np.array([fx, fy], dtype=np.float32) - 0.5
+            if self.refine:
+                c = self._refine(frame, c)
+            scaled.append(c.astype(np.float32))
+
+        return tuple(scaled), ids, rejected
+
+    # Refine the corners of one marker in a window of the original frame
+    def _refine(self, frame, corners):
+        height, width = frame.shape[:2]
+        margin = self.window + 2
+        x0 = max(0, int(corners[0, :, 0].min()) - margin)
+        y0 = max(0, int(corners[0, :, 1].min()) - margin)
+        x1 = min(width, int(corners[0, :, 0].max()) + margin + 1)
+        y1 = min(height, int(corners[0, :, 1].max()) + margin + 1)
+
+        roi = frame[y0:y1, x0:x1]
+        if roi.ndim == 3:
+            roi = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+
+        points = (corners[0] - np.array([x0, y0], dtype=np.float32)).reshape(-1, 1, 2)
+        points = np.ascontiguousarray(points, dtype=np.float32)
+        cv2.cornerSubPix(roi, points, (self.window, self.window), (-1, -1), self.criteria)
+
+        return (points.reshape(1, 4, 2) + np.array([x0, y0], dtype=np.float32))
@@ -0,0 +1,58 @@
+# Overlay drawing for the desktop detection tools
+#
+# Drawing is kept separate from detection so the scripts can decide per
+# frame whether an overlay is needed at all. Every overlay element is
+# drawn once per rendered frame.
+import cv2
+
+
+# Draw the outlines, centres and IDs of all detected markers
+def draw_markers(image, detections):
+    if len(detections) == 0:
+        return
+
+    # Outline all markers in a single call
+    corners = [c.reshape(1, 4, 2) for c in detections.corners]
+    cv2.aruco.drawDetectedMarkers(image, corners)
+
+    for markerCorners, markerID in zip(detections.corners, detections.ids):
+        # corners are always in top-left, top-right, bottom-right,
+        # and bottom-left order
+        topLeft = (int(markerCorners[0][0]), int(markerCorners[0][1]))
+        bottomRight = (int(markerCorners[2][0]), int(markerCorners[2][1]))
+
+        # draw the center (x, y)-coordinates of the ArUco marker
+        cX = int((topLeft[0] + bottomRight[0]) / 2.0)
+        cY = int((topLeft[1] + bottomRight[1]) / 2.0)
+        cv2.circle(image, (cX, cY), 4, (255, 0, 0), -1)
+
+        # draw the ArUco marker ID on the frame
+        cv2.putText(image, str(markerID),
+            (topLeft[0], topLeft[1] - 15),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.5, (0, 255, 0), 2)
+
+
+# Function to draw a circle at the target point and the label below it
+def drawtarget(image, target, asc):
+    # Initialise midpoint coordinates
+    x_mid, y_mid = target
+
+    # draw a circle at the midpoint when gate is detected
+    if not asc == "?":
+        cv2.circle(image, (int(x_mid), int(y_mid)), 5, (0, 0, 255), -1)
+
+    # draw the ASCII character on the frame
+    cv2.putText(image, asc,
+        (int(x_mid), int(y_mid + 30)),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        0.5, (0, 255, 0), 2)
+
+
+# Draw the complete overlay of one frame: frame centre, markers and
+# the (point, text) labels produced by the gate logic
+def draw_overlay(image, detections, centre, labels):
+    cv2.circle(image, centre, 1, (255, 255, 255), -1)
+    draw_markers(image, detections)
+    for point, text in labels:
+        drawtarget(image, point, text)
@@ -0,0 +1,163 @@
+# Multi-core detection on a pool of worker processes
+#
+# On quad-core boards detectMarkers only keeps one core busy. ParallelDetector
+# spreads consecutive frames over a pool of worker processes. Frames are
+# copied once into slots of a shared memory block instead of being pickled,
+# and only the small corner and id arrays come back through a queue. Results
+# are handed back strictly in frame order, at most one frame per worker in
+# flight, so latency stays bounded to a few frames.
+#
+# The workers are forked when the pool is created, which has to happen
+# before the caller starts any threads: a process forked while other
+# threads hold locks can deadlock. The shared memory block is only created
+# with the first frame, and its name travels with every task.
+import multiprocessing as mp
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+from detection import create_dictionary, create_parameters, create_detector
+
+
+# Worker process, detects markers in the frames placed in the slots of
+# the shared memory block named in each task. The pool already keeps the
+# cores busy, so OpenCV's own threads would only compete with it.
+def _worker(options, tasks, results):
+    cv2.setNumThreads(1)
+    shm = None
+    frames = None
+    detect = create_detector(create_dictionary(), create_parameters(), options)
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot, shm_name, shape, dtype = task
+            if shm is None:
+                shm = shared_memory.SharedMemory(name=shm_name)
+                frames = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+            corners, ids, _ = detect(frames[slot])
+            if ids is None or len(ids) == 0:
+                results.put((seq, slot, None, None))
+            else:
+                results.put((seq, slot, np.concatenate([c.reshape(1, 4, 2) for c in corners]), ids))
+    finally:
+        del frames
+        if shm is not None:
+            shm.close()
+
+
+class ParallelDetector:
+    def __init__(self, options, workers=3):
+        self.options = options
+        self.workers = workers
+
+        # One slot per worker, a frame is copied into a free slot and
+        # the slot is released when its result comes back
+        self.slots = workers
+        self.frame_shape = None
+        self.shm = None
+        self.frames = None
+        self.free = list(range(self.slots))
+
+        # Fork explicitly, the workers inherit the options without pickling
+        # and do not re-run the calling script. The resource tracker is
+        # started first so the workers share it: a worker that started its
+        # own would unlink the shared memory block when it exits.
+        resource_tracker.ensure_running()
+        context = mp.get_context("fork")
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.processes = []
+        for _ in range(workers):
+            p = context.Process(target=_worker, daemon=True, args=(options, self.tasks, self.results))
+            p.start()
+            self.processes.append(p)
+
+        # Frames in flight in submission order, and results that came
+        # back before an older frame finished
+        self.next_seq = 0
+        self.pending = []
+        self.done = {}
+
+        # Statistics of the pool
+        self.submitted = 0
+        self.completed = 0
+        self.max_reorder = 0
+
+    # Allocate the frame slots for the size of the first frame
+    def _allocate(self, frame):
+        self.frame_shape = frame.shape
+        shape = (self.slots,) + frame.shape
+        size = int(np.prod(shape)) * frame.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.frames = np.ndarray(shape, dtype=frame.dtype, buffer=self.shm.buf)
+
+    # Collect one result from the workers into the reorder buffer
+    def _collect(self):
+        seq, slot, corners, ids = self.results.get()
+        self.free.append(slot)
+        self.done[seq] = (corners, ids)
+        self.completed += 1
+        self.max_reorder = max(self.max_reorder, len(self.done))
+
+    # Submit a frame and return the detections of the oldest frame in
+    # flight once every worker is busy, as (timestamp, corners, ids,
+    # rejected), or None while the pipeline is still filling up
+    def detect(self, frame, timestamp):
+        if self.shm is None:
+            self._allocate(frame)
+        elif frame.shape != self.frame_shape:
+            raise ValueError("frame shape %s does not match the pool's %s" % (frame.shape, self.frame_shape))
+
+        # Wait for a slot, results that arrive meanwhile are kept
+        while not self.free:
+            self._collect()
+
+        slot = self.free.pop()
+        self.frames[slot] = frame
+        self.tasks.put((self.next_seq, slot, self.shm.name, self.frames.shape, self.frames.dtype.str))
+        self.pending.append((self.next_seq, timestamp))
+        self.next_seq += 1
+        self.submitted += 1
+
+        if len(self.pending) < self.workers:
+            return None
+        return self._next_result()
+
+    # Detections of the oldest frame in flight, in frame order
+    def _next_result(self):
+        seq, timestamp = self.pending.pop(0)
+        while seq not in self.done:
+            self._collect()
+        corners, ids = self.done.pop(seq)
+
+        if corners is None:
+            return timestamp, (), None, []
+        return timestamp, tuple(c.reshape(1, 4, 2) for c in corners), ids, []
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "max_reorder": self.max_reorder,
+        }
+
+    def close(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for p in self.processes:
+            p.join(timeout=2.0)
+            if p.is_alive():
+                p.terminate()
+        self.processes = []
+
+        if self.shm is not None:
+            self.frames = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
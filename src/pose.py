@@ -0,0 +1,88 @@
+# Metric marker and gate pose
+#
+# The gate logic steers by pixel position and judges distance by pixel
+# size, which depend on the lens and the resolution. With the camera
+# intrinsics and the printed marker side length, PoseEstimator solves the
+# pose of every detected marker in one batched call and derives the range
+# and bearing of each marker and of the selected gate in metres and degrees.
+#
+# The camera frame is x right, y down and z forward. Bearing is the angle
+# to the right of the optical axis, range the distance in the ground plane
+# (x, z). Gate yaw is the rotation of the line from the left to the right
+# marker, zero when the gate faces the camera squarely.
+import math
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+GatePose = namedtuple("GatePose", ["range", "bearing", "yaw", "width", "centre"])
+
+
+# Positions of all markers of one frame, as arrays in marker order
+class MarkerPoses:
+    def __init__(self, tvecs, rvecs):
+        self.tvecs = tvecs
+        self.rvecs = rvecs
+        self.ranges = np.hypot(tvecs[:, 0], tvecs[:, 2])
+        self.bearings = np.degrees(np.arctan2(tvecs[:, 0], tvecs[:, 2]))
+
+    def __len__(self):
+        return len(self.tvecs)
+
+
+class PoseEstimator:
+    # camera is a calibration.CameraModel, marker_length the side of the
+    # black marker square in metres. Corners from a detector built with
+    # --calibration are already undistorted, otherwise pass undistorted=False.
+    def __init__(self, camera, marker_length, undistorted=True):
+        self.camera = camera
+        self.marker_length = marker_length
+        self.dist_coeffs = np.zeros(5) if undistorted else camera.dist_coeffs
+
+        # Marker corners in the marker's own frame, for the solvePnP fallback
+        half = marker_length / 2.0
+        self.object_points = np.array(
+            [[-half, half, 0], [half, half, 0], [half, -half, 0], [-half, -half, 0]], dtype=np.float32)
+
+    # Poses of all markers of a gates.Detections, found in a frame of the
+    # given size
+    def estimate(self, detections, width, height):
+        if len(detections) == 0:
+            return MarkerPoses(np.empty((0, 3)), np.empty((0, 3)))
+
+        # Corners back in calibration pixels, one call for all markers
+        scale = self.camera.scale(width, height).astype(np.float32)
+        corners = detections.corners * scale
+        if hasattr(cv2.aruco, "estimatePoseSingleMarkers"):
+            rvecs, tvecs, _ = cv2.aruco.estimatePoseSingleMarkers(
+                list(corners.reshape(-1, 1, 4, 2)), self.marker_length, self.camera.camera_matrix, self.dist_coeffs)
+            return MarkerPoses(tvecs.reshape(-1, 3), rvecs.reshape(-1, 3))
+
+        # OpenCV 4.7 and later dropped the batched call
+        rvecs = []
+        tvecs = []
+        for c in corners:
+            _, rvec, tvec = cv2.solvePnP(self.object_points, c, self.camera.camera_matrix, self.dist_coeffs,
+                flags=cv2.SOLVEPNP_IPPE_SQUARE)
+            rvecs.append(rvec.reshape(3))
+            tvecs.append(tvec.reshape(3))
+        return MarkerPoses(np.array(tvecs), np.array(rvecs))
+
+    # Pose of the gate between the left and right markers of a
+    # gates.GateResult, or None when there is no valid gate
+    @staticmethod
+    def gate(poses, result):
+        if result is None or result.target is None:
+            return None
+        left = poses.tvecs[result.left]
+        right = poses.tvecs[result.right]
+        centre = (left + right) / 2.0
+        dx, dz = right[0] - left[0], right[2] - left[2]
+        return GatePose(
+            range=float(math.hypot(centre[0], centre[2])),
+            bearing=math.degrees(math.atan2(centre[0], centre[2])),
+            yaw=math.degrees(math.atan2(dz, dx)),
+            width=float(math.hypot(dx, dz)),
+            centre=tuple(float(v) for v in centre),
+        )
@@ -0,0 +1,144 @@
+# Compact binary framed protocol for the UART link
+#
+# The legacy protocol sends one ASCII character per frame, with the target
+# x-coordinate quantized into 26 letters. In binary mode every command is
+# sent as a fixed-size 16 byte frame instead:
+#
+#   offset  size  field
+#   0       2     sync bytes 0xAA 0x55
+#   2       1     command character ('A'-'Z', '?', '-', '&', '!', '@', '%', '<')
+#   3       2     sequence number, wraps at 65536
+#   5       4     capture timestamp in milliseconds, wraps at 2^32
+#   9       2     target x, 0-65535 across the frame width
+#   11      2     target y, 0-65535 down the frame height
+#   13      2     gate size (marker diagonal) in pixels
+#   15      1     CRC-8 (polynomial 0x07) of bytes 2-14
+#
+# Gate commands can instead be sent as pose frames of the same size, with
+# the metric gate position from pose.py in place of the pixel target:
+#
+#   0       2     sync bytes 0xAA 0x56
+#   2       1     gate command character
+#   3       2     sequence number, shared with target frames
+#   5       4     capture timestamp in milliseconds
+#   9       2     bearing to the gate centre, signed, 0.01 degree units
+#   11      2     range to the gate centre in millimetres
+#   13      2     gate yaw, signed, 0.01 degree units
+#   15      1     CRC-8 of bytes 2-14
+#
+# All fields are little-endian. At 9600 baud a frame takes about 17 ms.
+import struct
+from collections import namedtuple
+
+SYNC = b"\xaa\x55"
+BODY = struct.Struct("<cHIHHH")
+FRAME_SIZE = len(SYNC) + BODY.size + 1
+
+POSE_SYNC = b"\xaa\x56"
+POSE_BODY = struct.Struct("<cHIhHh")
+
+Frame = namedtuple("Frame", ["command", "seq", "timestamp", "x", "y", "size"])
+PoseFrame = namedtuple("PoseFrame", ["command", "seq", "timestamp", "bearing", "range", "yaw"])
+
+# Lookup table for CRC-8 with polynomial 0x07
+CRC8_TABLE = []
+for byte in range(256):
+    crc = byte
+    for _ in range(8):
+        crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    CRC8_TABLE.append(crc)
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+# Build a frame, x and y are fractions (0-1) of the frame width and height
+def encode_frame(command, seq, timestamp, x=0.0, y=0.0, size=0.0):
+    body = BODY.pack(
+        command.encode() if isinstance(command, str) else command,
+        seq & 0xFFFF,
+        int(timestamp * 1000) & 0xFFFFFFFF,
+        min(65535, max(0, int(round(x * 65535)))),
+        min(65535, max(0, int(round(y * 65535)))),
+        min(65535, max(0, int(round(size)))),
+    )
+    return SYNC + body + bytes([crc8(body)])
+
+
+def clamp16(value, signed=True):
+    if signed:
+        return min(32767, max(-32768, int(round(value))))
+    return min(65535, max(0, int(round(value))))
+
+
+# Copy of a target or pose frame with its sequence number replaced and
+# the CRC updated, so numbers are given out when a frame is written
+def with_sequence(frame, seq):
+    body = bytearray(frame[len(SYNC):FRAME_SIZE - 1])
+    struct.pack_into("<H", body, 1, seq & 0xFFFF)
+    return bytes(frame[:len(SYNC)]) + bytes(body) + bytes([crc8(body)])
+
+
+# Build a pose frame, bearing and yaw in degrees, distance in metres
+def encode_pose_frame(command, seq, timestamp, bearing, distance, yaw):
+    body = POSE_BODY.pack(
+        command.encode() if isinstance(command, str) else command,
+        seq & 0xFFFF,
+        int(timestamp * 1000) & 0xFFFFFFFF,
+        clamp16(bearing * 100),
+        clamp16(distance * 1000, signed=False),
+        clamp16(yaw * 100),
+    )
+    return POSE_SYNC + body + bytes([crc8(body)])
+
+
+# Incremental decoder, feed() it bytes as they arrive from the port and
+# it returns the complete Frame and PoseFrame tuples found so far. Corrupt
+# frames are skipped by searching for the next sync bytes.
+class FrameDecoder:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frames = 0
+        self.errors = 0
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+
+        while True:
+            # Next 0xAA followed by either sync byte, a trailing 0xAA is
+            # kept in case it starts the next frame
+            start = self.buffer.find(SYNC[:1])
+            while start >= 0 and start + 1 < len(self.buffer) and self.buffer[start + 1] not in (SYNC[1], POSE_SYNC[1]):
+                start = self.buffer.find(SYNC[:1], start + 1)
+            if start < 0:
+                self.buffer.clear()
+                break
+            if start > 0:
+                del self.buffer[:start]
+            if len(self.buffer) < FRAME_SIZE:
+                break
+
+            body = bytes(self.buffer[len(SYNC):FRAME_SIZE - 1])
+            if crc8(body) != self.buffer[FRAME_SIZE - 1]:
+                # Not a real frame, skip this sync and search again
+                self.errors += 1
+                del self.buffer[:1]
+                continue
+
+            if self.buffer[1] == POSE_SYNC[1]:
+                command, seq, timestamp, bearing, distance, yaw = POSE_BODY.unpack(body)
+                frames.append(PoseFrame(command.decode("ascii", "replace"), seq,
+                    timestamp / 1000.0, bearing / 100.0, distance / 1000.0, yaw / 100.0))
+            else:
+                command, seq, timestamp, x, y, size = BODY.unpack(body)
+                frames.append(Frame(command.decode("ascii", "replace"), seq,
+                    timestamp / 1000.0, x / 65535.0, y / 65535.0, size))
+            self.frames += 1
+            del self.buffer[:FRAME_SIZE]
+
+        return frames
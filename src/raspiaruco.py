@@ -1,252 +1,534 @@
 # import the necessary packages
 import sys
+import argparse
 import numpy as np
 import cv2
 import serial
 import time
+from capture import FrameCapture, add_capture_arguments, camera_source, parse_size
+from detection import create_dictionary, create_parameters, add_detector_arguments, create_detector, prepare_frame, print_detector_stats
+from serialout import SerialWriter, PacedPort, CONTROL_SIGNALS
+from protocol import encode_frame, encode_pose_frame
+from instrument import Instrumentation
+from gates import Detections, DetectionStore, frame_commands, ascii_command
+from estimator import TargetEstimator, ControlLoop
+from parallel import ParallelDetector
+from recorder import FlightRecorder
+from calibration import CameraModel
+from pose import PoseEstimator
+from scheduler import PowerScheduler, IDLE
+from telemetry import TelemetryServer, add_telemetry_arguments
+from startup import process_age, frame_is_valid, warm_up
+from concurrent.futures import ThreadPoolExecutor
+from allocations import AllocationMonitor
+from multicamera import MultiCamera, add_multicamera_arguments, FRAME_WIDTH, FRAME_HEIGHT
+
+# Start of the process, for the time to the first command
+startTime = time.monotonic() - process_age()
+
+# create custom dictionary of aruco markers
+arucoDict = create_dictionary()
+arucoParams = create_parameters()
+
+# Command line options
+parser = argparse.ArgumentParser()
+parser.add_argument("camera_index", nargs="?", type=camera_source, default=0,
+    help="index of the camera to open (default 0), or a video file to play instead")
+parser.add_argument("--port", default="/dev/serial0",
+    help="serial port the robot controller is connected to (default /dev/serial0)")
+parser.add_argument("--baud", type=int, default=9600,
+    help="serial baud rate (default 9600)")
+parser.add_argument("--pace-writes", action="store_true",
+    help="hold every write for its time on the wire at --baud, for a pseudo-terminal standing in for the UART")
+add_detector_arguments(parser)
+add_capture_arguments(parser)
+add_telemetry_arguments(parser)
+add_multicamera_arguments(parser)
+parser.add_argument("--workers", type=int, default=0,
+    help="detect markers in this many worker processes, one frame each (default 0, detect in the main loop)")
+parser.add_argument("--min-interval", type=float, default=0.1,
+    help="minimum time in seconds between UART commands (default 0.1)")
+parser.add_argument("--protocol", choices=["ascii", "binary"], default="ascii",
+    help="UART protocol, one ASCII character or a 16 byte binary frame per command (default ascii)")
+parser.add_argument("--stats", action="store_true",
+    help="time each stage of the frame loop from the start (toggle at runtime with SIGUSR1)")
+parser.add_argument("--stats-file", default=None,
+    help="JSON file the rolling stage latency statistics are exported to")
+parser.add_argument("--stats-interval", type=float, default=5.0,
+    help="seconds between statistics exports (default 5)")
+parser.add_argument("--control-rate", type=float, default=0,
+    help="send steering commands at this fixed rate in Hz from a filtered target estimate (default 0, one command per frame)")
+parser.add_argument("--filter-alpha", type=float, default=0.5,
+    help="alpha-beta filter position gain (default 0.5)")
+parser.add_argument("--filter-beta", type=float, default=0.1,
+    help="alpha-beta filter velocity gain (default 0.1)")
+parser.add_argument("--max-coast", type=float, default=0.5,
+    help="seconds the estimate is predicted for after the last gate detection (default 0.5)")
+parser.add_argument("--record", default=None,
+    help="ring file to record the detected frames, detections and commands to, for replay.py")
+parser.add_argument("--record-frames", type=int, default=300,
+    help="frames kept in the ring file, older frames are overwritten (default 300)")
+parser.add_argument("--record-size", type=parse_size, default=(500, 350), metavar="WxH",
+    help="largest frame recorded as is, larger frames are downscaled and replay approximately; 1000x700 replays exactly but writes four times as much (default 500x350)")
+parser.add_argument("--marker-length", type=float, default=None,
+    help="side of the printed markers in metres, estimates the gate range and bearing (needs --calibration)")
+parser.add_argument("--send-pose", action="store_true",
+    help="send gate commands as binary pose frames with range, bearing and yaw (needs --marker-length and --protocol binary)")
+parser.add_argument("--power-save", action="store_true",
+    help="scan at a low rate and resolution while no markers are in view")
+parser.add_argument("--idle-rate", type=float, default=2.0,
+    help="frames per second while idle with --power-save (default 2)")
+parser.add_argument("--idle-scale", type=float, default=0.5,
+    help="resolution factor while idle with --power-save (default 0.5)")
+parser.add_argument("--idle-after", type=float, default=1.0,
+    help="seconds without markers before going idle with --power-save (default 1)")
+parser.add_argument("--power-log", default=None,
+    help="JSON Lines file every power state change is appended to")
+parser.add_argument("--fast-start", action="store_true",
+    help="open the camera and warm up the detector during serial setup, signal ready after the first valid frame")
+parser.add_argument("--settle-time", type=float, default=3.0,
+    help="seconds --fast-start waits for a bright, sharp frame before signalling ready anyway (default 3)")
+parser.add_argument("--no-reuse", action="store_true",
+    help="allocate new capture, resize and detection buffers for every frame, for comparison")
+parser.add_argument("--trace-alloc", action="store_true",
+    help="measure the memory allocated per frame with tracemalloc (slows the loop down)")
+args = parser.parse_args()
+if args.record and args.workers > 0:
+    parser.error("--record cannot be combined with --workers")
+if args.telemetry and args.workers > 0:
+    parser.error("--telemetry cannot be combined with --workers")
+if args.marker_length and not args.calibration:
+    parser.error("--marker-length needs --calibration")
+if args.send_pose and not (args.marker_length and args.protocol == "binary"):
+    parser.error("--send-pose needs --marker-length and --protocol binary")
+if args.power_save and args.workers > 0:
+    parser.error("--power-save cannot be combined with --workers")
+if args.send_pose and args.control_rate > 0:
+    parser.error("--send-pose cannot be combined with --control-rate")
+if args.extra_cameras and (args.workers > 0 or args.record or args.marker_length or args.telemetry):
+    parser.error("--extra-cameras cannot be combined with --workers, --record, --marker-length or --telemetry")
+if args.camera_yaws is not None and len(args.camera_yaws) != 1 + len(args.extra_cameras):
+    parser.error("--camera-yaws needs one yaw for every camera")
+camera_index = args.camera_index
+reuse = not args.no_reuse
+
+
+# Open the camera, or all cameras with --extra-cameras
+def open_cameras():
+    capture = dict(gray=args.gray, size=args.capture_size, fps=args.capture_fps, reuse=reuse)
+    if args.extra_cameras:
+        return MultiCamera([camera_index] + args.extra_cameras, args.camera_yaws, args.camera_fov,
+            arucoDict, args, max_skew=args.max_skew, **capture)
+    return FrameCapture(camera_index, **capture)
+
+
+# On multi-core boards consecutive frames are detected in parallel by a
+# pool of worker processes, each with its own detector. The workers are
+# forked here, before any thread is started.
+pool = None
+if args.workers > 0:
+    pool = ParallelDetector(args, workers=args.workers)
+
+# In fast-start mode the camera is opened and the detector warmed up on
+# other threads while the serial port is set up
+startup = None
+if args.fast_start:
+    startup = ThreadPoolExecutor(max_workers=2)
+    cameraOpening = startup.submit(open_cameras)
+    warmingUp = startup.submit(warm_up, arucoDict, arucoParams)
 
 # Initialize UART serial communication
-ser = serial.Serial('/dev/serial0', 9600)
+ser = serial.Serial(args.port, args.baud)
 time.sleep(0.1)
 ser.reset_output_buffer()
 
-# Class to represent the aruco markers as form of gates
-class gate:
-    def __init__(self, corners, ID):
-        self.corners = corners
-        self.ID = ID
-        self.size = cv2.norm(corners[0] - corners[2]) # diagonal length of the marker
-
-# Function to calculate the midpoint between two markers
-def calculate_midpoint(marker1, marker2):
-    x1, y1 = marker1[1] # top-right corner of marker 1
-    x2, y2 = marker2[3] # bottom-left corner of marker 2
-
-    # calculate midpoint
-    x_mid = (x1 + x2) / 2
-    y_mid = (y1 + y2) / 2
-
-    return (x_mid, y_mid)
-
-# create custom dictionary of aruco markers
-arucoDict = cv2.aruco.Dictionary_create(4,4)
-arucoParams = cv2.aruco.DetectorParameters_create()
+# Commands are written by a worker thread so the vision loop never
+# waits on the UART. Binary frames get their sequence numbers when they
+# are written, so replaced or dropped frames leave no gaps.
+writer = SerialWriter(PacedPort(ser, args.baud) if args.pace_writes else ser, min_interval=args.min_interval, sequence=args.protocol == "binary")
+
+# Function to send a command to the robot in the selected protocol,
+# binary frames also carry the exact target, gate size and capture time.
+# Frames not tied to a captured frame, such as the ready signal, carry the
+# time they are sent.
+def send_command(command, target=None, size=0, timestamp=None):
+    if args.protocol == "binary":
+        x, y = (0.0, 0.0)
+        if target is not None:
+            x, y = (target[0] / width, target[1] / height)
+        if timestamp is None:
+            timestamp = time.monotonic()
+        packet = encode_frame(command, 0, timestamp, x, y, size)
+        writer.send(packet, control=command.encode() in CONTROL_SIGNALS)
+    else:
+        writer.send(command)
+
+# Function to send a gate command with the metric gate pose
+def send_pose(command, gatePose, timestamp):
+    packet = encode_pose_frame(command, 0, timestamp, gatePose.bearing, gatePose.range, gatePose.yaw)
+    writer.send(packet)
+
+# Per-stage latency statistics, switched on and off with SIGUSR1
+instr = Instrumentation(enabled=args.stats, export_path=args.stats_file, export_interval=args.stats_interval)
+instr.install_toggle()
+
+# With a fixed control rate, steering commands come from a filtered
+# estimate of the target instead of each frame's own decision
+estimator = None
+control = None
+if args.control_rate > 0:
+    estimator = TargetEstimator(alpha=args.filter_alpha, beta=args.filter_beta, max_coast=args.max_coast)
+
+# Function to send the latest estimate, called by the control loop
+def send_estimate(estimate, status):
+    if estimate is None:
+        send_command(status, timestamp=time.monotonic())
+    else:
+        x, y, size = estimate
+        send_command(ascii_command(x, 1.0), (x * width, y * height), size, time.monotonic())
+
+# Detection function for the selected options
+detect = create_detector(arucoDict, arucoParams, args)
+
+# Metric range and bearing of the gate from the marker poses
+poseEstimator = None
+if args.marker_length:
+    poseEstimator = PoseEstimator(CameraModel.load(args.calibration), args.marker_length)
+gatePose = None
+
+# Function to decode only the frames the loop takes while idle, the
+# camera keeps running so waking up does not wait for it
+def set_power_state(state):
+    cam.set_on_demand(state == IDLE)
+
+# Low rate, low resolution scanning while nothing is in view
+scheduler = None
+if args.power_save:
+    scheduler = PowerScheduler(idle_rate=args.idle_rate, idle_scale=args.idle_scale,
+        idle_after=args.idle_after, log_path=args.power_log, on_change=set_power_state)
+
+# Annotated frames for a viewer on the other end of an SSH tunnel
+telemetry = None
+if args.telemetry:
+    telemetry = TelemetryServer(args.telemetry, host=args.telemetry_host, rate=args.telemetry_rate, quality=args.telemetry_quality)
+    print("[INFO] Telemetry stream on http://%s:%d" % (args.telemetry_host, args.telemetry))
+
+# Flight recorder of the last frames, for replay off the robot
+recorder = None
+if args.record:
+    recorder = FlightRecorder(args.record, slots=args.record_frames, size=args.record_size)
+
+# Function to tell the robot that navigation commands follow
+readyTime = None
+def signal_ready():
+    global control, readyTime
+    readyTime = time.monotonic()
+    signal = "<"
+    send_command(signal)
 
-if len(sys.argv) > 1:
-    camera_index = int(sys.argv[1])
-else:
-    camera_index = 0  # Default camera index
+    # Start steering at the fixed control rate
+    if estimator is not None:
+        control = ControlLoop(estimator, send_estimate, rate=args.control_rate)
 
 # Camera Setup
 print("[INFO] Starting video stream...")
-cam = cv2.VideoCapture(camera_index)
+if startup is not None:
+    cam = cameraOpening.result()
+    print("[INFO] Detector warm-up (ms): %.1f" % (warmingUp.result() * 1000.0))
+    startup.shutdown()
+else:
+    cam = open_cameras()
+cameras = cam if args.extra_cameras else None
 if not cam.isOpened():
     print("[INFO] Cannot open camera")
     signal = "%"
-    ser.write(signal.encode())
-    ser.flush()
+    send_command(signal)
 
     # Release the camera and serial port connection
     # and Exit the program
     cam.release()
+    writer.close()
     ser.close()
     sys.exit()
-else:
+elif not args.fast_start:
     print("[INFO] Camera is ready")
-    signal = "<"
-    ser.write(signal.encode())
-    ser.flush()
+    signal_ready()
     time.sleep(0.5)
 
+# In fast-start mode ready is only signalled once a valid frame has been
+# processed, dark or blurred frames of a settling camera are skipped for
+# at most --settle-time seconds, so a dark start area cannot hold it up
+ready = not args.fast_start
+settleStart = time.monotonic()
+discardedFrames = 0
+firstCommandTime = None
+
+# Function to tell whether a frame is skipped while the camera settles
+def settling(frame):
+    global discardedFrames
+    if ready or frame_is_valid(frame):
+        return False
+    if time.monotonic() - settleStart < args.settle_time:
+        discardedFrames += 1
+        return True
+    print("[INFO] No valid frame within %.1f s, signalling ready anyway" % args.settle_time)
+    return False
+
+# Buffers reused by every frame in the steady state: the resized frames
+# and the detected markers
+frameBuffers = {} if reuse else None
+store = DetectionStore() if reuse else None
+allocations = AllocationMonitor(trace=args.trace_alloc)
+
 # Record of marker IDs detected in stream
 tagID = []
 
 # loop over the frames from the video stream
 while True:
-    # Capture frame-by-frame video stream
-    _, frame = cam.read()
-
-    # grab the frame from the threaded video stream and resize it
-    # to have a maximum width of 1000 pixels
-    # and maximum height of 750 pixels
-    frame = cv2.resize(frame, (1000, 700))
-
-    # Get the height and width of the image
-    _, width, _ = frame.shape
-
-    # List of tags in view
-    tags  = []
-
-    # detect ArUco markers in the input frame
-    (corners, ids, rejected) = cv2.aruco.detectMarkers(frame, arucoDict, parameters=arucoParams)
-    
-    # verify *at least* one ArUco marker was detected
-    if len(corners) > 0:
-        # Add detected ArUco markers to tags list
-        for x in range(len(ids)):
-            # add detected ArUco markers to tags list
-            g = gate(corners[x][0], ids[x])
-            tags.append(g)
-        
-        # Sort tags list by size of ArUco markers in ascending order
-        tags.sort(key = lambda gate: gate.size, reverse = True)
-        
-        gatedetect = False
-        
-        # Scale factor to find convert coordinates to an ascii value
-        # 25 sections (26 characters, 0-25).
-        scale_factor = 25 / width # 25 / 1000 = 0.02
-        
-        # Stop Marker
-        if (tags[0].ID[0] == 3):
-            signal = "!"
-            ser.write(signal.encode())
-            ser.flush()
-            print("[INFO] STOP Marker detected")
-            time.sleep(0.3)
+    # While idle, wait until the next scan is due
+    if scheduler is not None:
+        scheduler.wait()
+
+    allocations.start_frame()
+    t = instr.start()
+    if cameras is not None:
+        # Every camera is captured and detected at once, the markers come
+        # back in pixels of the panorama around the robot
+        ok, corners, ids = cameras.read(scheduler.scale if scheduler is not None else 1.0)
+        if not ok:
+            print("[INFO] Video stream ended")
+            break
+        frame = cameras.frame
+        rejected = None
+
+        # Gate targets and commands are in the first camera's frame
+        width, height = FRAME_WIDTH, FRAME_HEIGHT
+        frameTime = cameras.timestamp
+        detectTime = cameras.detect_ms
+        t = instr.stop("detect", t)
+        instr.record("frame_age", cameras.frame_age * 1000.0)
+
+        if settling(frame):
             continue
-
-        # Start Marker
-        if (tags[0].ID[0] == 2):
-            signal = "&"
-            ser.write(signal.encode())
-            ser.flush()
-            print("[INFO] START Marker detected")
-            time.sleep(0.3)
-	
-        # Check if the gates are aligned correctly
-        if (len(tags) == 2):
-            # Extracting the corners of the markers
-            marker0Corners = tags[0].corners
-            marker1Corners = tags[1].corners
-
-            # Calculate the centre of the markers
-            marker0Center = np.mean(marker0Corners, axis=0).astype(int)
-            marker1Center = np.mean(marker1Corners, axis=0).astype(int)
-
-            # Calculate the midpoint between the two markers to act as target
-            target = calculate_midpoint(marker0Corners, marker1Corners)
-
-            print("[INFO] Detecting Gates") 
-
-            # Close the program using start and stop markers simultaneously
-            if (tags[0].ID[0] == 2 and tags[1].ID[0] == 3) or (tags[0].ID[0] == 3 and tags[1].ID[0] == 2):
-                signal = "@"
-                ser.write(signal.encode())
-                ser.flush()
-                print("[INFO] Stopping video stream")
-                break
-
-            # Default value for ASCII character if no gate is detected
-            asc = '?'
-
-            # Compare the IDs of the markers to verify gate alignment
-            if (tags[0].ID[0] == 0 and tags[1].ID[0] == 1):
-                # Compare the positions of the markers
-                if (marker0Center[0] < marker1Center[0]):
-                    # Scale the target point x-coordinate to an ASCII character value
-                    asc = chr(int((target[0] * scale_factor) + 64))
-                    gatedetect = True
-
-            elif (tags[0].ID[0] == 1 and tags[1].ID[0] == 0):
-                # Compare the positions of the markers
-                if (marker0Center[0] > marker1Center[0]):
-                    # Scale the target point to an ASCII character value
-                    asc = chr(int((target[0] * scale_factor) + 64))
-                    gatedetect = True
-
-            # Send the ASCII character over UART
-            ser.write(asc.encode())
-            ser.flush()
-            time.sleep(0.1)
+        instr.count("frames")
+    else:
+        # Grab the newest frame from the threaded video stream
+        ok, frame = cam.read()
+        if not ok:
+            print("[INFO] Video stream ended")
+            break
+        t = instr.stop("capture", t)
+        instr.record("frame_age", cam.frame_age * 1000.0)
+
+        if settling(frame):
+            continue
+        instr.count("frames")
+
+        # resize the frame to have a maximum width of 1000 pixels
+        # and maximum height of 700 pixels, smaller while idle, unless in
+        # multi-scale mode
+        frame = prepare_frame(frame, args, scheduler.scale if scheduler is not None else 1.0, frameBuffers)
+        t = instr.stop("resize", t)
+
+        # Get the height and width of the image
+        height, width = frame.shape[:2]
+
+        # detect ArUco markers in the input frame, the pool returns the
+        # detections of an earlier frame together with its capture time
+        frameTime = cam.frame_timestamp
+        detectStart = time.perf_counter()
+        if pool is None:
+            (corners, ids, rejected) = detect(frame)
+        else:
+            output = pool.detect(frame, frameTime)
+            if output is None:
+                continue
+            (frameTime, corners, ids, rejected) = output
+        detectTime = (time.perf_counter() - detectStart) * 1000.0
+        t = instr.stop("detect", t)
+
+    # All markers in view as arrays, sorted by size in descending order
+    if store is not None:
+        detections = store.fill(corners, ids)
+    else:
+        detections = Detections.from_aruco(corners, ids)
+
+    # Commands for this frame, in the order they are sent
+    commands, result = frame_commands(detections, width, cameras.to_main_frame if cameras is not None else None)
+    t = instr.stop("pair", t)
+
+    # Switch between idle and full rate scanning
+    if scheduler is not None:
+        scheduler.update(detections, rejected)
+
+    # Poses of all markers in one pass, only needed when there is a gate
+    if poseEstimator is not None and result is not None and result.target is not None:
+        gatePose = PoseEstimator.gate(poseEstimator.estimate(detections, width, height), result)
+        t = instr.stop("pose", t)
+
+    if not ready:
+        print("[INFO] Camera is ready, %d frames discarded" % discardedFrames)
+        signal_ready()
+        ready = True
+
+    for signal in commands:
+        # Gate commands carry the target for the binary protocol,
+        # '?' is sent when no valid gate is in view
+        if result is not None and signal == result.command:
+            asc = signal
             print(asc)
+            if gatePose is not None and result.target is not None:
+                print("[OUTPUT] Gate range: %.2f m, bearing: %.1f deg, yaw: %.1f deg" % (gatePose.range, gatePose.bearing, gatePose.yaw))
+            if args.send_pose and result.target is not None:
+                send_pose(asc, gatePose, frameTime)
+            elif estimator is None:
+                send_command(asc, result.target, result.size, frameTime)
+            elif result.target is not None:
+                estimator.update(result.target[0] / width, result.target[1] / height, result.size, frameTime)
+            else:
+                estimator.miss(asc)
+            continue
 
-        if len(tags) >= 3:
-            # Extracting the corners of the markers
-            marker0Corners = tags[0].corners
-            marker1Corners = tags[1].corners
-            marker2Corners = tags[2].corners
-
-            # Calculate the centre of the markers
-            marker0Center = np.mean(marker0Corners, axis=0).astype(int)
-            marker1Center = np.mean(marker1Corners, axis=0).astype(int)
-            marker2Center = np.mean(marker2Corners, axis=0).astype(int)
-
-            # Default value for ASCII character and if no gate is detected
-            asc = '?'
-
-            # Compare the IDs of the markers to verify gate alignment
-            if (tags[0].ID[0] == 0 and tags[1].ID[0] == 1):
-                # Calculate the midpoint between the two markers to act as target
-                target = calculate_midpoint(marker0Corners, marker1Corners)
-
-                # Compare the positions of the markers
-                if (marker0Center[0] < marker1Center[0]):
-                    # Scale the target point x-coordinate to an ASCII character value
-                    asc = chr(int((target[0] * scale_factor) + 64))
-                    gatedetect = True
-
-            elif (tags[0].ID[0] == 1 and tags[1].ID[0] == 0):
-                # Calculate the midpoint between the two markers to act as target
-                target = calculate_midpoint(marker0Corners, marker1Corners)
-
-                # Compare the positions of the markers
-                if (marker0Center[0] > marker1Center[0]):
-                    # Scale the target point to an ASCII character value
-                    asc = chr(int((target[0] * scale_factor) + 64))
-                    gatedetect = True
-
-            elif (tags[1].ID[0] == 1 and tags[2].ID[0] == 0):
-                # Calculate target point
-                target = calculate_midpoint(marker1Corners, marker2Corners)
-                
-                # Compare the positions of the markers
-                if (marker1Center[0] > marker2Center[0]):
-                    # Scale the target point to an ASCII character value
-                    asc = chr(int((target[0] * scale_factor) + 64))
-                    gatedetect = True
-
-            elif (tags[1].ID[0] == 0 and tags[2].ID[0] == 1):
-                # Calculate target point
-                target = calculate_midpoint(marker1Corners, marker2Corners)
-
-                # Compare the positions of the markers
-                if (marker1Center[0] < marker2Center[0]):
-                    # Scale the target point x-coordinate to an ASCII character value
-                    asc = chr(int((target[0] * scale_factor) + 64))
-                    gatedetect = True
-
-            # Send the ASCII character over UART
-            ser.write(asc.encode())
-            ser.flush()
-            time.sleep(0.1)
-            print(asc)
+        # No markers in view, the control loop coasts on its estimate
+        if signal == "-" and estimator is not None:
+            estimator.miss(signal)
+            continue
 
-        tagID = [tag.ID[0] for tag in tags]
-        tagsize = [tag.size for tag in tags]
-    else:
-        # No marker detected
-        signal = "-"
-        ser.write(signal.encode())
-        ser.flush()
-        time.sleep(0.3)
+        if signal == "!":
+            print("[INFO] STOP Marker detected")
+            # Keep stopping instead of coasting towards the last gate
+            if estimator is not None:
+                estimator.miss(signal, clear=True)
+        elif signal == "&":
+            print("[INFO] START Marker detected")
+        elif signal == "@":
+            print("[INFO] Stopping video stream")
+        send_command(signal, timestamp=frameTime)
+
+    t = instr.stop("uart", t)
+
+    # Cold-start latency, from process start to the first frame's commands
+    if firstCommandTime is None and commands:
+        firstCommandTime = time.monotonic()
+        print("[INFO] Time to first command (ms): %.0f, ready after (ms): %.0f, frames discarded: %d" % (
+            (firstCommandTime - startTime) * 1000.0, (readyTime - startTime) * 1000.0, discardedFrames))
+
+    # Keep the frame and its decision in the flight recorder
+    if recorder is not None:
+        recorder.record(frame, frameTime, detections, commands, detectTime)
+        t = instr.stop("record", t)
+
+    # Hand the frame to the telemetry encoder when a viewer wants one
+    if telemetry is not None and telemetry.ready():
+        gate = result is not None and result.target is not None
+
+        # The encoder works on the frame later, reused buffers are copied
+        shownFrame, shownDetections = (frame.copy(), detections.copy()) if reuse else (frame, detections)
+        telemetry.publish(shownFrame, shownDetections, [(result.target, result.command)] if gate else [], {
+            "time": frameTime,
+            "ids": detections.ids.tolist(),
+            "sizes": detections.sizes.tolist(),
+            "commands": commands,
+            "target": [float(v) for v in result.target] if gate else None,
+            "range": gatePose.range if gate and gatePose is not None else None,
+            "bearing": gatePose.bearing if gate and gatePose is not None else None,
+        })
+        t = instr.stop("telemetry", t)
+    instr.count("commands", len(commands))
+    instr.maybe_export()
+    allocations.end_frame()
+
+    # Close the program using start and stop markers simultaneously
+    if result is None and "@" in commands:
+        break
+
+    if len(detections) > 0 and "!" not in commands:
+        tagID = detections.ids.tolist()
+        tagsize = detections.sizes.tolist()
+        gateResult = result
 
 if not(tagID == []):
     print("[INFO] Detected Tags ID: " + str(tagID))
     print("[INFO] Tag Sizes (pixels): " + str(tagsize))
 
-    if gatedetect:
-        print("[INFO] Gate detected.")
-        print("[OUTPUT] Target Gate Coordinates: " + str(target))
-    else:
-        print("[INFO] No Gate detected.")
-    print("[OUTPUT] ASCII value of target:", asc)
+    if len(tagID) >= 2:
+        if gateResult.target is not None:
+            print("[INFO] Gate detected.")
+            print("[OUTPUT] Target Gate Coordinates: " + str(gateResult.target))
+            if gatePose is not None:
+                print("[OUTPUT] Gate range: %.2f m, bearing: %.1f deg" % (gatePose.range, gatePose.bearing))
+        else:
+            print("[INFO] No Gate detected.")
+        print("[OUTPUT] ASCII value of target:", gateResult.command)
 
 print("[INFO] Cleaning up and Exiting Program")
 
-# close the serial port
+# Final export of the stage latency statistics
+if instr.enabled:
+    instr.export()
+
+# Peak memory, garbage collections and, when traced, memory allocated per frame
+allocations.close()
+stats = allocations.stats()
+print("[INFO] Peak RSS (MB): %.1f, GC collections: %s, GC time (ms): %.1f" % (stats["peak_rss_mb"], stats["collections"], stats["gc_ms"]))
+if "avg_frame_kb" in stats:
+    print("[INFO] Allocated per frame (KB): avg %.1f, max %.1f, frame-sized in %d of %d frames" % (
+        stats["avg_frame_kb"], stats["max_frame_kb"], stats["large_frames"], stats["traced_frames"]))
+
+# Time, CPU load and frame rate spent in each power state
+if scheduler is not None:
+    stats = scheduler.stats()
+    for state, s in stats["states"].items():
+        print("[INFO] Power state %s: %.1f s, %d frames at %.1f fps, CPU load %.0f%%" % (state, s["seconds"], s["frames"], s["fps"], s["cpu_load"] * 100.0))
+    print("[INFO] Power state changes: %d" % stats["transitions"])
+
+# Stop the telemetry stream
+if telemetry is not None:
+    telemetry.close()
+    stats = telemetry.stats()
+    print("[INFO] Telemetry frames encoded: %d, dropped: %d, avg encode (ms): %.1f" % (stats["encoded"], stats["dropped"], stats["avg_encode_ms"]))
+
+# Flush the flight recording to disk
+if recorder is not None:
+    recorder.close()
+    print("[INFO] Recorded %d frames, last %d kept in %s" % (recorder.count, min(recorder.count, recorder.slots), args.record))
+
+# Stop the fixed-rate control loop before the last commands go out
+if control is not None:
+    control.stop()
+    print("[INFO] Control loop ticks: %d, late: %d" % (control.ticks, control.late))
+
+# Send any queued commands and close the serial port
+writer.close()
+stats = writer.stats()
+print("[INFO] Commands written: %d, coalesced: %d, dropped: %d" % (stats["written"], stats["coalesced"], stats["dropped"]))
+print("[INFO] Max queue depth: %d, avg write latency (ms): %.1f" % (stats["max_queue_depth"], stats["avg_write_ms"]))
+if stats["written"]:
+    print("[INFO] Avg queue delay (ms): %.1f, max queue delay (ms): %.1f" % (stats["avg_queue_delay_ms"], stats["max_queue_delay_ms"]))
 ser.close()
 
-# cleanup
+# Report how many stale frames were skipped by the capture thread
+stats = cam.stats()
+print("[INFO] Frames captured: %d, processed: %d, dropped: %d" % (stats["captured"], stats["delivered"], stats["dropped"]))
+if stats["skipped"]:
+    print("[INFO] Frames skipped undecoded while idle: %d" % stats["skipped"])
+print("[INFO] Last frame age (ms): %.1f" % stats["frame_age_ms"])
+print("[INFO] Capture format: %s, %dx%d" % (stats["format"], cam.width, cam.height))
+
+# Report what the tracking and tuning stages of the detector did
+if cameras is not None:
+    stats = cameras.stats()
+    print("[INFO] Cameras: %d, avg cycle (ms): %.1f, avg slowest detection (ms): %.1f" % (stats["cameras"], stats["avg_cycle_ms"], stats["avg_slowest_detect_ms"]))
+    print("[INFO] Stale frames left out: %d, max skew (ms): %.1f, duplicate markers: %d" % (stats["stale"], stats["max_skew_ms"], stats["duplicates"]))
+    for view in cameras.views:
+        print_detector_stats(view.detect)
+elif pool is None:
+    print_detector_stats(detect)
+else:
+    pool.close()
+    stats = pool.stats()
+    print("[INFO] Detection workers: %d, frames detected: %d, max reorder depth: %d" % (stats["workers"], stats["completed"], stats["max_reorder"]))
+
+# cleanup, the runtime never opens a window so headless OpenCV
+# builds work too
 cam.release()
-cv2.destroyAllWindows()
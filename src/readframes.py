@@ -0,0 +1,32 @@
+import serial
+import time
+from protocol import FrameDecoder, PoseFrame
+
+serialPort = serial.Serial(
+    port="COM4", baudrate=9600, bytesize=8, timeout=2, stopbits=serial.STOPBITS_ONE
+)
+decoder = FrameDecoder()  # Used to turn binary frames coming over UART into commands
+lastFrame = None
+while 1:
+    # Block until at least one byte arrives, then take everything waiting
+    data = serialPort.read(max(1, serialPort.in_waiting))
+    if not data:
+        continue
+
+    for frame in decoder.feed(data):
+        # Frames lost on the link show up as gaps in the sequence number
+        # and the capture timestamps give the time between camera frames
+        if lastFrame is not None:
+            lost = (frame.seq - lastFrame.seq - 1) & 0xFFFF
+            interval = (frame.timestamp - lastFrame.timestamp) * 1000.0
+        else:
+            lost = 0
+            interval = 0.0
+
+        if isinstance(frame, PoseFrame):
+            print("%s seq=%d bearing=%.2fdeg range=%.3fm yaw=%.2fdeg interval=%.1fms lost=%d errors=%d" % (
+                frame.command, frame.seq, frame.bearing, frame.range, frame.yaw, interval, lost, decoder.errors))
+        else:
+            print("%s seq=%d x=%.4f y=%.4f size=%d interval=%.1fms lost=%d errors=%d" % (
+                frame.command, frame.seq, frame.x, frame.y, frame.size, interval, lost, decoder.errors))
+        lastFrame = frame
@@ -1,19 +1,34 @@
-import serial
-import time
+import argparse
+from receiver import SerialReceiver
 
-serialPort = serial.Serial(
-    port="COM4", baudrate=9600, bytesize=8, timeout=2, stopbits=serial.STOPBITS_ONE
-)
-serialString = ""  # Used to hold data coming over UART
-while 1:
-    # Wait until there is data waiting in the serial buffer
-    if serialPort.in_waiting > 0:
+parser = argparse.ArgumentParser()
+parser.add_argument("--port", default="COM4",
+    help="serial port to read the commands from (default COM4)")
+parser.add_argument("--baud", type=int, default=9600,
+    help="serial baud rate (default 9600)")
+parser.add_argument("--binary", action="store_true",
+    help="decode binary frames from --protocol binary instead of ASCII characters")
+args = parser.parse_args()
 
-        # Read data out of the buffer until a carraige return / new line is found
-        serialString = serialPort.readline()
 
-        # Print the contents of the serial data
-        try:
-            print(serialString.decode("Ascii"))
-        except:
-            pass
\ No newline at end of file
+# Print every command as it arrives
+def show(event):
+    if event.kind == "steer":
+        print("%s %-12s x=%.2f gap=%.1fms" % (event.command, event.kind, event.position, event.gap * 1000.0))
+    else:
+        print("%s %-12s gap=%.1fms" % (event.command, event.kind, event.gap * 1000.0))
+
+
+# Blocks in the port's read until data arrives, so the loop is idle
+# while nothing is sent
+receiver = SerialReceiver(args.port, args.baud, handler=show, binary=args.binary)
+try:
+    receiver.run()
+except KeyboardInterrupt:
+    pass
+
+stats = receiver.stats()
+print("[INFO] Events: %d (%.1f/s), errors: %d" % (stats["events"], stats["events_per_s"], stats["errors"]))
+print("[INFO] Mean gap (ms): %.1f, max gap (ms): %.1f" % (stats["mean_gap_ms"], stats["max_gap_ms"]))
+print("[INFO] Commands by kind: %s" % stats["counts"])
+receiver.close()
@@ -0,0 +1,145 @@
+# Event-driven receiver of the command stream on the robot side
+#
+# The reference receiver busy-polled in_waiting and waited for newlines
+# that raspiaruco.py never sends. SerialReceiver blocks in the port's read
+# until bytes arrive, so it costs nothing while the link is quiet, and
+# CommandDecoder turns the single-character stream into typed events with
+# receive timestamps as it arrives. Binary frames from --protocol binary
+# are decoded into the same events. Rates and gaps between events are kept
+# so the link can be checked from the receiving end.
+import threading
+import time
+from collections import namedtuple
+
+import serial
+
+from protocol import FrameDecoder, PoseFrame
+
+# Kinds of events, by command character. Gate letters 'A'-'Z' are steer
+# events; '@' also doubles as the gate letter at the far left edge.
+KINDS = {
+    "?": "no_gate",
+    "-": "no_markers",
+    "&": "start",
+    "!": "stop",
+    "@": "shutdown",
+    "%": "camera_error",
+    "<": "ready",
+}
+
+# kind, command character, receive time (time.monotonic), seconds since
+# the previous event, and for steer events the target position as a
+# fraction of the frame width
+CommandEvent = namedtuple("CommandEvent", ["kind", "command", "time", "gap", "position"])
+
+
+def command_kind(command):
+    if "A" <= command <= "Z":
+        return "steer"
+    return KINDS.get(command)
+
+
+# Position of a gate letter, the centre of its 1/25 wide bucket
+def letter_position(command):
+    return min(1.0, (ord(command) - 64 + 0.5) / 25.0)
+
+
+class CommandDecoder:
+    def __init__(self, binary=False):
+        self.frames = FrameDecoder() if binary else None
+        self.last_time = None
+
+        # Statistics of the stream
+        self.started = None
+        self.events = 0
+        self.errors = 0
+        self.counts = {}
+        self.max_gap = 0.0
+
+    # Decode the bytes received at time t into a list of CommandEvents
+    def feed(self, data, t=None):
+        if t is None:
+            t = time.monotonic()
+        if self.started is None:
+            self.started = t
+
+        if self.frames is None:
+            items = [(chr(b), None) for b in data]
+        else:
+            errors = self.frames.errors
+            items = []
+            for frame in self.frames.feed(data):
+                position = None if isinstance(frame, PoseFrame) else frame.x
+                items.append((frame.command, position))
+            self.errors += self.frames.errors - errors
+
+        events = []
+        for command, position in items:
+            kind = command_kind(command)
+            if kind is None:
+                self.errors += 1
+                continue
+            if kind != "steer":
+                position = None
+            elif position is None:
+                position = letter_position(command)
+
+            gap = t - self.last_time if self.last_time is not None else 0.0
+            self.last_time = t
+            self.max_gap = max(self.max_gap, gap)
+            self.events += 1
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            events.append(CommandEvent(kind, command, t, gap, position))
+        return events
+
+    def stats(self):
+        elapsed = (self.last_time - self.started) if self.last_time is not None else 0.0
+        return {
+            "events": self.events,
+            "errors": self.errors,
+            "counts": dict(self.counts),
+            "events_per_s": self.events / elapsed if elapsed > 0 else 0.0,
+            "mean_gap_ms": elapsed / (self.events - 1) * 1000.0 if self.events > 1 else 0.0,
+            "max_gap_ms": self.max_gap * 1000.0,
+        }
+
+
+# Reads the port with blocking reads and hands every event to handler,
+# either in the calling thread with run() or on a thread with start()
+class SerialReceiver:
+    def __init__(self, port, baudrate=9600, handler=None, binary=False, timeout=0.5):
+        # The read timeout only bounds how long stop() takes
+        self.serial = serial.Serial(port=port, baudrate=baudrate, bytesize=8,
+            stopbits=serial.STOPBITS_ONE, timeout=timeout)
+        self.decoder = CommandDecoder(binary)
+        self.handler = handler
+        self.running = False
+        self.thread = None
+
+    # Block until bytes arrive, then take everything already waiting
+    def read_events(self):
+        data = self.serial.read(max(1, self.serial.in_waiting))
+        if not data:
+            return []
+        return self.decoder.feed(data)
+
+    def run(self):
+        self.running = True
+        while self.running:
+            for event in self.read_events():
+                self.handler(event)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="SerialReceiver", daemon=True)
+        self.thread.start()
+        return self
+
+    def stats(self):
+        return self.decoder.stats()
+
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+        self.serial.close()
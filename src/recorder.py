@@ -0,0 +1,165 @@
+# Bounded flight recorder of the frame loop
+#
+# FlightRecorder keeps the last N frames of a run in a fixed-size ring file
+# that is memory-mapped once at startup. Each slot holds a grayscale copy
+# of the frame the markers were detected on, its detections and the
+# commands the frame produced. Frames that fit the slot are stored at
+# their own size, so replay.py detects on exactly the same pixels; larger
+# frames are downscaled to the slot and only replay approximately. The
+# default slot is half the detection size: a slot for whole 1000x700
+# frames makes 300 frames take 210 MB and dirties about 7 MB of pages a
+# second, too much for an SD card to keep up with.
+# Recording a frame copies into the mapped slot in place, and the kernel
+# writes dirty pages back in the background so the loop never waits on the
+# disk. Recording reads a ring file back in frame order for replay.py.
+import mmap
+import struct
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+MAGIC = b"ARUCOREC"
+VERSION = 2
+
+# Markers and command characters kept per frame
+MAX_MARKERS = 16
+MAX_COMMANDS = 8
+
+# File header: magic, version, slot count, image width and height, frames
+# recorded so far
+HEADER = struct.Struct("<8sIIIIQ")
+HEADER_SIZE = 64
+
+# Slot header: frame number (from 1, 0 marks an empty slot), capture time,
+# width and height of the detected frame, number of markers, number of
+# commands, detection time in ms, the command characters and the width
+# and height of the stored image
+RECORD = struct.Struct("<QdHHHHf%dsHH" % MAX_COMMANDS)
+RECORD_SIZE = 64
+
+# exact is False for frames that were downscaled to fit the slot
+RecordedFrame = namedtuple("RecordedFrame", "seq timestamp width height detect_ms image ids corners commands exact")
+
+
+def slot_size(width, height):
+    return RECORD_SIZE + MAX_MARKERS * 4 + MAX_MARKERS * 8 * 4 + width * height
+
+
+class FlightRecorder:
+    def __init__(self, path, slots=300, size=(500, 350)):
+        self.path = path
+        self.slots = slots
+        self.width, self.height = size
+        self.slot_size = slot_size(self.width, self.height)
+
+        # The file is created at its full size, so disk use is fixed for
+        # the whole run
+        fileSize = HEADER_SIZE + slots * self.slot_size
+        self.file = open(path, "w+b")
+        self.file.truncate(fileSize)
+        self.map = mmap.mmap(self.file.fileno(), fileSize)
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, slots, self.width, self.height, 0)
+
+        # Views of every slot and a buffer for a downscaled colour frame,
+        # created once so recording a frame only copies. The image area of
+        # a slot is width * height bytes, frames that fit are stored there
+        # at their own size.
+        self.ids = []
+        self.corners = []
+        self.images = []
+        for i in range(slots):
+            offset = HEADER_SIZE + i * self.slot_size + RECORD_SIZE
+            self.ids.append(np.ndarray((MAX_MARKERS,), np.int32, self.map, offset))
+            offset += MAX_MARKERS * 4
+            self.corners.append(np.ndarray((MAX_MARKERS, 4, 2), np.float32, self.map, offset))
+            offset += MAX_MARKERS * 8 * 4
+            self.images.append(np.ndarray((self.height * self.width,), np.uint8, self.map, offset))
+        self.small = np.empty((self.height, self.width, 3), np.uint8)
+
+        self.count = 0
+
+    # Record one frame, its Detections and the commands it produced
+    def record(self, frame, timestamp, detections, commands, detect_ms=0.0):
+        slot = self.count % self.slots
+        self.count += 1
+
+        # Mark the slot empty while it is rewritten, so a crash part way
+        # leaves no header describing a half-new image
+        offset = HEADER_SIZE + slot * self.slot_size
+        RECORD.pack_into(self.map, offset, 0, 0.0, 0, 0, 0, 0, 0.0, b"", 0, 0)
+
+        # Convert straight into the mapped slot, frames larger than the
+        # slot are downscaled first
+        height, width = frame.shape[:2]
+        if width <= self.width and height <= self.height:
+            imageWidth, imageHeight = width, height
+            image = self.images[slot][:width * height].reshape(height, width)
+            if frame.ndim == 2:
+                np.copyto(image, frame)
+            else:
+                cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=image)
+        else:
+            imageWidth, imageHeight = self.width, self.height
+            image = self.images[slot].reshape(self.height, self.width)
+            if frame.ndim == 2:
+                cv2.resize(frame, (self.width, self.height), dst=image, interpolation=cv2.INTER_AREA)
+            else:
+                cv2.resize(frame, (self.width, self.height), dst=self.small, interpolation=cv2.INTER_AREA)
+                cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=image)
+
+        n = min(len(detections), MAX_MARKERS)
+        self.ids[slot][:n] = detections.ids[:n]
+        self.corners[slot][:n] = detections.corners[:n]
+
+        text = "".join(commands).encode()[:MAX_COMMANDS]
+
+        # The slot header goes last, a slot is only valid once it has its
+        # frame number
+        RECORD.pack_into(self.map, offset,
+            self.count, timestamp, width, height, n, len(text), detect_ms, text, imageWidth, imageHeight)
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.slots, self.width, self.height, self.count)
+
+    def close(self):
+        if self.map is None:
+            return
+        self.images = self.ids = self.corners = None
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+        self.map = None
+
+
+# Read access to a ring file written by FlightRecorder
+class Recording:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, self.slots, self.width, self.height, self.count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a flight recording: " + path)
+        self.data = data
+        self.slot_size = slot_size(self.width, self.height)
+
+    def __len__(self):
+        return min(self.count, self.slots)
+
+    # Recorded frames, oldest first
+    def frames(self):
+        records = []
+        for slot in range(self.slots):
+            offset = HEADER_SIZE + slot * self.slot_size
+            record = RECORD.unpack_from(self.data, offset)
+            if record[0]:
+                records.append((record, offset + RECORD_SIZE))
+
+        for record, offset in sorted(records, key=lambda r: r[0][0]):
+            seq, timestamp, width, height, n, length, detect_ms, text, imageWidth, imageHeight = record
+            ids = np.frombuffer(self.data, np.int32, MAX_MARKERS, offset)
+            offset += MAX_MARKERS * 4
+            corners = np.frombuffer(self.data, np.float32, MAX_MARKERS * 8, offset).reshape(MAX_MARKERS, 4, 2)
+            offset += MAX_MARKERS * 8 * 4
+            image = np.frombuffer(self.data, np.uint8, imageWidth * imageHeight, offset).reshape(imageHeight, imageWidth)
+            yield RecordedFrame(seq, timestamp, width, height, detect_ms, image,
+                ids[:n].copy(), corners[:n].copy(), list(text[:length].decode()),
+                (imageWidth, imageHeight) == (width, height))
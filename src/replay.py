@@ -0,0 +1,96 @@
+# Deterministic replay of a flight recording
+#
+# Feeds the frames of a ring file written by raspiaruco.py --record back
+# through the same detection and pairing path, in the order they were
+# recorded, with a fresh detector built from the given options. Every run
+# over the same recording gives the same commands, so a mis-targeting or a
+# timing regression seen on the robot can be reproduced and compared
+# against other detector options off-robot. Frames recorded at the size
+# they were detected on replay exactly; frames that were downscaled to fit
+# the recorder's slots are scaled back up and only replay approximately.
+#
+#   python src/replay.py flight.rec [--preset fast] [--output replay.json]
+import argparse
+import json
+import statistics
+
+import cv2
+
+from benchmark import process_frame, summarise
+from detection import create_dictionary, create_parameters, add_detector_arguments, create_detector
+from recorder import Recording
+
+
+def replay(recording, args):
+    detect = create_detector(create_dictionary(), create_parameters(), args)
+
+    frames = []
+    timings = []
+    mismatches = 0
+    approximate = 0
+    for recorded in recording.frames():
+        # The recorded image is what the robot detected on, unless it had
+        # to be downscaled to fit the slot
+        frame = recorded.image
+        if not recorded.exact:
+            frame = cv2.resize(frame, (recorded.width, recorded.height))
+            approximate += 1
+        detections, commands, result, frameTimings = process_frame(frame, detect, args, prepare=False)
+        timings.append(frameTimings)
+
+        match = commands == recorded.commands
+        if not match:
+            mismatches += 1
+            print("[INFO] Frame %d: recorded %s (%d markers), replayed %s (%d markers)" % (recorded.seq,
+                "".join(recorded.commands), len(recorded.ids), "".join(commands), len(detections)))
+
+        frames.append({
+            "seq": recorded.seq,
+            "timestamp": recorded.timestamp,
+            "exact": recorded.exact,
+            "recorded_commands": recorded.commands,
+            "commands": commands,
+            "recorded_ids": recorded.ids.tolist(),
+            "ids": detections.ids.tolist(),
+            "target": None if result is None or result.target is None else [float(v) for v in result.target],
+            "recorded_detect_ms": recorded.detect_ms,
+            "detect_ms": frameTimings["detect"],
+        })
+
+    summary = summarise(timings)
+    summary["mismatches"] = mismatches
+    summary["approximate"] = approximate
+    recordedDetect = [f["recorded_detect_ms"] for f in frames if f["recorded_detect_ms"] > 0]
+    if recordedDetect:
+        summary["recorded_detect_mean_ms"] = statistics.mean(recordedDetect)
+    return {"options": dict(vars(args)), "summary": summary, "frames": frames}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a flight recording through the detection and gate pairing path")
+    parser.add_argument("recording",
+        help="ring file written by raspiaruco.py --record")
+    parser.add_argument("--output", default=None,
+        help="JSON file to write the per-frame results to")
+    add_detector_arguments(parser)
+    args = parser.parse_args()
+
+    recording = Recording(args.recording)
+    print("[INFO] Replaying %d of %d recorded frames" % (len(recording), recording.count))
+    results = replay(recording, args)
+
+    summary = results["summary"]
+    print("[INFO] Frames: %d, command mismatches: %d" % (summary["frames"], summary["mismatches"]))
+    if summary["approximate"]:
+        print("[INFO] %d frames were recorded downscaled, their results are approximate (raise --record-size)" % summary["approximate"])
+    if "detect" in summary:
+        print("[INFO] Detect mean (ms): %.1f replayed, %.1f recorded" % (summary["detect"]["mean_ms"], summary.get("recorded_detect_mean_ms", 0.0)))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print("[INFO] Results written to " + args.output)
+
+
+if __name__ == "__main__":
+    main()
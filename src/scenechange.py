@@ -0,0 +1,62 @@
+# Scene-change gating of the detector
+#
+# While the robot waits at a start marker the camera sees the same scene
+# frame after frame, and every frame still paid for a full detectMarkers
+# call. SceneGate compares a tiny grayscale thumbnail of each frame with
+# the thumbnail of the last frame that was actually detected, and hands
+# back that frame's detections while the mean difference stays below a
+# threshold. Comparing against the last detected frame rather than the
+# previous one means slow drift still adds up to a change. A detection is
+# forced every refresh_interval frames regardless.
+import cv2
+import numpy as np
+
+
+class SceneGate:
+    def __init__(self, detect, threshold=4.0, refresh_interval=15, size=(32, 24)):
+        self.detect = detect
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.size = size
+
+        # Thumbnail and detections of the last detected frame
+        self.thumbnail = None
+        self.gray = np.empty(size[::-1], np.uint8)
+        self.small = np.empty(size[::-1] + (3,), np.uint8)
+        self.last = None
+        self.last_shape = None
+        self.frames_since_detect = 0
+
+        # Statistics of the gate
+        self.frames = 0
+        self.skipped = 0
+
+    def __call__(self, frame):
+        self.frames += 1
+        self.frames_since_detect += 1
+
+        # Grayscale thumbnail, mean absolute difference in grey levels
+        if frame.ndim == 2:
+            cv2.resize(frame, self.size, dst=self.gray, interpolation=cv2.INTER_AREA)
+        else:
+            cv2.resize(frame, self.size, dst=self.small, interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+        if (self.thumbnail is not None and frame.shape == self.last_shape
+                and self.frames_since_detect < self.refresh_interval
+                and cv2.norm(self.gray, self.thumbnail, cv2.NORM_L1) / self.gray.size < self.threshold):
+            self.skipped += 1
+            return self.last
+
+        self.last = self.detect(frame)
+        self.last_shape = frame.shape
+        self.thumbnail = self.gray.copy()
+        self.frames_since_detect = 0
+        return self.last
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "skip_ratio": self.skipped / self.frames if self.frames else 0.0,
+        }
@@ -0,0 +1,128 @@
+# Power-aware frame-rate and resolution scheduling
+#
+# With no markers in view the loop used to run flat out, which drains the
+# battery and heats the Pi. PowerScheduler switches the loop between an
+# idle state, which processes a few frames per second at reduced
+# resolution, and an active state at full rate and resolution. Any marker
+# in view switches to active on the next frame, and so does a growing gate
+# still too small to be decoded at the idle resolution: a rejected marker
+# candidate that grows from one idle frame to the next. Idle is only
+# entered again after idle_after seconds without markers. on_change is
+# called with every new state, so the caller can throttle the camera as
+# well. CPU time, frame rate and time spent in each state are tracked so
+# the trade-off can be measured, and every state change is logged with its
+# reason.
+import json
+import time
+
+import numpy as np
+
+IDLE = "idle"
+ACTIVE = "active"
+
+# A rejected candidate wakes the loop when its diagonal, in pixels of the
+# idle frame, is at least MIN_CANDIDATE and CANDIDATE_GROWTH times that
+# of the largest candidate of the previous idle frame
+MIN_CANDIDATE = 12.0
+CANDIDATE_GROWTH = 1.2
+
+
+class PowerScheduler:
+    def __init__(self, idle_rate=2.0, idle_scale=0.5, idle_after=1.0, log_path=None, on_change=None):
+        self.idle_period = 1.0 / idle_rate
+        self.idle_scale = idle_scale
+        self.idle_after = idle_after
+        self.log_path = log_path
+        self.on_change = on_change
+
+        self.state = ACTIVE
+        self.last_marker = time.monotonic()
+        self.next_frame = 0.0
+
+        # Size of the largest rejected candidate of the last idle frame
+        self.candidate = 0.0
+
+        # Wall time, CPU time and frames per state, and the state log
+        self.started = time.monotonic()
+        self.state_started = self.started
+        self.cpu_started = time.process_time()
+        self.wall = {IDLE: 0.0, ACTIVE: 0.0}
+        self.cpu = {IDLE: 0.0, ACTIVE: 0.0}
+        self.frames = {IDLE: 0, ACTIVE: 0}
+        self.log = []
+
+    # Resolution factor for the next frame
+    @property
+    def scale(self):
+        return self.idle_scale if self.state == IDLE else 1.0
+
+    # Sleep until the next frame is due, only idle frames are rate limited
+    def wait(self):
+        if self.state != IDLE:
+            return
+        delay = self.next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    # Update the state from the Detections of a frame and the rejected
+    # candidates cv2.aruco.detectMarkers returned for it, when known
+    def update(self, detections, rejected=None):
+        now = time.monotonic()
+        self.frames[self.state] += 1
+        self.next_frame = now + self.idle_period
+
+        if len(detections) > 0:
+            self.last_marker = now
+            if self.state == IDLE:
+                self._switch(ACTIVE, "marker in view", now)
+        elif self.state == IDLE:
+            candidate = self._largest(rejected)
+            if self.candidate > 0 and candidate >= max(MIN_CANDIDATE, self.candidate * CANDIDATE_GROWTH):
+                self.last_marker = now
+                self._switch(ACTIVE, "candidate grew from %.0f to %.0f px" % (self.candidate, candidate), now)
+            self.candidate = candidate
+        elif now - self.last_marker >= self.idle_after:
+            self.candidate = 0.0
+            self._switch(IDLE, "no markers for %.1f s" % self.idle_after, now)
+
+    # Diagonal of the largest rejected candidate, 0 when there is none
+    @staticmethod
+    def _largest(rejected):
+        if rejected is None or len(rejected) == 0:
+            return 0.0
+        corners = np.concatenate([c.reshape(1, 4, 2) for c in rejected])
+        return float(np.linalg.norm(corners[:, 0] - corners[:, 2], axis=1).max())
+
+    def _switch(self, state, reason, now):
+        cpu = time.process_time()
+        self.wall[self.state] += now - self.state_started
+        self.cpu[self.state] += cpu - self.cpu_started
+        self.state_started = now
+        self.cpu_started = cpu
+
+        entry = {"time": now - self.started, "from": self.state, "to": state, "reason": reason}
+        self.log.append(entry)
+        if self.log_path:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        self.state = state
+        if self.on_change is not None:
+            self.on_change(state)
+
+    def stats(self):
+        now = time.monotonic()
+        wall = dict(self.wall)
+        cpu = dict(self.cpu)
+        wall[self.state] += now - self.state_started
+        cpu[self.state] += time.process_time() - self.cpu_started
+
+        states = {}
+        for state in (IDLE, ACTIVE):
+            states[state] = {
+                "seconds": wall[state],
+                "cpu_seconds": cpu[state],
+                "cpu_load": cpu[state] / wall[state] if wall[state] > 0 else 0.0,
+                "frames": self.frames[state],
+                "fps": self.frames[state] / wall[state] if wall[state] > 0 else 0.0,
+            }
+        return {"state": self.state, "transitions": len(self.log), "states": states}
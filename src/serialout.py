@@ -0,0 +1,185 @@
+# Non-blocking UART output worker
+#
+# Writing to the serial port and sleeping after every command capped the
+# vision loop at a few frames per second. SerialWriter takes commands from
+# the vision loop into a small bounded queue and writes them on its own
+# thread, at most one every min_interval seconds. Steering commands that
+# have not been written yet are replaced by newer ones, and identical
+# repeats are only re-sent every repeat_interval seconds. Control signals
+# are never dropped and always go out in the order they were sent.
+#
+# With sequence=True the payloads are binary protocol frames, and their
+# sequence numbers are filled in as they are written. Replaced and dropped
+# frames then leave no gaps, so a gap on the receiving end is a frame
+# really lost on the link.
+import threading
+import time
+from collections import deque
+
+from protocol import with_sequence
+
+# Start, stop, shutdown, camera error and ready signals
+CONTROL_SIGNALS = (b"&", b"!", b"@", b"%", b"<")
+
+
+# Serial port whose flush() only returns once the bytes written would have
+# left a UART at the given baud rate, 10 bit times per byte. A UART's
+# flush waits for the wire, a pseudo-terminal's returns at once, so this
+# lets a pseudo-terminal stand in for the real link.
+class PacedPort:
+    def __init__(self, ser, baud):
+        self.ser = ser
+        self.byte_time = 10.0 / baud
+        self.wire_free = 0.0
+
+    def write(self, data):
+        self.wire_free = max(self.wire_free, time.monotonic()) + len(data) * self.byte_time
+        return self.ser.write(data)
+
+    def flush(self):
+        self.ser.flush()
+        delay = self.wire_free - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+
+class SerialWriter:
+    def __init__(self, ser, min_interval=0.1, repeat_interval=1.0, max_queue=8, sequence=False):
+        self.ser = ser
+        self.sequence = sequence
+        self.next_seq = 0
+        self.min_interval = min_interval
+        self.repeat_interval = repeat_interval
+        self.max_queue = max_queue
+
+        # Pending entries of [data, control, time queued]
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.closing = False
+
+        # Last command taken off the queue and when, set as it is taken so
+        # a command being written counts as the last one sent
+        self.last_data = None
+        self.last_sent = 0.0
+        self.last_write = 0.0
+
+        # Statistics of the output stream
+        self.written = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.write_time = 0.0
+        self.max_write_time = 0.0
+        self.queue_delay = 0.0
+        self.max_queue_delay = 0.0
+
+        self.thread = threading.Thread(target=self._run, name="SerialWriter", daemon=True)
+        self.thread.start()
+
+    # Queue a command for sending, returns without waiting for the UART.
+    # control can be given for payloads that are not a single character,
+    # such as binary protocol frames
+    def send(self, command, control=None):
+        data = command.encode() if isinstance(command, str) else bytes(command)
+        if control is None:
+            control = data in CONTROL_SIGNALS
+        now = time.monotonic()
+
+        with self.cond:
+            if self.queue:
+                tail = self.queue[-1]
+                # Same command is already waiting to be written
+                if tail[0] == data:
+                    self.coalesced += 1
+                    return
+                # Only the newest steering command is worth sending
+                if not control and not tail[1]:
+                    tail[0] = data
+                    tail[2] = now
+                    self.coalesced += 1
+                    return
+            elif data == self.last_data and now - self.last_sent < self.repeat_interval:
+                # Repeat of the last command written, the robot already has it
+                self.coalesced += 1
+                return
+
+            if len(self.queue) >= self.max_queue:
+                # Make room by dropping the oldest steering command,
+                # control signals wait for the worker instead
+                for entry in self.queue:
+                    if not entry[1]:
+                        self.queue.remove(entry)
+                        self.dropped += 1
+                        break
+                else:
+                    self.cond.wait_for(lambda: len(self.queue) < self.max_queue)
+
+            self.queue.append([data, control, now])
+            self.max_depth = max(self.max_depth, len(self.queue))
+            self.cond.notify_all()
+
+    # Worker loop writing queued commands at most every min_interval
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue or self.closing)
+                if not self.queue:
+                    break
+
+                # Rate limit without holding up the vision loop
+                delay = self.last_write + self.min_interval - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+
+                data, _, queued = self.queue.popleft()
+                self.last_data = data
+                self.last_sent = time.monotonic()
+                self.cond.notify_all()
+
+            payload = data
+            if self.sequence:
+                payload = with_sequence(data, self.next_seq)
+                self.next_seq += 1
+
+            start = time.monotonic()
+            self.ser.write(payload)
+            self.ser.flush()
+            end = time.monotonic()
+
+            with self.cond:
+                self.last_write = end
+                self.written += 1
+                self.write_time += end - start
+                self.max_write_time = max(self.max_write_time, end - start)
+                self.queue_delay += start - queued
+                self.max_queue_delay = max(self.max_queue_delay, start - queued)
+
+    def depth(self):
+        with self.cond:
+            return len(self.queue)
+
+    def stats(self):
+        with self.cond:
+            written = max(self.written, 1)
+            return {
+                "written": self.written,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped,
+                "queue_depth": len(self.queue),
+                "max_queue_depth": self.max_depth,
+                "avg_write_ms": self.write_time / written * 1000.0,
+                "max_write_ms": self.max_write_time * 1000.0,
+                "avg_queue_delay_ms": self.queue_delay / written * 1000.0,
+                "max_queue_delay_ms": self.max_queue_delay * 1000.0,
+            }
+
+    # Write everything still queued, then stop the worker
+    def close(self):
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.thread.join()
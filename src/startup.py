@@ -0,0 +1,50 @@
+# Fast-start helpers for the runtime
+#
+# A cold start used to open the camera, then sleep before the ready signal,
+# and the first frames after that were often still dark or out of focus
+# while the sensor settled. The runtime now opens the camera and warms up
+# the detector on other threads while the serial port is set up, and only
+# signals ready once a frame passes frame_is_valid(). process_age() gives
+# the time since the process was created, so the time to the first command
+# includes interpreter start and the cv2 import.
+import os
+import time
+
+import cv2
+import numpy as np
+
+# A valid frame has a mean brightness and a Laplacian variance (focus) of
+# at least these, measured on an 80x60 grayscale thumbnail
+MIN_BRIGHTNESS = 25
+MIN_SHARPNESS = 50
+
+
+# Seconds since this process was created, 0 where /proc is not available
+def process_age():
+    try:
+        with open("/proc/self/stat") as f:
+            startTicks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - startTicks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+# Whether a frame is bright and sharp enough to act on
+def frame_is_valid(frame, min_brightness=MIN_BRIGHTNESS, min_sharpness=MIN_SHARPNESS):
+    small = cv2.resize(frame, (80, 60), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    if small.mean() < min_brightness:
+        return False
+    return cv2.Laplacian(small, cv2.CV_64F).var() >= min_sharpness
+
+
+# Run one detection on a blank frame, so OpenCV's lazy setup is done
+# before the first camera frame arrives. Returns the time taken.
+def warm_up(arucoDict, arucoParams, size=(1000, 700)):
+    start = time.perf_counter()
+    blank = np.full((size[1], size[0]), 255, np.uint8)
+    cv2.aruco.detectMarkers(blank, arucoDict, parameters=arucoParams)
+    return time.perf_counter() - start
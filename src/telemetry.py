@@ -0,0 +1,203 @@
+# Local MJPEG telemetry stream of the annotated frames
+#
+# cv2.imshow needs a display, and forwarding X over SSH cripples the frame
+# rate. TelemetryServer serves the annotated frames as an MJPEG stream and
+# the latest detections as JSON over HTTP on localhost, to be viewed
+# through an SSH tunnel (ssh -L 8080:localhost:8080 pi@robot, then open
+# http://localhost:8080). publish() only keeps a reference to the newest
+# frame; drawing, downscaling and JPEG encoding run on the encoder thread
+# at a capped rate. Frames are dropped while nobody is watching, and slow
+# clients always get the newest JPEG and skip the ones they missed, so the
+# vision loop never waits on a viewer.
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+from overlay import draw_overlay
+
+BOUNDARY = "frame"
+
+PAGE = b"""<!DOCTYPE html>
+<html><head><title>ArUco Gate Detection</title></head>
+<body style="background:#222;color:#ddd;font-family:monospace">
+<img src="/stream"><pre id="meta"></pre>
+<script>
+setInterval(function() {
+  fetch("/meta").then(r => r.text()).then(t => document.getElementById("meta").textContent = t);
+}, 500);
+</script>
+</body></html>
+"""
+
+
+# Add the telemetry options to an argparse parser
+def add_telemetry_arguments(parser):
+    parser.add_argument("--telemetry", type=int, default=0, metavar="PORT",
+        help="serve an MJPEG stream of the annotated frames on this port (default 0, off)")
+    parser.add_argument("--telemetry-host", default="127.0.0.1",
+        help="address the telemetry server listens on (default 127.0.0.1)")
+    parser.add_argument("--telemetry-rate", type=float, default=5.0,
+        help="maximum frames per second encoded for the stream (default 5)")
+    parser.add_argument("--telemetry-quality", type=int, default=60,
+        help="JPEG quality of the stream (default 60)")
+
+
+class TelemetryServer:
+    def __init__(self, port, host="127.0.0.1", rate=5.0, quality=60, max_width=640):
+        self.period = 1.0 / rate
+        self.quality = quality
+        self.max_width = max_width
+
+        # Newest published frame, waiting to be encoded
+        self.lock = threading.Lock()
+        self.pending = threading.Condition(self.lock)
+        self.latest = None
+        self.last_accepted = 0.0
+
+        # Newest encoded JPEG and its metadata, numbered so clients can
+        # wait for the next one
+        self.encoded = threading.Condition()
+        self.jpeg = None
+        self.meta = b"{}"
+        self.version = 0
+
+        # Statistics of the stream
+        self.clients = 0
+        self.published = 0
+        self.dropped = 0
+        self.encoded_frames = 0
+        self.encode_ms = 0.0
+
+        self.running = True
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.server_thread = threading.Thread(target=self.server.serve_forever, name="TelemetryServer", daemon=True)
+        self.server_thread.start()
+        self.encoder = threading.Thread(target=self._encode_loop, name="TelemetryEncoder", daemon=True)
+        self.encoder.start()
+
+    # Whether a frame would be streamed now, so the caller can skip
+    # building its metadata otherwise
+    def ready(self):
+        if self.clients == 0 or time.monotonic() - self.last_accepted < self.period:
+            self.dropped += 1
+            return False
+        return True
+
+    # Offer a frame with its Detections, (point, text) labels and JSON
+    # serialisable metadata. Returns straight away; the frame must not be
+    # changed afterwards.
+    def publish(self, frame, detections, labels, meta):
+        with self.lock:
+            if self.latest is not None:
+                self.dropped += 1
+            self.latest = (frame, detections, labels, meta)
+            self.last_accepted = time.monotonic()
+            self.published += 1
+            self.pending.notify()
+
+    def _encode_loop(self):
+        while self.running:
+            with self.lock:
+                self.pending.wait_for(lambda: self.latest is not None or not self.running, timeout=1.0)
+                item = self.latest
+                self.latest = None
+            if item is None:
+                continue
+
+            start = time.perf_counter()
+            frame, detections, labels, meta = item
+            image = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR) if frame.ndim == 2 else frame.copy()
+            height, width = image.shape[:2]
+            draw_overlay(image, detections, (width // 2, height // 2), labels)
+            if width > self.max_width:
+                image = cv2.resize(image, (self.max_width, height * self.max_width // width), interpolation=cv2.INTER_AREA)
+            ok, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if not ok:
+                continue
+
+            with self.encoded:
+                self.jpeg = jpeg.tobytes()
+                self.meta = json.dumps(meta).encode()
+                self.version += 1
+                self.encoded.notify_all()
+            self.encoded_frames += 1
+            self.encode_ms += (time.perf_counter() - start) * 1000.0
+
+    # Wait for a JPEG newer than version, returns (version, jpeg)
+    def _next_jpeg(self, version, timeout=1.0):
+        with self.encoded:
+            self.encoded.wait_for(lambda: self.version != version or not self.running, timeout)
+            return self.version, self.jpeg
+
+    def _handler(self):
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/":
+                    self._send("text/html", PAGE)
+                elif self.path == "/meta":
+                    self._send("application/json", telemetry.meta)
+                elif self.path == "/stream":
+                    self._stream()
+                else:
+                    self.send_error(404)
+
+            def _send(self, content_type, body):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=" + BOUNDARY)
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+
+                with telemetry.encoded:
+                    telemetry.clients += 1
+                version = -1
+                try:
+                    while telemetry.running:
+                        version, jpeg = telemetry._next_jpeg(version)
+                        if jpeg is None:
+                            continue
+                        self.wfile.write(b"--" + BOUNDARY.encode() + b"\r\n")
+                        self.wfile.write(b"Content-Type: image/jpeg\r\n")
+                        self.wfile.write(b"Content-Length: " + str(len(jpeg)).encode() + b"\r\n\r\n")
+                        self.wfile.write(jpeg + b"\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with telemetry.encoded:
+                        telemetry.clients -= 1
+
+            # Keep the console for the robot's own output
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def stats(self):
+        return {
+            "published": self.published,
+            "dropped": self.dropped,
+            "encoded": self.encoded_frames,
+            "avg_encode_ms": self.encode_ms / self.encoded_frames if self.encoded_frames else 0.0,
+        }
+
+    def close(self):
+        self.running = False
+        with self.lock:
+            self.pending.notify_all()
+        with self.encoded:
+            self.encoded.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+        self.encoder.join(timeout=1.0)
@@ -0,0 +1,120 @@
+# Region-of-interest tracking for ArUco detection
+#
+# Gate markers only move a little between frames, so once they have been
+# found in a full-frame scan the next frames only need to be searched in
+# padded windows around the previous marker corners. A full-frame scan is
+# still done every full_scan_interval frames, and straight away whenever
+# a tracked marker is lost, so new markers are picked up again.
+import numpy as np
+
+
+class MarkerTracker:
+    def __init__(self, detect, full_scan_interval=10, padding=0.5, min_padding=16):
+        # detect(image) -> (corners, ids, rejected), e.g. cv2.aruco.detectMarkers
+        self.detect = detect
+        self.full_scan_interval = full_scan_interval
+        self.padding = padding          # ROI padding as a fraction of marker size
+        self.min_padding = min_padding  # minimum ROI padding in pixels
+
+        # Corners of the markers found in the previous frame, and the size
+        # of that frame
+        self.prev_corners = []
+        self.frame_size = None
+        self.frames_since_full_scan = 0
+
+        # Statistics of the tracker
+        self.full_scans = 0
+        self.roi_scans = 0
+        self.lost = 0
+        self.scanned_pixels = 0
+        self.frame_pixels = 0
+
+    # Detect markers in a frame, returns the same (corners, ids, rejected)
+    # layout as cv2.aruco.detectMarkers so callers can build gates as usual
+    def __call__(self, frame):
+        height, width = frame.shape[:2]
+        self.frame_pixels += height * width
+        self.frames_since_full_scan += 1
+
+        # Corners from a frame of another resolution do not apply
+        if (width, height) != self.frame_size:
+            self.prev_corners = []
+            self.frame_size = (width, height)
+
+        if not self.prev_corners or self.frames_since_full_scan >= self.full_scan_interval:
+            return self._full_scan(frame)
+
+        corners = []
+        ids = []
+        for (x0, y0, x1, y1) in self._regions(width, height):
+            self.scanned_pixels += (x1 - x0) * (y1 - y0)
+            roi_corners, roi_ids, _ = self.detect(frame[y0:y1, x0:x1])
+            if roi_ids is None:
+                continue
+
+            # Shift the corners back into full-frame coordinates
+            for c, i in zip(roi_corners, roi_ids):
+                corners.append(c + np.array([x0, y0], dtype=c.dtype))
+                ids.append(i)
+
+        self.roi_scans += 1
+
+        # A tracked marker has been lost, rescan the whole frame
+        if len(ids) < len(self.prev_corners):
+            self.lost += 1
+            return self._full_scan(frame)
+
+        self.prev_corners = [c[0] for c in corners]
+        return tuple(corners), np.array(ids, dtype=np.int32), []
+
+    def _full_scan(self, frame):
+        height, width = frame.shape[:2]
+        self.scanned_pixels += height * width
+        self.full_scans += 1
+        self.frames_since_full_scan = 0
+
+        corners, ids, rejected = self.detect(frame)
+        self.prev_corners = [c[0] for c in corners]
+        return corners, ids, rejected
+
+    # Padded bounding boxes around the previous markers, clipped to the
+    # frame and merged where they overlap so no marker is detected twice
+    def _regions(self, width, height):
+        boxes = []
+        for c in self.prev_corners:
+            x0, y0 = c.min(axis=0)
+            x1, y1 = c.max(axis=0)
+            pad = max(self.min_padding, self.padding * max(x1 - x0, y1 - y0))
+            boxes.append([
+                max(0, int(x0 - pad)), max(0, int(y0 - pad)),
+                min(width, int(x1 + pad) + 1), min(height, int(y1 + pad) + 1),
+            ])
+
+        merged = True
+        while merged:
+            merged = False
+            for a in range(len(boxes)):
+                for b in range(a + 1, len(boxes)):
+                    ax0, ay0, ax1, ay1 = boxes[a]
+                    bx0, by0, bx1, by1 = boxes[b]
+                    if ax0 < bx1 and bx0 < ax1 and ay0 < by1 and by0 < ay1:
+                        boxes[a] = [min(ax0, bx0), min(ay0, by0), max(ax1, bx1), max(ay1, by1)]
+                        del boxes[b]
+                        merged = True
+                        break
+                if merged:
+                    break
+
+        return boxes
+
+    # Fraction of frames that only needed ROI scans and the fraction of
+    # frame pixels actually searched
+    def stats(self):
+        frames = self.full_scans + self.roi_scans - self.lost
+        return {
+            "frames": frames,
+            "full_scans": self.full_scans,
+            "roi_scans": self.roi_scans,
+            "lost": self.lost,
+            "scanned_fraction": self.scanned_pixels / self.frame_pixels if self.frame_pixels else 0.0,
+        }
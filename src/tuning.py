@@ -0,0 +1,153 @@
+# Detector parameter presets and adaptive tuning
+#
+# cv2.aruco.DetectorParameters_create() defaults search for markers of
+# every size with three adaptive threshold windows on every frame. The
+# presets trade recall for speed, and AdaptiveTuner narrows the threshold
+# windows and perimeter rates to the marker sizes seen in recent frames,
+# widening them back out when detections drop out.
+from collections import deque
+
+# Parameter values of each preset, attributes a given OpenCV build does
+# not have are skipped
+PRESETS = {
+    # One threshold window, small markers ignored
+    "fast": {
+        "adaptiveThreshWinSizeMin": 7,
+        "adaptiveThreshWinSizeMax": 7,
+        "adaptiveThreshWinSizeStep": 10,
+        "minMarkerPerimeterRate": 0.05,
+        "polygonalApproxAccuracyRate": 0.05,
+        "cornerRefinementMethod": 0,
+    },
+    # Two threshold windows
+    "balanced": {
+        "adaptiveThreshWinSizeMin": 7,
+        "adaptiveThreshWinSizeMax": 17,
+        "adaptiveThreshWinSizeStep": 10,
+        "minMarkerPerimeterRate": 0.03,
+        "polygonalApproxAccuracyRate": 0.03,
+        "cornerRefinementMethod": 0,
+    },
+    # Dense threshold window sweep, small markers and sub-pixel corners
+    "accurate": {
+        "adaptiveThreshWinSizeMin": 3,
+        "adaptiveThreshWinSizeMax": 33,
+        "adaptiveThreshWinSizeStep": 5,
+        "minMarkerPerimeterRate": 0.02,
+        "polygonalApproxAccuracyRate": 0.03,
+        "cornerRefinementMethod": 1,
+    },
+}
+
+TUNED_ATTRIBUTES = (
+    "adaptiveThreshWinSizeMin",
+    "adaptiveThreshWinSizeMax",
+    "adaptiveThreshWinSizeStep",
+    "minMarkerPerimeterRate",
+    "maxMarkerPerimeterRate",
+)
+
+
+def apply_preset(parameters, name):
+    for attribute, value in PRESETS[name].items():
+        if hasattr(parameters, attribute):
+            setattr(parameters, attribute, value)
+    return parameters
+
+
+# Smallest odd number of at least value
+def odd(value):
+    value = max(3, int(value))
+    return value if value % 2 else value + 1
+
+
+# Wraps a detect function and tunes the shared DetectorParameters object
+# in place from the marker sizes it returns. Every refresh_interval frames
+# one frame is searched with the full range, so markers of a new scale
+# are still found while others stay in view.
+class AdaptiveTuner:
+    def __init__(self, detect, parameters, window=15, miss_limit=3, refresh_interval=30, tune_max=True):
+        self.detect = detect
+        self.parameters = parameters
+        self.miss_limit = miss_limit
+        self.refresh_interval = refresh_interval
+        self.tune_max = tune_max
+        self.frames = 0
+
+        # Wide search the tuner returns to when markers are lost
+        self.base = {a: getattr(parameters, a) for a in TUNED_ATTRIBUTES}
+
+        # Perimeter rates and side lengths of recent markers
+        self.rates = deque(maxlen=window)
+        self.sides = deque(maxlen=window)
+        self.misses = 0
+        self.narrowed = False
+
+        # Statistics of the tuner
+        self.narrowings = 0
+        self.widenings = 0
+
+    def __call__(self, frame):
+        self.frames += 1
+        if self.narrowed and self.frames % self.refresh_interval == 0:
+            self.widen()
+
+        corners, ids, rejected = self.detect(frame)
+
+        if ids is None or len(ids) == 0:
+            self.misses += 1
+            if self.narrowed and self.misses >= self.miss_limit:
+                self.widen()
+            return corners, ids, rejected
+
+        self.misses = 0
+        longest = max(frame.shape[:2])
+        for c in corners:
+            c = c.reshape(4, 2)
+            sides = [float(((c[i] - c[(i + 1) % 4]) ** 2).sum() ** 0.5) for i in range(4)]
+            self.rates.append(sum(sides) / longest)
+            self.sides.append(min(sides))
+
+        self.narrow()
+        return corners, ids, rejected
+
+    # Restrict the search to the marker scales seen recently, with margin
+    # for markers growing or shrinking as the robot moves
+    def narrow(self):
+        p = self.parameters
+        p.minMarkerPerimeterRate = max(self.base["minMarkerPerimeterRate"], 0.6 * min(self.rates))
+        if self.tune_max:
+            p.maxMarkerPerimeterRate = min(self.base["maxMarkerPerimeterRate"], 1.6 * max(self.rates))
+
+        # A marker is 6 cells wide including its border, threshold windows
+        # around the cell size of the smallest and largest marker
+        smallest = min(self.sides) / 6
+        largest = max(self.sides) / 6
+        winMin = odd(min(max(self.base["adaptiveThreshWinSizeMin"], smallest / 2), self.base["adaptiveThreshWinSizeMax"]))
+        winMax = odd(min(max(winMin, largest), self.base["adaptiveThreshWinSizeMax"]))
+        p.adaptiveThreshWinSizeMin = winMin
+        p.adaptiveThreshWinSizeMax = winMax
+        p.adaptiveThreshWinSizeStep = max(winMax - winMin, 1)
+
+        if not self.narrowed:
+            self.narrowings += 1
+        self.narrowed = True
+
+    # Return to the full search range
+    def widen(self):
+        for attribute, value in self.base.items():
+            setattr(self.parameters, attribute, value)
+        self.rates.clear()
+        self.sides.clear()
+        self.narrowed = False
+        self.widenings += 1
+
+    def stats(self):
+        p = self.parameters
+        return {
+            "narrowed": self.narrowed,
+            "narrowings": self.narrowings,
+            "widenings": self.widenings,
+            "threshold_windows": [p.adaptiveThreshWinSizeMin, p.adaptiveThreshWinSizeMax, p.adaptiveThreshWinSizeStep],
+            "perimeter_rates": [p.minMarkerPerimeterRate, p.maxMarkerPerimeterRate],
+        }
@@ -0,0 +1,5 @@
+# The scripts in src/ import each other by bare module name
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
@@ -0,0 +1,132 @@
+# Gate pairing and the commands raspiaruco.py sends for a frame
+import argparse
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark import TESTING_DIR, find_images, process_frame
+from detection import add_detector_arguments, create_dictionary, create_parameters, create_detector
+from gates import LEFT, RIGHT, START, STOP, Detections, DetectionStore, ascii_command, frame_commands, pair_gates, select_gate
+
+
+# Corners of a square marker, top-left, top-right, bottom-right, bottom-left
+def square(x, y, side):
+    return [[x, y], [x + side, y], [x + side, y + side], [x, y + side]]
+
+
+def detections(*markers):
+    corners = [square(*m[1:]) for m in markers]
+    ids = [m[0] for m in markers]
+    return Detections(np.array(corners, dtype=np.float32), np.array(ids))
+
+
+def test_ascii_command_sections():
+    assert ascii_command(0, 1000) == "@"
+    assert ascii_command(500, 1000) == "L"
+    assert ascii_command(999, 1000) == "X"
+    assert ascii_command(0.5, 1.0) == "L"
+
+
+# Undistorted targets can lie outside the frame, they must still give one
+# of the 26 steering letters and never '?' or other control characters
+@pytest.mark.parametrize("x", [-2.56, -49.0, -1e6, 1048.0, 1e6])
+def test_ascii_command_clamps_to_frame(x):
+    command = ascii_command(x, 1000)
+    assert "@" <= command <= "Y"
+
+
+def test_detections_sorted_by_size():
+    d = detections((LEFT, 100, 100, 50), (RIGHT, 400, 100, 80))
+    assert d.ids.tolist() == [RIGHT, LEFT]
+    assert d.sizes[0] > d.sizes[1]
+
+
+def test_pair_gates_target_between_markers():
+    d = detections((LEFT, 100, 100, 80), (RIGHT, 400, 110, 60))
+    li, ri, targets, sizes = pair_gates(d)
+    assert len(li) == 1
+    assert d.ids[li[0]] == LEFT and d.ids[ri[0]] == RIGHT
+
+    # Top-right corner of the larger marker and bottom-left of the smaller
+    assert targets[0].tolist() == pytest.approx([(180 + 400) / 2, (100 + 170) / 2])
+
+
+def test_pair_gates_rejects_swapped_markers():
+    d = detections((RIGHT, 100, 100, 80), (LEFT, 400, 100, 80))
+    assert len(pair_gates(d)[0]) == 0
+    assert select_gate(d, 1000).command == "?"
+
+
+def test_pair_gates_rejects_mismatched_sizes():
+    d = detections((LEFT, 100, 100, 100), (RIGHT, 400, 100, 30))
+    assert len(pair_gates(d)[0]) == 0
+
+
+def test_pair_gates_prefers_closest_gate():
+    d = detections(
+        (LEFT, 100, 100, 40), (RIGHT, 200, 100, 40),
+        (LEFT, 400, 300, 120), (RIGHT, 800, 300, 120),
+    )
+    result = select_gate(d, 1000)
+    assert result.size == pytest.approx(d.sizes[0])
+    assert result.command == ascii_command(result.target[0], 1000)
+    assert result.target[0] > 500
+
+
+def test_select_gate_maps_target_to_frame():
+    d = detections((LEFT, 100, 100, 80), (RIGHT, 400, 100, 80))
+    result = select_gate(d, 1000, to_frame=lambda p: (p[0] + 5000, p[1]))
+    assert result.target[0] > 5000
+    assert result.command == "Y"
+
+
+@pytest.mark.parametrize("markers, commands", [
+    ([], ["-"]),
+    ([(STOP, 100, 100, 80)], ["!"]),
+    ([(STOP, 100, 100, 80), (START, 400, 100, 60)], ["!"]),
+    ([(START, 100, 100, 80), (STOP, 400, 100, 60)], ["&", "@"]),
+    ([(START, 100, 100, 80)], ["&"]),
+    ([(LEFT, 100, 100, 80)], []),
+    ([(LEFT, 400, 100, 80), (RIGHT, 100, 100, 80)], ["?"]),
+])
+def test_frame_commands(markers, commands):
+    assert frame_commands(detections(*markers), 1000)[0] == commands
+
+
+def test_frame_commands_start_then_gate():
+    d = detections((START, 500, 400, 120), (LEFT, 100, 100, 80), (RIGHT, 400, 100, 80))
+    commands, result = frame_commands(d, 1000)
+    assert commands == ["&", result.command]
+    assert result.target is not None
+
+
+def test_detection_store_matches_detections():
+    rng = np.random.default_rng(1)
+    store = DetectionStore(capacity=2)
+    for n in (0, 3, 20, 1):
+        corners = [rng.uniform(0, 500, (1, 4, 2)).astype(np.float32) for _ in range(n)]
+        ids = rng.integers(0, 4, (n, 1)).astype(np.int32) if n else None
+        expected = Detections.from_aruco(corners, ids)
+        store.fill(corners, ids)
+
+        assert len(store) == n
+        assert store.ids.tolist() == expected.ids.tolist()
+        assert np.allclose(store.corners, expected.corners)
+        assert np.allclose(store.sizes, expected.sizes)
+        assert np.allclose(store.centres, expected.centres)
+        assert frame_commands(store, 1000)[0] == frame_commands(expected, 1000)[0]
+
+
+# The bundled photos named after the letter the robot should be sent
+@pytest.mark.parametrize("filename", [f for f in find_images([os.path.join(TESTING_DIR, "*", "gate target *")])])
+def test_photo_gate_letter(filename):
+    parser = argparse.ArgumentParser()
+    add_detector_arguments(parser)
+    args = parser.parse_args([])
+    detect = create_detector(create_dictionary(), create_parameters(), args)
+
+    _, commands, _, _ = process_frame(cv2.imread(filename), detect, args)
+    letter = os.path.splitext(os.path.basename(filename))[0][-1]
+    assert commands[-1] == letter
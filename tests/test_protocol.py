@@ -0,0 +1,72 @@
+# Binary UART frames and their decoder
+import pytest
+
+from protocol import FRAME_SIZE, Frame, FrameDecoder, crc8, encode_frame, encode_pose_frame, with_sequence
+
+
+def test_crc8_check_value():
+    # CRC-8 with polynomial 0x07, no reflection and zero init
+    assert crc8(b"123456789") == 0xF4
+    assert crc8(b"") == 0
+
+
+def test_frame_round_trip():
+    frame = encode_frame("N", 513, 12.345, 0.25, 0.75, 140.4)
+    assert len(frame) == FRAME_SIZE == 16
+    assert frame[:2] == b"\xaa\x55"
+
+    decoded, = FrameDecoder().feed(frame)
+    assert decoded.command == "N"
+    assert decoded.seq == 513
+    assert decoded.timestamp == pytest.approx(12.345)
+    assert decoded.x == pytest.approx(0.25, abs=1e-4)
+    assert decoded.y == pytest.approx(0.75, abs=1e-4)
+    assert decoded.size == 140
+
+
+def test_frame_fields_wrap_and_clamp():
+    decoded, = FrameDecoder().feed(encode_frame("?", 70000, 0.0, -0.5, 1.5, 1e6))
+    assert decoded.seq == 70000 & 0xFFFF
+    assert (decoded.x, decoded.y, decoded.size) == (0.0, 1.0, 65535)
+
+
+def test_pose_frame_round_trip():
+    decoded, = FrameDecoder().feed(encode_pose_frame("J", 7, 1.5, -12.34, 2.5, 45.0))
+    assert decoded.command == "J"
+    assert decoded.bearing == pytest.approx(-12.34)
+    assert decoded.range == pytest.approx(2.5)
+    assert decoded.yaw == pytest.approx(45.0)
+
+
+def test_with_sequence_keeps_frame_valid():
+    frame = with_sequence(encode_frame("C", 0, 1.0, 0.5, 0.5, 10), 42)
+    decoded, = FrameDecoder().feed(frame)
+    assert decoded == Frame("C", 42, 1.0, decoded.x, decoded.y, 10)
+
+
+def test_decoder_byte_by_byte():
+    data = encode_frame("A", 1, 0.0) + encode_frame("B", 2, 0.0)
+    decoder = FrameDecoder()
+    frames = []
+    for i in range(len(data)):
+        frames += decoder.feed(data[i:i + 1])
+    assert [f.command for f in frames] == ["A", "B"]
+
+
+def test_decoder_resynchronises_after_noise():
+    good = encode_frame("T", 3, 0.0)
+    corrupt = bytearray(encode_frame("X", 2, 0.0))
+    corrupt[5] ^= 0xFF
+
+    decoder = FrameDecoder()
+    frames = decoder.feed(b"\x00\xaa\x13" + bytes(corrupt) + b"\xaa" + good)
+    assert [(f.command, f.seq) for f in frames] == [("T", 3)]
+    assert decoder.errors >= 1
+    assert decoder.frames == 1
+
+
+def test_decoder_keeps_partial_frame():
+    frame = encode_frame("K", 9, 0.0)
+    decoder = FrameDecoder()
+    assert decoder.feed(frame[:10]) == []
+    assert [f.command for f in decoder.feed(frame[10:])] == ["K"]
@@ -0,0 +1,73 @@
+# Flight recorder ring file written and read back
+import numpy as np
+
+from gates import Detections
+from recorder import FlightRecorder, Recording
+
+
+def detections(n):
+    corners = np.arange(n * 8, dtype=np.float32).reshape(n, 4, 2)
+    corners[:, 2] += 10
+    return Detections(corners, np.arange(n))
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "flight.rec")
+    recorder = FlightRecorder(path, slots=4, size=(100, 70))
+    frame = np.random.default_rng(0).integers(0, 255, (70, 100), dtype=np.uint8)
+    recorder.record(frame, 12.5, detections(2), ["&", "N"], 3.25)
+    recorder.close()
+
+    frames = list(Recording(path).frames())
+    assert len(frames) == 1
+    recorded = frames[0]
+    assert recorded.seq == 1
+    assert recorded.timestamp == 12.5
+    assert (recorded.width, recorded.height) == (100, 70)
+    assert recorded.detect_ms == 3.25
+    assert recorded.commands == ["&", "N"]
+    assert recorded.exact
+    assert np.array_equal(recorded.image, frame)
+    assert np.array_equal(recorded.ids, detections(2).ids)
+    assert np.array_equal(recorded.corners, detections(2).corners)
+
+
+def test_large_frames_are_downscaled(tmp_path):
+    path = str(tmp_path / "flight.rec")
+    recorder = FlightRecorder(path, slots=2, size=(50, 35))
+    recorder.record(np.zeros((70, 100, 3), np.uint8), 1.0, detections(0), ["-"])
+    recorder.close()
+
+    recorded, = Recording(path).frames()
+    assert not recorded.exact
+    assert recorded.image.shape == (35, 50)
+    assert (recorded.width, recorded.height) == (100, 70)
+
+
+def test_ring_keeps_newest_frames_oldest_first(tmp_path):
+    path = str(tmp_path / "flight.rec")
+    recorder = FlightRecorder(path, slots=3, size=(20, 10))
+    for i in range(7):
+        recorder.record(np.full((10, 20), i, np.uint8), float(i), detections(1), [chr(65 + i)])
+    recorder.close()
+
+    recording = Recording(path)
+    assert len(recording) == 3
+    frames = list(recording.frames())
+    assert [f.seq for f in frames] == [5, 6, 7]
+    assert [f.commands for f in frames] == [["E"], ["F"], ["G"]]
+    assert [int(f.image[0, 0]) for f in frames] == [4, 5, 6]
+
+
+# A frame that fails part way leaves its slot empty, not an old header
+# over a half-written image
+def test_slot_invalid_while_rewritten(tmp_path):
+    path = str(tmp_path / "flight.rec")
+    recorder = FlightRecorder(path, slots=1, size=(20, 10))
+    recorder.record(np.zeros((10, 20), np.uint8), 1.0, detections(1), ["A"])
+    try:
+        recorder.record(np.full((10, 20), 9, np.uint8), 2.0, None, ["B"])
+    except TypeError:
+        pass
+    recorder.close()
+    assert list(Recording(path).frames()) == []
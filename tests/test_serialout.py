@@ -0,0 +1,111 @@
+# Coalescing, ordering and sequence numbers of the UART output worker
+import threading
+import time
+
+from protocol import FrameDecoder, encode_frame
+from serialout import PacedPort, SerialWriter
+
+
+# Serial port stand-in whose writes can be held until released
+class FakePort:
+    def __init__(self, hold=False):
+        self.writes = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+        self.started.set()
+        self.release.wait(5.0)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def test_steering_commands_are_coalesced():
+    port = FakePort(hold=True)
+    writer = SerialWriter(port, min_interval=0.0)
+    writer.send("A")
+    assert port.started.wait(5.0)
+
+    # The worker is busy, only the newest steering command is kept
+    for command in "BCDE":
+        writer.send(command)
+    port.release.set()
+    writer.close()
+
+    assert port.writes == [b"A", b"E"]
+    assert writer.stats()["coalesced"] == 3
+
+
+def test_control_signals_are_kept_in_order():
+    port = FakePort(hold=True)
+    writer = SerialWriter(port, min_interval=0.0, max_queue=2)
+    writer.send("A")
+    assert port.started.wait(5.0)
+
+    for command in ["B", "&", "C", "!", "D", "@"]:
+        threading.Thread(target=writer.send, args=(command,)).start()
+        time.sleep(0.01)
+    port.release.set()
+    time.sleep(0.1)
+    writer.close()
+
+    controls = [w for w in port.writes if w in (b"&", b"!", b"@")]
+    assert controls == [b"&", b"!", b"@"]
+
+
+def test_repeats_are_suppressed():
+    port = FakePort()
+    writer = SerialWriter(port, min_interval=0.0, repeat_interval=10.0)
+    writer.send("A")
+    time.sleep(0.1)
+    writer.send("A")
+    writer.close()
+    assert port.writes == [b"A"]
+
+
+# A command equal to the previous write still goes out when a different
+# command is being written, or the robot is left with the stale one
+def test_repeat_of_earlier_command_after_newer_one():
+    port = FakePort()
+    writer = SerialWriter(port, min_interval=0.0, repeat_interval=10.0)
+    writer.send("A")
+    time.sleep(0.1)
+
+    port.release.clear()
+    port.started.clear()
+    writer.send("B")
+    assert port.started.wait(5.0)
+    writer.send("A")
+    port.release.set()
+    writer.close()
+    assert port.writes == [b"A", b"B", b"A"]
+
+
+def test_sequence_numbers_have_no_gaps():
+    port = FakePort(hold=True)
+    writer = SerialWriter(port, min_interval=0.0, sequence=True)
+    writer.send(encode_frame("A", 0, 1.0), control=False)
+    assert port.started.wait(5.0)
+
+    # Replaced frames do not use up a sequence number
+    for command in "BCD":
+        writer.send(encode_frame(command, 0, 1.0), control=False)
+    writer.send(encode_frame("!", 0, 1.0), control=True)
+    port.release.set()
+    writer.close()
+
+    frames = FrameDecoder().feed(b"".join(port.writes))
+    assert [(f.command, f.seq) for f in frames] == [("A", 0), ("D", 1), ("!", 2)]
+
+
+def test_paced_port_holds_flush_for_the_wire():
+    port = PacedPort(FakePort(), 9600)
+    start = time.monotonic()
+    port.write(b"x" * 48)
+    port.flush()
+    assert time.monotonic() - start >= 48 * 10 / 9600.0 * 0.9